@@ -0,0 +1,4 @@
+-- Motor de agenda: pausas configurables además del almuerzo
+
+alter table clinic_settings
+  add column if not exists breaks jsonb default '[]'::jsonb;
@@ -0,0 +1,104 @@
+-- Reserva atomica de turnos: valida paciente, limite diario y capacidad del
+-- horario e inserta en una sola llamada RPC (supabase.rpc("book_appointment")).
+-- Un advisory lock por clinica+fecha serializa reservas concurrentes del mismo dia.
+
+create index if not exists idx_appointments_clinic_date on appointments (clinic_id, date);
+
+create or replace function book_appointment(
+  p_clinic_id text,
+  p_patient_id uuid,
+  p_patient_name text,
+  p_patient_phone text,
+  p_date date,
+  p_start_time time,
+  p_end_time time,
+  p_treatment_id uuid,
+  p_buffer_minutes int default 0,
+  p_default_minutes int default 30,
+  p_max_per_slot int default 1,
+  p_max_per_day int default 20,
+  p_allow_overbooking boolean default false,
+  p_overbooking_fee numeric default 0,
+  p_confirmation_required boolean default true
+) returns jsonb
+language plpgsql
+as $$
+declare
+  v_patient_id uuid := p_patient_id;
+  v_start int := (extract(epoch from p_start_time) / 60)::int;
+  v_end int := (extract(epoch from p_end_time) / 60)::int;
+  v_day_count int;
+  v_overlap int;
+  v_overbooked boolean;
+  v_row appointments%rowtype;
+begin
+  perform pg_advisory_xact_lock(hashtext(p_clinic_id || ':' || p_date::text));
+
+  if v_patient_id is null then
+    select id into v_patient_id
+    from patients
+    where clinic_id = p_clinic_id and full_name = p_patient_name
+    limit 1;
+    if v_patient_id is null then
+      return jsonb_build_object('error', 'Paciente no registrado', 'code', 'patient_not_found');
+    end if;
+  end if;
+
+  select count(*) into v_day_count
+  from appointments
+  where clinic_id = p_clinic_id and date = p_date;
+  if v_day_count >= p_max_per_day then
+    return jsonb_build_object('error', 'Limite de turnos por dia alcanzado', 'code', 'daily_limit');
+  end if;
+
+  -- Ocupacion maxima dentro de [inicio, fin): se alcanza en el inicio pedido
+  -- o en el inicio (con buffer) de algun turno que cae dentro del rango.
+  with day as (
+    select
+      (extract(epoch from a.start_time) / 60)::int - p_buffer_minutes as lo,
+      coalesce(
+        (extract(epoch from a.end_time) / 60)::int,
+        (extract(epoch from a.start_time) / 60)::int + coalesce(t.duration_minutes, p_default_minutes)
+      ) + p_buffer_minutes as hi
+    from appointments a
+    left join treatments t on t.id = a.treatment_id
+    where a.clinic_id = p_clinic_id
+      and a.date = p_date
+      and coalesce(a.status, '') <> 'cancelled'
+  ),
+  points as (
+    select v_start as pt
+    union
+    select lo from day where lo > v_start and lo < v_end
+  )
+  select coalesce(max(c), 0) into v_overlap
+  from (
+    select (select count(*) from day where day.lo <= points.pt and day.hi > points.pt) as c
+    from points
+  ) counts;
+
+  if v_overlap >= p_max_per_slot then
+    return jsonb_build_object(
+      'error', 'Horario no disponible',
+      'code', 'slot_conflict',
+      'overlapping', v_overlap,
+      'capacity', p_max_per_slot
+    );
+  end if;
+
+  v_overbooked := p_allow_overbooking and v_overlap > 0;
+
+  insert into appointments (
+    clinic_id, patient_id, patient_name, patient_phone, date, start_time, end_time,
+    treatment_id, double_booked, overbooked, extra_fee, status, confirmation_required
+  ) values (
+    p_clinic_id, v_patient_id, p_patient_name, p_patient_phone, p_date, p_start_time, p_end_time,
+    p_treatment_id, v_overbooked, v_overbooked,
+    case when v_overbooked then p_overbooking_fee else 0 end,
+    'pending', p_confirmation_required
+  )
+  returning * into v_row;
+
+  return jsonb_build_object('success', true, 'appointment', to_jsonb(v_row));
+end;
+$$;
@@ -0,0 +1,43 @@
+-- Outbox de efectos secundarios de turnos (broadcast, automatizaciones,
+-- auditoria, eventos/alertas). Las rutas insertan una fila por efecto y
+-- responden; app/services/outbox.py las procesa en segundo plano, en lotes,
+-- con reintentos y backoff.
+
+create table if not exists outbox_events (
+  id uuid primary key default gen_random_uuid(),
+  clinic_id text,
+  kind text not null, -- broadcast | automations | audit | event | alerts (una clinica y un efecto por fila)
+  payload jsonb not null default '{}'::jsonb,
+  status text not null default 'pending', -- pending | done | failed
+  attempts int not null default 0,
+  available_at timestamptz not null default now(),
+  last_error text,
+  created_at timestamptz default now(),
+  processed_at timestamptz
+);
+
+create index if not exists idx_outbox_events_pending
+  on outbox_events (available_at)
+  where status = 'pending';
+
+-- Toma hasta p_limit eventos listos y los "alquila" por p_lease_seconds:
+-- si el proceso muere a mitad del lote, vuelven a estar disponibles al
+-- vencer el alquiler. SKIP LOCKED permite varios dispatchers en paralelo.
+create or replace function claim_outbox_events(
+  p_limit int default 100,
+  p_lease_seconds int default 60
+) returns setof outbox_events
+language sql
+as $$
+  update outbox_events o
+  set attempts = o.attempts + 1,
+      available_at = now() + make_interval(secs => p_lease_seconds)
+  where o.id in (
+    select id from outbox_events
+    where status = 'pending' and available_at <= now()
+    order by available_at
+    limit p_limit
+    for update skip locked
+  )
+  returning o.*;
+$$;
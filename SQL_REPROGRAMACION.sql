@@ -0,0 +1,19 @@
+-- Reprogramacion masiva al bloquear fechas/periodos: cola de avisos a
+-- pacientes (insertada en lotes por rebook_blocked_appointments).
+
+create table if not exists patient_notifications (
+  id uuid primary key default gen_random_uuid(),
+  clinic_id text not null,
+  appointment_id uuid references appointments(id) on delete cascade,
+  patient_id uuid,
+  patient_phone text,
+  kind text not null, -- reschedule | ...
+  body text not null,
+  status text not null default 'pending', -- pending | sent | failed
+  created_at timestamptz default now(),
+  sent_at timestamptz
+);
+
+create index if not exists idx_patient_notifications_pending
+  on patient_notifications (clinic_id, created_at)
+  where status = 'pending';
@@ -0,0 +1,18 @@
+-- Ruteo multi-clinica del webhook de WhatsApp: cada numero de la cuenta de
+-- Meta (metadata.phone_number_id del payload) pertenece a una clinica y
+-- envia con sus propias credenciales. El backend carga la tabla entera en
+-- un indice en memoria (app/services/whatsapp_accounts.py) y la recarga al
+-- cambiar por la API o al vencer WA_ACCOUNTS_CACHE_TTL.
+
+create table if not exists whatsapp_accounts (
+  id uuid primary key default gen_random_uuid(),
+  clinic_id text not null,
+  phone_number_id text not null unique,
+  display_phone_number text,
+  access_token text, -- null = WHATSAPP_TOKEN del backend
+  enabled boolean not null default true,
+  created_at timestamptz default now(),
+  updated_at timestamptz default now()
+);
+
+create index if not exists whatsapp_accounts_clinic_idx on whatsapp_accounts (clinic_id);
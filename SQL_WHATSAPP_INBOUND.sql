@@ -0,0 +1,18 @@
+-- Webhook de WhatsApp: id del mensaje de Meta (wamid) en messages, para
+-- aplicar los cambios de estado (sent/delivered/read/failed) que llegan en
+-- entregas de solo "statuses".
+
+alter table messages add column if not exists wa_message_id text;
+
+create index if not exists messages_wa_message_idx on messages (wa_message_id);
+
+-- Deduplicacion de reenvios de Meta: un wamid entra una sola vez
+-- (upsert on_conflict=wa_message_id, ignore_duplicates). Los salientes sin
+-- wamid quedan en null, que no choca.
+drop index if exists messages_wa_message_idx;
+create unique index if not exists messages_wa_message_uidx on messages (wa_message_id);
+
+-- Mensaje ya resuelto por la IA (respuesta enviada o ninguna que dar): un
+-- lote reintentado o un reenvio de Meta vuelve a la IA solo con los
+-- mensajes guardados que aun no se respondieron.
+alter table messages add column if not exists replied_at timestamptz;
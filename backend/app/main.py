@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -29,7 +30,20 @@ supabase: Client = create_client(
 # ===============================
 # FASTAPI APP
 # ===============================
-fastapi_app = FastAPI(title="AutoReplyPro Backend")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    # Background workers (imported here: they need the supabase client above)
+    from app.services.outbox import outbox_dispatcher
+    from app.services.whatsapp_inbound import webhook_queue
+
+    outbox_dispatcher.start()
+    webhook_queue.start()
+    yield
+    await webhook_queue.stop()
+    await outbox_dispatcher.stop()
+
+
+fastapi_app = FastAPI(title="AutoReplyPro Backend", lifespan=lifespan)
 fastapi_app.state.supabase = supabase
 
 fastapi_app.add_middleware(
@@ -54,6 +68,7 @@ from app.routers.calendar import router as calendar_router
 from app.routers.availability import router as availability_router
 from app.routers.clinic_settings import router as clinic_settings_router
 from app.routers.treatments import router as treatments_router
+from app.routers.resources import router as resources_router
 from app.routers.patients import router as patients_router
 from app.routers.roles import router as roles_router
 from app.routers.messages import router as messages_router
@@ -63,6 +78,7 @@ from app.routers.observability import router as observability_router
 from app.routers.playbooks import router as playbooks_router
 from app.routers.backups import router as backups_router
 from app.routers.alerts import router as alerts_router
+from app.routers.whatsapp_accounts import router as whatsapp_accounts_router
 from app.services.socket_server import sio
 
 fastapi_app.include_router(clinic_settings_router, prefix="/api", tags=["clinic-settings"])
@@ -71,6 +87,7 @@ fastapi_app.include_router(appointments_router, prefix="/api")
 fastapi_app.include_router(calendar_router, prefix="/api")
 fastapi_app.include_router(availability_router, prefix="/api")
 fastapi_app.include_router(treatments_router, prefix="/api")
+fastapi_app.include_router(resources_router, prefix="/api", tags=["resources"])
 fastapi_app.include_router(patients_router, prefix="/api", tags=["patients"])
 fastapi_app.include_router(roles_router, prefix="/api", tags=["roles"])
 fastapi_app.include_router(messages_router, prefix="/api", tags=["messages"])
@@ -80,6 +97,7 @@ fastapi_app.include_router(observability_router, prefix="/api", tags=["observabi
 fastapi_app.include_router(playbooks_router, prefix="/api", tags=["playbooks"])
 fastapi_app.include_router(backups_router, prefix="/api", tags=["backups"])
 fastapi_app.include_router(alerts_router, prefix="/api", tags=["alerts"])
+fastapi_app.include_router(whatsapp_accounts_router, prefix="/api", tags=["whatsapp-accounts"])
 
 # Wrap FastAPI with Socket.IO ASGI app
 app = socketio.ASGIApp(sio, other_asgi_app=fastapi_app)
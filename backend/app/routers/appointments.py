@@ -1,16 +1,23 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Header, HTTPException, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 from app.services.agenda_logic import (
     create_appointment,
     reschedule_appointment,
-    get_available_slots
+    reschedule_appointments,
+    get_available_slots,
+    record_appointment_change
 )
 from app.main import supabase
-from app.services.realtime import broadcast_change
-from app.services.automation_runner import run_automations_for_appointment
-from app.services.audit import log_audit
-from app.services.observability import log_event
+from app.services.availability import NOT_CANCELLED_FILTER
+from app.services.outbox import (
+    effect_audit,
+    effect_automations,
+    effect_broadcast,
+    effect_event,
+    record_effects,
+)
+from app.services.idempotency import IdempotencyConflict, appointment_idempotency
 
 router = APIRouter()
 
@@ -40,60 +47,114 @@ class AppointmentCancel(BaseModel):
     reason: str = None
 
 
+class AppointmentsBulk(BaseModel):
+    clinic_id: str
+    appointment_ids: List[str]
+
+
+class AppointmentsBulkCancel(AppointmentsBulk):
+    reason: Optional[str] = None
+
+
+class AppointmentMove(BaseModel):
+    appointment_id: str
+    new_date: str
+    new_time: str
+
+
+class AppointmentsBulkReschedule(BaseModel):
+    clinic_id: str
+    moves: List[AppointmentMove]
+
+
+MAX_BULK_APPOINTMENTS = 1000
+# ids por filtro in_() para no exceder el largo de URL de PostgREST
+BULK_ID_CHUNK = 200
+
+
 @router.post("/appointments")
-def create_appointment_route(data: AppointmentCreate):
-    """Crear un nuevo turno"""
+def create_appointment_route(
+    data: AppointmentCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+):
+    """
+    Crear un nuevo turno.
+
+    Con Idempotency-Key, un reintento con la misma clave devuelve el resultado
+    original sin volver a validar, insertar ni disparar efectos secundarios.
+    """
     try:
-        result = create_appointment(
-            clinic_id=data.clinic_id,
-            patient_id=data.patient_id,
-            patient_name=data.patient_name,
-            patient_phone=data.patient_phone,
-            date=data.date,
-            start_time=data.start_time,
-            treatment_id=data.treatment_id,
-            allow_double_booking=data.allow_double_booking
+        if not idempotency_key:
+            return _create_appointment(data)
+        result, replayed = appointment_idempotency.run(
+            ("api", data.clinic_id, idempotency_key),
+            data.dict(),
+            lambda: _create_appointment(data),
         )
-        if result and isinstance(result, dict):
-            appointment = result.get("appointment") or result
-            if isinstance(appointment, dict):
-                broadcast_change(
-                    data.clinic_id,
-                    "appointment_created",
-                    {
-                        "appointment_id": appointment.get("id"),
-                        "date": appointment.get("date"),
-                        "start_time": appointment.get("start_time"),
-                    },
-                )
-                run_automations_for_appointment("appointment_created", appointment)
-                log_audit(
-                    data.clinic_id,
-                    "create_appointment",
-                    "appointments",
-                    appointment.get("id", ""),
-                    {
-                        "date": appointment.get("date"),
-                        "start_time": appointment.get("start_time"),
-                        "treatment_id": appointment.get("treatment_id"),
-                        "patient_id": appointment.get("patient_id"),
-                    },
-                )
-                log_event(
-                    "appointment_created",
-                    {
-                        "appointment_id": appointment.get("id"),
-                        "date": appointment.get("date"),
-                        "start_time": appointment.get("start_time"),
-                        "treatment_id": appointment.get("treatment_id"),
-                    },
-                    clinic_id=data.clinic_id,
-                )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
         return result
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _create_appointment(data: AppointmentCreate):
+    result = create_appointment(
+        clinic_id=data.clinic_id,
+        patient_id=data.patient_id,
+        patient_name=data.patient_name,
+        patient_phone=data.patient_phone,
+        date=data.date,
+        start_time=data.start_time,
+        treatment_id=data.treatment_id,
+        allow_double_booking=data.allow_double_booking
+    )
+    if result and isinstance(result, dict) and not result.get("error"):
+        appointment = result.get("appointment") or result
+        if isinstance(appointment, dict):
+            record_effects(
+                data.clinic_id,
+                [
+                    effect_broadcast(
+                        "appointment_created",
+                        {
+                            "appointment_id": appointment.get("id"),
+                            "date": appointment.get("date"),
+                            "start_time": appointment.get("start_time"),
+                        },
+                    ),
+                    effect_automations("appointment_created", [appointment]),
+                    effect_audit(
+                        data.clinic_id,
+                        "create_appointment",
+                        "appointments",
+                        [(
+                            appointment.get("id", ""),
+                            {
+                                "date": appointment.get("date"),
+                                "start_time": appointment.get("start_time"),
+                                "treatment_id": appointment.get("treatment_id"),
+                                "patient_id": appointment.get("patient_id"),
+                            },
+                        )],
+                    ),
+                    effect_event(
+                        "appointment_created",
+                        {
+                            "appointment_id": appointment.get("id"),
+                            "date": appointment.get("date"),
+                            "start_time": appointment.get("start_time"),
+                            "treatment_id": appointment.get("treatment_id"),
+                        },
+                    ),
+                ],
+            )
+    return result
+
+
 @router.patch("/appointments/{appointment_id}/reschedule")
 def reschedule_appointment_route(
     appointment_id: str,
@@ -106,33 +167,30 @@ def reschedule_appointment_route(
             new_date=data.new_date,
             new_time=data.new_time
         )
-        if result and isinstance(result, dict):
+        if result and isinstance(result, dict) and not result.get("error"):
             appointment = result.get("appointment") or result
             if isinstance(appointment, dict):
-                log_audit(
-                    appointment.get("clinic_id", ""),
-                    "reschedule_appointment",
-                    "appointments",
-                    appointment_id,
-                    {"date": appointment.get("date"), "start_time": appointment.get("start_time")},
-                )
-                log_event(
-                    "appointment_rescheduled",
-                    {
-                        "appointment_id": appointment_id,
-                        "date": appointment.get("date"),
-                        "start_time": appointment.get("start_time"),
-                    },
-                    clinic_id=appointment.get("clinic_id", ""),
-                )
-                broadcast_change(
-                    appointment.get("clinic_id", ""),
-                    "appointment_rescheduled",
-                    {
-                        "appointment_id": appointment_id,
-                        "date": appointment.get("date"),
-                        "start_time": appointment.get("start_time"),
-                    },
+                clinic_id = appointment.get("clinic_id", "")
+                moved = {
+                    "appointment_id": appointment_id,
+                    "date": appointment.get("date"),
+                    "start_time": appointment.get("start_time"),
+                }
+                record_effects(
+                    clinic_id,
+                    [
+                        effect_audit(
+                            clinic_id,
+                            "reschedule_appointment",
+                            "appointments",
+                            [(
+                                appointment_id,
+                                {"date": appointment.get("date"), "start_time": appointment.get("start_time")},
+                            )],
+                        ),
+                        effect_event("appointment_rescheduled", moved),
+                        effect_broadcast("appointment_rescheduled", moved),
+                    ],
                 )
         return result
     except Exception as e:
@@ -149,24 +207,21 @@ def confirm_appointment_route(appointment_id: str):
             .execute()
         
         if result.data:
-            log_audit(
-                result.data[0].get("clinic_id", ""),
-                "confirm_appointment",
-                "appointments",
-                appointment_id,
-                {"status": "confirmed"},
-            )
-            log_event(
-                "appointment_confirmed",
-                {"appointment_id": appointment_id},
-                clinic_id=result.data[0].get("clinic_id", ""),
+            clinic_id = result.data[0].get("clinic_id", "")
+            record_effects(
+                clinic_id,
+                [
+                    effect_audit(
+                        clinic_id,
+                        "confirm_appointment",
+                        "appointments",
+                        [(appointment_id, {"status": "confirmed"})],
+                    ),
+                    effect_event("appointment_confirmed", {"appointment_id": appointment_id}),
+                    effect_broadcast("appointment_confirmed", {"appointment_id": appointment_id}),
+                    effect_automations("appointment_confirmed", [result.data[0]]),
+                ],
             )
-            broadcast_change(
-                result.data[0].get("clinic_id", ""),
-                "appointment_confirmed",
-                {"appointment_id": appointment_id},
-            )
-            run_automations_for_appointment("appointment_confirmed", result.data[0])
             return {"success": True, "appointment": result.data[0]}
         
         return {"error": "Turno no encontrado"}
@@ -187,24 +242,22 @@ def cancel_appointment_route(appointment_id: str, reason: str = None):
             .execute()
         
         if result.data:
-            log_audit(
-                result.data[0].get("clinic_id", ""),
-                "cancel_appointment",
-                "appointments",
-                appointment_id,
-                {"status": "cancelled", "reason": reason},
-            )
-            log_event(
-                "appointment_cancelled",
-                {"appointment_id": appointment_id},
-                clinic_id=result.data[0].get("clinic_id", ""),
+            record_appointment_change(result.data[0])
+            clinic_id = result.data[0].get("clinic_id", "")
+            record_effects(
+                clinic_id,
+                [
+                    effect_audit(
+                        clinic_id,
+                        "cancel_appointment",
+                        "appointments",
+                        [(appointment_id, {"status": "cancelled", "reason": reason})],
+                    ),
+                    effect_event("appointment_cancelled", {"appointment_id": appointment_id}),
+                    effect_broadcast("appointment_cancelled", {"appointment_id": appointment_id}),
+                    effect_automations("appointment_cancelled", [result.data[0]]),
+                ],
             )
-            broadcast_change(
-                result.data[0].get("clinic_id", ""),
-                "appointment_cancelled",
-                {"appointment_id": appointment_id},
-            )
-            run_automations_for_appointment("appointment_cancelled", result.data[0])
             return {"success": True, "message": "Turno cancelado"}
         
         return {"error": "Turno no encontrado"}
@@ -212,6 +265,147 @@ def cancel_appointment_route(appointment_id: str, reason: str = None):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _check_bulk_size(count: int) -> None:
+    if count > MAX_BULK_APPOINTMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximo {MAX_BULK_APPOINTMENTS} turnos por operacion",
+        )
+
+
+def _bulk_update(clinic_id: str, appointment_ids: List[str], update: dict) -> List[dict]:
+    """
+    Actualiza los turnos no cancelados de la clínica (un cancelado no vuelve
+    a confirmarse ni se cancela dos veces) y mantiene el inventario de slots.
+    """
+    ids = list(dict.fromkeys(appointment_ids))
+    rows: List[dict] = []
+    for i in range(0, len(ids), BULK_ID_CHUNK):
+        result = supabase.table("appointments") \
+            .update(update) \
+            .eq("clinic_id", clinic_id) \
+            .in_("id", ids[i:i + BULK_ID_CHUNK]) \
+            .or_(NOT_CANCELLED_FILTER) \
+            .execute()
+        rows.extend(result.data or [])
+    for row in rows:
+        record_appointment_change(row)
+    return rows
+
+
+def _bulk_side_effects(
+    clinic_id: str,
+    action: str,
+    event: str,
+    rows: List[dict],
+    changes: Optional[dict] = None,
+    run_automations: bool = True,
+) -> None:
+    """
+    Efectos de una operación masiva: un insert de auditoría, un evento (las
+    alertas se disparan una vez), un broadcast y automatizaciones en lote,
+    registrados en el outbox con un solo insert.
+    Sin changes se audita la nueva fecha/hora de cada turno.
+    """
+    ids = [row.get("id") for row in rows]
+    entries = [
+        (row.get("id", ""), changes or {"date": row.get("date"), "start_time": row.get("start_time")})
+        for row in rows
+    ]
+    effects = [
+        effect_audit(clinic_id, action, "appointments", entries),
+        effect_event(event, {"appointment_ids": ids, "count": len(ids)}),
+        effect_broadcast(event, {"appointment_ids": ids, "count": len(ids)}),
+    ]
+    if run_automations:
+        effects.append(effect_automations(event, rows))
+    record_effects(clinic_id, effects)
+
+
+@router.post("/appointments/bulk/confirm")
+def bulk_confirm_appointments_route(data: AppointmentsBulk):
+    """Confirmar varios turnos en una sola operación"""
+    try:
+        _check_bulk_size(len(data.appointment_ids))
+        rows = _bulk_update(data.clinic_id, data.appointment_ids, {"status": "confirmed"})
+        if rows:
+            _bulk_side_effects(
+                data.clinic_id, "confirm_appointment", "appointment_confirmed", rows, {"status": "confirmed"}
+            )
+        found = {row.get("id") for row in rows}
+        return {
+            "success": True,
+            "confirmed": len(rows),
+            "not_found": [i for i in data.appointment_ids if i not in found],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/appointments/bulk/cancel")
+def bulk_cancel_appointments_route(data: AppointmentsBulkCancel):
+    """Cancelar varios turnos en una sola operación"""
+    try:
+        _check_bulk_size(len(data.appointment_ids))
+        rows = _bulk_update(
+            data.clinic_id,
+            data.appointment_ids,
+            {"status": "cancelled", "cancellation_reason": data.reason},
+        )
+        if rows:
+            _bulk_side_effects(
+                data.clinic_id,
+                "cancel_appointment",
+                "appointment_cancelled",
+                rows,
+                {"status": "cancelled", "reason": data.reason},
+            )
+        found = {row.get("id") for row in rows}
+        return {
+            "success": True,
+            "cancelled": len(rows),
+            "not_found": [i for i in data.appointment_ids if i not in found],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/appointments/bulk/reschedule")
+def bulk_reschedule_appointments_route(data: AppointmentsBulkReschedule):
+    """Reagendar varios turnos; cada movimiento se valida contra los anteriores del lote"""
+    try:
+        _check_bulk_size(len(data.moves))
+        result = reschedule_appointments(data.clinic_id, [move.dict() for move in data.moves])
+        if result.get("error"):
+            return result
+        rows = result["rescheduled"]
+        if rows:
+            # Como el reagendado individual, no dispara automatizaciones
+            _bulk_side_effects(
+                data.clinic_id,
+                "reschedule_appointment",
+                "appointment_rescheduled",
+                rows,
+                run_automations=False,
+            )
+        return {
+            "success": True,
+            "rescheduled": [
+                {"appointment_id": row["id"], "date": row["date"], "start_time": row["start_time"]}
+                for row in rows
+            ],
+            "failed": result["failed"],
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/appointments")
 def list_appointments(clinic_id: str, date: str = None, status: str = None):
     """Listar turnos de una clínica"""
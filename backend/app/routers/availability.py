@@ -1,12 +1,41 @@
+from datetime import date
 from fastapi import APIRouter, HTTPException, Query
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel, Field
 from app.services.agenda_logic import (
+    availability_flight,
+    find_next_available,
+    get_availability_matrix,
     get_available_slots,
     get_available_dates_for_clinic,
-    get_clinic_settings
+    get_clinic_settings,
+    slot_inventory,
+    InvalidSearch,
 )
+from app.services.capacity_simulator import run_capacity_simulation
 
 router = APIRouter()
 
+MAX_MATRIX_DAYS = 62
+MAX_MATRIX_TREATMENTS = 50
+MAX_SIMULATION_CONFIGS = 50
+
+
+class AvailabilityMatrixRequest(BaseModel):
+    clinic_id: str
+    treatment_ids: List[str] = Field(default_factory=list)
+    start_date: str  # YYYY-MM-DD
+    end_date: str    # YYYY-MM-DD
+    allow_double: bool = False
+
+
+class CapacitySimulationRequest(BaseModel):
+    clinic_id: str
+    configs: List[Dict[str, Any]] = Field(default_factory=list)  # overrides de ClinicSettings
+    start_date: Optional[str] = None  # YYYY-MM-DD, default: hace 365 días
+    end_date: Optional[str] = None    # YYYY-MM-DD, default: ayer
+
+
 @router.get("/availability/slots")
 def availability_slots(
     clinic_id: str = Query(...),
@@ -20,11 +49,14 @@ def availability_slots(
     allow_double: Si True, permite double booking (2 turnos en mismo horario)
     """
     try:
-        slots = get_available_slots(
-            clinic_id=clinic_id,
-            date=date,
-            treatment_id=treatment_id,
-            allow_double_booking=allow_double
+        slots = availability_flight.do(
+            ("slots", clinic_id, date, treatment_id, allow_double),
+            lambda: get_available_slots(
+                clinic_id=clinic_id,
+                date=date,
+                treatment_id=treatment_id,
+                allow_double_booking=allow_double
+            ),
         )
         return {
             "date": date,
@@ -45,10 +77,13 @@ def availability_dates(
     Devuelve próximas N fechas disponibles con cantidad de slots.
     """
     try:
-        dates = get_available_dates_for_clinic(
-            clinic_id=clinic_id,
-            treatment_id=treatment_id,
-            days_ahead=days_ahead
+        dates = availability_flight.do(
+            ("dates", clinic_id, treatment_id, days_ahead),
+            lambda: get_available_dates_for_clinic(
+                clinic_id=clinic_id,
+                treatment_id=treatment_id,
+                days_ahead=days_ahead
+            ),
         )
         
         available_only = [d for d in dates if d["available"]]
@@ -63,6 +98,82 @@ def availability_dates(
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 
+@router.post("/availability/matrix")
+def availability_matrix(payload: AvailabilityMatrixRequest):
+    """
+    Matriz de slots para varios tratamientos y un rango de fechas en una sola llamada.
+    """
+    try:
+        start = date.fromisoformat(payload.start_date)
+        end = date.fromisoformat(payload.end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Fechas inválidas, usar YYYY-MM-DD")
+    if end < start or (end - start).days >= MAX_MATRIX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Rango inválido (máximo {MAX_MATRIX_DAYS} días)")
+    treatment_ids = list(dict.fromkeys(payload.treatment_ids))
+    if not treatment_ids or len(treatment_ids) > MAX_MATRIX_TREATMENTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Indicar entre 1 y {MAX_MATRIX_TREATMENTS} tratamientos",
+        )
+
+    try:
+        matrix = availability_flight.do(
+            (
+                "matrix",
+                payload.clinic_id,
+                tuple(treatment_ids),
+                payload.start_date,
+                payload.end_date,
+                payload.allow_double,
+            ),
+            lambda: get_availability_matrix(
+                clinic_id=payload.clinic_id,
+                treatment_ids=treatment_ids,
+                start_date=payload.start_date,
+                end_date=payload.end_date,
+                allow_double_booking=payload.allow_double
+            ),
+        )
+        return {"clinic_id": payload.clinic_id, **matrix}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generando matriz: {str(e)}")
+
+
+@router.get("/availability/next")
+def availability_next(
+    clinic_id: str = Query(...),
+    treatment_id: str = Query(...),
+    after: Optional[str] = Query(None, description="YYYY-MM-DD o YYYY-MM-DDTHH:MM"),
+    limit: int = Query(5, ge=1, le=50),
+    preference: Optional[str] = Query(None, description="morning | afternoon | HH:MM-HH:MM")
+):
+    """
+    Próximos N horarios libres desde una fecha, con preferencia horaria opcional.
+    """
+    try:
+        slots = availability_flight.do(
+            ("next", clinic_id, treatment_id, after, limit, preference),
+            lambda: find_next_available(
+                clinic_id=clinic_id,
+                treatment_id=treatment_id,
+                after=after,
+                limit=limit,
+                preference=preference
+            ),
+        )
+        return {
+            "clinic_id": clinic_id,
+            "treatment_id": treatment_id,
+            "slots": slots,
+            "total": len(slots)
+        }
+    except InvalidSearch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
 @router.get("/availability/summary")
 def availability_summary(clinic_id: str = Query(...)):
     """
@@ -94,3 +205,47 @@ def availability_summary(clinic_id: str = Query(...)):
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@router.post("/availability/inventory/rebuild")
+def availability_inventory_rebuild(clinic_id: str = Query(...)):
+    """
+    Reconstruye desde la base el inventario precalculado de slots de una clínica.
+    """
+    try:
+        settings = get_clinic_settings(clinic_id)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Clínica no encontrada")
+        return slot_inventory.rebuild(clinic_id, settings)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+
+@router.post("/availability/simulate")
+def availability_simulate(payload: CapacitySimulationRequest):
+    """
+    Simulación what-if: reproduce la demanda histórica contra la configuración
+    actual y cada candidata (utilización, rechazos, recargos por sobreturno).
+    """
+    if len(payload.configs) > MAX_SIMULATION_CONFIGS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_SIMULATION_CONFIGS} configuraciones")
+    try:
+        # El rango (tope MAX_SIMULATION_DAYS) se valida ya resuelto en run_capacity_simulation
+        settings = get_clinic_settings(payload.clinic_id)
+        if not settings:
+            raise HTTPException(status_code=404, detail="Clínica no encontrada")
+        return run_capacity_simulation(
+            payload.clinic_id,
+            settings,
+            payload.configs,
+            start_date=payload.start_date,
+            end_date=payload.end_date,
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from app.main import supabase
+from app.services.availability import NOT_CANCELLED_FILTER
 
 router = APIRouter(prefix="/calendar")
 
@@ -11,7 +12,7 @@ def get_calendar_day(clinic_id: str, date: str):
             .select("id,date,start_time,patient_name,treatment_id,status,double_booked")
             .eq("clinic_id", clinic_id)
             .eq("date", date)
-            .neq("status", "cancelled")
+            .or_(NOT_CANCELLED_FILTER)
             .order("start_time")
             .execute()
         )
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Request, HTTPException
 from postgrest.exceptions import APIError
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Sequence
 from datetime import datetime, date
 from app.services.audit import log_audit
+from app.services.agenda_logic import invalidate_clinic_settings, rebook_blocked_appointments
+from app.services.outbox import effect_audit, effect_broadcast, effect_event, record_effects
 
 router = APIRouter()
 
@@ -11,6 +13,50 @@ def supabase(req: Request):
     return req.app.state.supabase
 
 
+def _rebook(
+    clinic_id: str,
+    dates: Sequence[str] = (),
+    periods: Sequence[Dict] = (),
+    apply: bool = True,
+    notify: bool = True,
+) -> Dict:
+    """
+    Reprograma los turnos de días bloqueados y, si se aplicó, registra en el
+    outbox los mismos efectos que un reagendado: auditoría por turno (más un
+    resumen), evento y broadcast appointment_rescheduled. Como el reagendado
+    individual, no dispara automatizaciones; los avisos quedan en
+    patient_notifications.
+    """
+    result = rebook_blocked_appointments(clinic_id, dates=dates, periods=periods, apply=apply, notify=notify)
+    if not result.get("applied"):
+        return result
+    moved = result["rebooked"]
+    ids = [m["appointment_id"] for m in moved]
+    record_effects(
+        clinic_id,
+        [
+            effect_audit(
+                clinic_id,
+                "reschedule_appointment",
+                "appointments",
+                [
+                    (m["appointment_id"], {**m["to"], "from": m["from"], "reason": "blocked_dates"})
+                    for m in moved
+                ],
+            ),
+            effect_audit(
+                clinic_id,
+                "rebook_blocked_appointments",
+                "appointments",
+                [(clinic_id, {"rebooked": len(moved), "unplaced": len(result["unplaced"])})],
+            ),
+            effect_event("appointment_rescheduled", {"appointment_ids": ids, "count": len(ids)}),
+            effect_broadcast("appointment_rescheduled", {"appointment_ids": ids, "count": len(ids)}),
+        ],
+    )
+    return result
+
+
 # =========================
 # MODELOS DE CONFIGURACIÓN
 # =========================
@@ -21,6 +67,19 @@ class BlockedPeriod(BaseModel):
     reason: Optional[str] = None  # "Vacaciones", "Mantenimiento", etc.
 
 
+class BlockedImpactRequest(BaseModel):
+    dates: List[str] = Field(default=[])
+    periods: List[BlockedPeriod] = Field(default=[])
+    apply: bool = False   # aplicar las reprogramaciones
+    notify: bool = True   # encolar avisos a pacientes (solo si apply)
+
+
+class BreakWindow(BaseModel):
+    start: str  # "16:00"
+    end: str    # "16:30"
+    reason: Optional[str] = None
+
+
 class ClinicSettings(BaseModel):
     # Básico
     name: Optional[str] = "Mi Clínica"
@@ -32,6 +91,7 @@ class ClinicSettings(BaseModel):
     close_time: str = "18:00"
     lunch_start: Optional[str] = None  # "12:00"
     lunch_end: Optional[str] = None    # "13:00"
+    breaks: List[BreakWindow] = Field(default=[])  # Pausas extra además del almuerzo
     
     # Calendario
     work_days: List[int] = Field(default=[0, 1, 2, 3, 4])  # [0=Lun, 1=Mar, ..., 4=Vie]
@@ -43,6 +103,7 @@ class ClinicSettings(BaseModel):
     max_appointments_per_day: int = 20
     buffer_between_appointments: int = 0  # minutos de buffer
     max_appointments_per_slot: int = 2
+    resource_scheduling: bool = False  # capacidad por profesional/sillón (tabla resources)
     overbooking_extra_fee: float = 0
     overbooking_fee_type: str = "fixed"  # fixed | percent
     
@@ -93,6 +154,7 @@ def get_settings(clinic_id: str, req: Request):
 
         if not ins.data:
             raise HTTPException(status_code=500, detail="Error creando settings")
+        invalidate_clinic_settings(clinic_id)
         return ins.data[0]
 
     return res.data
@@ -116,6 +178,7 @@ def update_settings(
 
     if not res.data:
         raise HTTPException(status_code=500, detail="No se pudo actualizar")
+    invalidate_clinic_settings(clinic_id)
 
     log_audit(
         clinic_id,
@@ -135,9 +198,10 @@ def update_settings(
 def add_blocked_dates(
     clinic_id: str,
     payload: dict,  # {"dates": ["2026-01-31", "2026-02-01"]}
-    req: Request
+    req: Request,
+    rebook: bool = False,
 ):
-    """Agregar fechas específicas bloqueadas"""
+    """Agregar fechas específicas bloqueadas (rebook=true reprograma los turnos afectados)"""
     sb = supabase(req)
     
     settings = sb.table("clinic_settings") \
@@ -156,6 +220,7 @@ def add_blocked_dates(
         .update({"blocked_dates": merged}) \
         .eq("clinic_id", clinic_id) \
         .execute()
+    invalidate_clinic_settings(clinic_id)
     log_audit(
         clinic_id,
         "add_blocked_dates",
@@ -164,6 +229,11 @@ def add_blocked_dates(
         {"blocked_dates": new_dates},
     )
     
+    if rebook:
+        return {
+            "blocked_dates": merged,
+            "rebooking": _rebook(clinic_id, dates=new_dates),
+        }
     return {"blocked_dates": merged}
 
 
@@ -189,6 +259,7 @@ def remove_blocked_date(
         .update({"blocked_dates": updated}) \
         .eq("clinic_id", clinic_id) \
         .execute()
+    invalidate_clinic_settings(clinic_id)
     log_audit(
         clinic_id,
         "remove_blocked_date",
@@ -204,9 +275,10 @@ def remove_blocked_date(
 def add_blocked_period(
     clinic_id: str,
     payload: BlockedPeriod,
-    req: Request
+    req: Request,
+    rebook: bool = False,
 ):
-    """Agregar período bloqueado (ej: vacaciones)"""
+    """Agregar período bloqueado (ej: vacaciones); rebook=true reprograma los turnos afectados"""
     sb = supabase(req)
     
     settings = sb.table("clinic_settings") \
@@ -222,6 +294,7 @@ def add_blocked_period(
         .update({"blocked_periods": current_periods}) \
         .eq("clinic_id", clinic_id) \
         .execute()
+    invalidate_clinic_settings(clinic_id)
     log_audit(
         clinic_id,
         "add_blocked_period",
@@ -230,6 +303,11 @@ def add_blocked_period(
         payload.dict(),
     )
     
+    if rebook:
+        return {
+            "blocked_periods": current_periods,
+            "rebooking": _rebook(clinic_id, periods=[payload.dict()]),
+        }
     return {"blocked_periods": current_periods}
 
 
@@ -255,6 +333,7 @@ def remove_blocked_period(
         .update({"blocked_periods": updated}) \
         .eq("clinic_id", clinic_id) \
         .execute()
+    invalidate_clinic_settings(clinic_id)
     log_audit(
         clinic_id,
         "remove_blocked_period",
@@ -266,6 +345,27 @@ def remove_blocked_period(
     return {"blocked_periods": updated}
 
 
+@router.post("/clinic-settings/{clinic_id}/blocked-impact")
+def blocked_impact(clinic_id: str, payload: BlockedImpactRequest):
+    """
+    Turnos afectados por bloquear fechas/períodos y su reprogramación
+    propuesta; con apply=true la aplica en lote y encola avisos.
+    """
+    try:
+        result = _rebook(
+            clinic_id,
+            dates=payload.dates,
+            periods=[p.dict() for p in payload.periods],
+            apply=payload.apply,
+            notify=payload.notify,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if result.get("error"):
+        raise HTTPException(status_code=404, detail=result["error"])
+    return result
+
+
 @router.get("/clinic-settings/{clinic_id}/blocked-dates")
 def get_blocked_dates(clinic_id: str, req: Request):
     """Obtener todas las fechas y períodos bloqueados"""
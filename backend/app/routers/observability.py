@@ -1,6 +1,11 @@
 from fastapi import APIRouter, HTTPException
 from typing import Optional
 from app.main import supabase
+from app.services.agenda_logic import slot_inventory
+from app.services.cache import cache_stats
+from app.services.outbox import outbox_dispatcher
+from app.services.whatsapp_inbound import webhook_queue
+from app.services.single_flight import single_flight_stats
 
 router = APIRouter()
 
@@ -8,7 +13,14 @@ router = APIRouter()
 @router.get("/metrics")
 def basic_metrics():
     # Minimal metrics endpoint (extend with real aggregation)
-    return {"ok": True}
+    return {
+        "ok": True,
+        "caches": cache_stats(),
+        "slot_inventory": slot_inventory.stats(),
+        "single_flight": single_flight_stats(),
+        "outbox": outbox_dispatcher.stats(),
+        "webhook_queue": webhook_queue.stats(),
+    }
 
 
 @router.post("/events")
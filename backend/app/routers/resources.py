@@ -0,0 +1,165 @@
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from app.main import supabase
+from app.services.agenda_logic import get_clinic_settings, slot_inventory
+from app.services.resources import get_resource_catalog, invalidate_resource_catalog, resource_hours_error
+
+router = APIRouter()
+
+# =========================
+# Pydantic Schemas
+# =========================
+
+class ResourceCreate(BaseModel):
+    clinic_id: str
+    name: str
+    kind: str = "dentist"  # dentist | chair | ...
+    # Solo acotan los de la clínica (subconjunto / dentro del horario); None = los de la clínica
+    work_days: Optional[List[int]] = None
+    open_time: Optional[str] = None
+    close_time: Optional[str] = None
+    enabled: bool = True
+
+class ResourceUpdate(BaseModel):
+    name: Optional[str] = None
+    kind: Optional[str] = None
+    work_days: Optional[List[int]] = None
+    open_time: Optional[str] = None
+    close_time: Optional[str] = None
+    enabled: Optional[bool] = None
+
+class TreatmentResources(BaseModel):
+    clinic_id: str
+    resource_ids: List[str] = Field(default=[])  # vacío = cualquier recurso
+
+
+def _check_hours(clinic_id: str, work_days, open_time, close_time) -> None:
+    error = resource_hours_error(get_clinic_settings(clinic_id), work_days, open_time, close_time)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+
+
+def _invalidate(clinic_id: str) -> None:
+    invalidate_resource_catalog(clinic_id)
+    slot_inventory.invalidate(clinic_id)
+
+# =========================
+# RESOURCES
+# =========================
+
+@router.get("/resources")
+def list_resources(clinic_id: str):
+    try:
+        catalog = get_resource_catalog(clinic_id)
+        return {"resources": catalog.resources, "eligibility": catalog.eligible}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/resources")
+def create_resource(payload: ResourceCreate):
+    try:
+        _check_hours(payload.clinic_id, payload.work_days, payload.open_time, payload.close_time)
+        result = supabase.table("resources").insert(payload.dict()).execute()
+        if not result.data:
+            raise HTTPException(status_code=400, detail="Error creating resource")
+        _invalidate(payload.clinic_id)
+        return result.data[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.put("/resources/{resource_id}")
+def update_resource(resource_id: str, clinic_id: str, payload: ResourceUpdate):
+    try:
+        changes = {k: v for k, v in payload.dict().items() if v is not None}
+        if not changes:
+            raise HTTPException(status_code=400, detail="Sin cambios")
+        if {"work_days", "open_time", "close_time"} & changes.keys():
+            current = (
+                supabase.table("resources")
+                .select("work_days,open_time,close_time")
+                .eq("id", resource_id)
+                .eq("clinic_id", clinic_id)
+                .execute()
+            ).data or [{}]
+            merged = {**current[0], **changes}
+            _check_hours(clinic_id, merged.get("work_days"), merged.get("open_time"), merged.get("close_time"))
+        result = (
+            supabase.table("resources")
+            .update(changes)
+            .eq("id", resource_id)
+            .eq("clinic_id", clinic_id)
+            .execute()
+        )
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Recurso no encontrado")
+        _invalidate(clinic_id)
+        return result.data[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/resources/{resource_id}")
+def delete_resource(resource_id: str, clinic_id: str):
+    try:
+        supabase.table("resources").delete().eq("id", resource_id).eq("clinic_id", clinic_id).execute()
+        _invalidate(clinic_id)
+        return {"success": True}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+# =========================
+# ELIGIBILITY
+# =========================
+
+@router.put("/treatments/{treatment_id}/resources")
+def set_treatment_resources(treatment_id: str, payload: TreatmentResources):
+    try:
+        treatment = (
+            supabase.table("treatments")
+            .select("id")
+            .eq("id", treatment_id)
+            .eq("clinic_id", payload.clinic_id)
+            .execute()
+        )
+        if not treatment.data:
+            raise HTTPException(status_code=404, detail="Tratamiento no encontrado")
+        if payload.resource_ids:
+            owned = (
+                supabase.table("resources")
+                .select("id")
+                .eq("clinic_id", payload.clinic_id)
+                .in_("id", payload.resource_ids)
+                .execute()
+            )
+            foreign = set(payload.resource_ids) - {r["id"] for r in owned.data or []}
+            if foreign:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Recursos de otra clínica o inexistentes: {', '.join(sorted(foreign))}",
+                )
+
+        (
+            supabase.table("treatment_resources")
+            .delete()
+            .eq("treatment_id", treatment_id)
+            .eq("clinic_id", payload.clinic_id)
+            .execute()
+        )
+        if payload.resource_ids:
+            supabase.table("treatment_resources").insert([
+                {"clinic_id": payload.clinic_id, "treatment_id": treatment_id, "resource_id": resource_id}
+                for resource_id in payload.resource_ids
+            ]).execute()
+        _invalidate(payload.clinic_id)
+        return {"success": True, "treatment_id": treatment_id, "resource_ids": payload.resource_ids}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
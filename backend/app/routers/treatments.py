@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from typing import Optional
 from app.main import supabase
+from app.services.treatment_catalog import get_treatment_catalog, invalidate_treatment_catalog
 
 router = APIRouter()
 
@@ -44,6 +45,7 @@ def create_treatment(payload: TreatmentCreate):
 
         if not result.data:
             raise HTTPException(status_code=400, detail="Error creating treatment")
+        invalidate_treatment_catalog(payload.clinic_id)
 
         return result.data[0]
 
@@ -58,11 +60,7 @@ def create_treatment(payload: TreatmentCreate):
 @router.get("/treatments")
 def list_treatments(clinic_id: str):
     try:
-        result = supabase.table("treatments") \
-            .select("*") \
-            .eq("clinic_id", clinic_id) \
-            .execute()
-
-        return {"treatments": result.data or []}
+        # Copias: las filas del catálogo cacheado son compartidas
+        return {"treatments": [dict(row) for row in get_treatment_catalog(clinic_id).rows]}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
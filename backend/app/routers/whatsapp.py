@@ -1,8 +1,6 @@
 import os
 from fastapi import APIRouter, HTTPException, Request
-from app.main import supabase
-from app.services.ai_scheduler import build_ai_reply
-from app.services.alerts_sender import send_whatsapp
+from app.services.whatsapp_inbound import is_duplicate_delivery, split_by_conversation, webhook_queue
 
 router = APIRouter()
 
@@ -22,71 +20,20 @@ async def whatsapp_verify(request: Request):
 
 @router.post("/webhook")
 async def whatsapp_webhook(payload: dict):
+    """
+    Ack-first: valida, encola (persistido en SQLite) y responde 200 al
+    instante. Hilo, mensaje, IA y respuesta corren en los workers de
+    webhook_queue (app/services/whatsapp_inbound.py), un item por
+    conversación: cada chat en orden, los chats entre sí en paralelo.
+    """
+    if not isinstance(payload.get("entry"), list):
+        raise HTTPException(status_code=400, detail="Payload de webhook invalido")
+    # Reenvío de Meta de mensajes ya guardados: 200 sin encolar
+    if is_duplicate_delivery(payload):
+        return {"ok": True, "duplicate": True}
     try:
-        entry = payload["entry"][0]
-        changes = entry["changes"][0]
-        value = changes["value"]
-        message = value["messages"][0]
-
-        wa_number = message["from"]
-        text = message["text"]["body"]
-
-        clinic_id = payload.get("clinic_id") or os.getenv("DEFAULT_CLINIC_ID")
-        if not clinic_id:
-            first = supabase.table("clinic_settings").select("clinic_id").limit(1).execute()
-            clinic_id = first.data[0]["clinic_id"] if first.data else None
-
-        # create/find thread
-        thread = (
-            supabase.table("message_threads")
-            .select("*")
-            .eq("clinic_id", clinic_id)
-            .eq("contact_number", wa_number)
-            .limit(1)
-            .execute()
-        )
-        if thread.data:
-            thread_id = thread.data[0]["id"]
-        else:
-            created = (
-                supabase.table("message_threads")
-                .insert(
-                    {
-                        "clinic_id": clinic_id,
-                        "contact_number": wa_number,
-                        "contact_name": "",
-                        "channel": "whatsapp",
-                    }
-                )
-                .execute()
-            )
-            thread_id = created.data[0]["id"] if created.data else None
-
-        if thread_id:
-            supabase.table("messages").insert(
-                {
-                    "clinic_id": clinic_id,
-                    "thread_id": thread_id,
-                    "direction": "in",
-                    "body": text,
-                    "status": "received",
-                }
-            ).execute()
-
-        # auto-reply with AI if enabled
-        settings = (
-            supabase.table("clinic_settings")
-            .select("bot_enabled,auto_reply_enabled")
-            .eq("clinic_id", clinic_id)
-            .single()
-            .execute()
-        )
-        if settings.data and settings.data.get("bot_enabled") and settings.data.get("auto_reply_enabled"):
-            reply = build_ai_reply(clinic_id, text, wa_number)
-            if reply:
-                send_whatsapp(wa_number, reply)
-
+        for part in split_by_conversation(payload):
+            await webhook_queue.enqueue(part)
         return {"ok": True}
-
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
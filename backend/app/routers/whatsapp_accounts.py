@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from typing import Dict, Optional
+from app.main import supabase
+from app.services.whatsapp_accounts import invalidate_whatsapp_accounts
+
+router = APIRouter()
+
+# =========================
+# Pydantic Schemas
+# =========================
+
+class WhatsAppAccountCreate(BaseModel):
+    clinic_id: str
+    phone_number_id: str
+    display_phone_number: Optional[str] = None
+    access_token: Optional[str] = None  # None = WHATSAPP_TOKEN del backend
+    enabled: bool = True
+
+class WhatsAppAccountUpdate(BaseModel):
+    phone_number_id: Optional[str] = None
+    display_phone_number: Optional[str] = None
+    access_token: Optional[str] = None
+    enabled: Optional[bool] = None
+
+
+def _public(account: Dict) -> Dict:
+    # El token nunca sale de la API
+    row = {k: v for k, v in account.items() if k != "access_token"}
+    row["has_access_token"] = bool(account.get("access_token"))
+    return row
+
+# =========================
+# WHATSAPP ACCOUNTS
+# =========================
+
+@router.get("/whatsapp-accounts")
+def list_whatsapp_accounts(clinic_id: str):
+    try:
+        result = supabase.table("whatsapp_accounts").select("*").eq("clinic_id", clinic_id).execute()
+        return {"accounts": [_public(a) for a in result.data or []]}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/whatsapp-accounts")
+def create_whatsapp_account(payload: WhatsAppAccountCreate):
+    try:
+        result = supabase.table("whatsapp_accounts").insert(payload.dict()).execute()
+        if not result.data:
+            raise HTTPException(status_code=400, detail="Error creating WhatsApp account")
+        invalidate_whatsapp_accounts()
+        return _public(result.data[0])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.put("/whatsapp-accounts/{account_id}")
+def update_whatsapp_account(account_id: str, clinic_id: str, payload: WhatsAppAccountUpdate):
+    try:
+        changes = {k: v for k, v in payload.dict().items() if v is not None}
+        if not changes:
+            raise HTTPException(status_code=400, detail="Sin cambios")
+        changes["updated_at"] = datetime.now(timezone.utc).isoformat()
+        result = (
+            supabase.table("whatsapp_accounts")
+            .update(changes)
+            .eq("id", account_id)
+            .eq("clinic_id", clinic_id)
+            .execute()
+        )
+        if not result.data:
+            raise HTTPException(status_code=404, detail="Cuenta no encontrada")
+        invalidate_whatsapp_accounts()
+        return _public(result.data[0])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/whatsapp-accounts/{account_id}")
+def delete_whatsapp_account(account_id: str, clinic_id: str):
+    try:
+        supabase.table("whatsapp_accounts").delete().eq("id", account_id).eq("clinic_id", clinic_id).execute()
+        invalidate_whatsapp_accounts()
+        return {"success": True}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
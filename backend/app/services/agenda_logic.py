@@ -1,20 +1,40 @@
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import os
+from bisect import bisect_left
+from datetime import date as date_cls, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 from postgrest.exceptions import APIError
 
 from app.main import supabase
 from app.services.availability import (
-    generate_slots,
-    generate_slots_with_lunch,
-    get_available_dates,
-    is_date_blocked,
+    MINUTES_PER_DAY,
+    NOT_CANCELLED_FILTER,
+    BlockedIndex,
+    OccupancyTimeline,
+    build_open_windows,
+    day_slot_minutes,
+    format_hhmm,
+    format_slots,
     is_work_day,
+    parse_hhmm,
+    rank_slots,
+    settings_break_windows,
 )
+from app.services.cache import TTLCache
+from app.services.clinic_calendar import ClinicCalendar, clinic_now, clinic_today
+from app.services.resources import ResourceDay, get_resource_catalog, uses_resources
+from app.services.single_flight import SingleFlight
+from app.services.slot_inventory import SlotInventory
+from app.services.treatment_catalog import get_treatment, get_treatment_catalog
 
 
-def get_clinic_settings(clinic_id: str) -> Dict:
-    """Get clinic settings or empty dict."""
+_settings_cache = TTLCache(
+    "clinic_settings",
+    ttl_seconds=float(os.getenv("CLINIC_SETTINGS_CACHE_TTL") or "60"),
+)
+
+
+def _load_clinic_settings(clinic_id: str) -> Dict:
     try:
         settings = (
             supabase.table("clinic_settings")
@@ -31,94 +51,243 @@ def get_clinic_settings(clinic_id: str) -> Dict:
     return settings.data if settings.data else {}
 
 
+def get_clinic_settings(clinic_id: str) -> Dict:
+    """Get clinic settings or empty dict (cached per clinic, read-only)."""
+    return _settings_cache.get_or_load(clinic_id, lambda: _load_clinic_settings(clinic_id))
+
+
+def invalidate_clinic_settings(clinic_id: str) -> None:
+    """Drop the cached settings row after any write to clinic_settings."""
+    _settings_cache.invalidate(clinic_id)
+    slot_inventory.invalidate(clinic_id)
+
+
+def get_blocked_index(clinic_id: str, settings: Dict) -> BlockedIndex:
+    """Blocked dates/periods compiled once per cached settings version."""
+    return _settings_cache.derive(
+        clinic_id,
+        "blocked_index",
+        settings,
+        lambda s: BlockedIndex(s.get("blocked_dates") or [], s.get("blocked_periods") or []),
+    )
+
+
+CLINIC_CALENDAR_HORIZON_DAYS = int(os.getenv("CLINIC_CALENDAR_HORIZON_DAYS") or "90")
+
+
+def get_clinic_calendar(clinic_id: str, settings: Dict) -> ClinicCalendar:
+    """
+    Localized day metadata from the clinic's own "today" (its timezone),
+    built once per cached settings version and local date.
+    """
+    today = clinic_today(settings)
+    return _settings_cache.derive(
+        clinic_id,
+        f"calendar:{today.isoformat()}",
+        settings,
+        lambda s: ClinicCalendar(
+            s, get_blocked_index(clinic_id, s), today, CLINIC_CALENDAR_HORIZON_DAYS
+        ),
+    )
+
+
 def _get_max_per_slot(settings: Dict, allow_overbooking: bool) -> int:
     if not allow_overbooking:
         return 1
     return int(settings.get("max_appointments_per_slot", 2) or 2)
 
 
+def _get_treatment_duration(clinic_id: str, treatment_id: str) -> Optional[int]:
+    treatment = get_treatment(clinic_id, treatment_id)
+    if not treatment:
+        return None
+    return treatment.get("duration_minutes")
+
+
+_APPOINTMENT_COLUMNS = "id,date,start_time,end_time,treatment_id,status"
+
+
+def _appointment_columns(settings: Dict) -> str:
+    if uses_resources(settings):
+        return _APPOINTMENT_COLUMNS + ",resource_ids"
+    return _APPOINTMENT_COLUMNS
+
+
+def _appointment_spans(
+    clinic_id: str,
+    settings: Dict,
+    appointments: List[Dict],
+) -> List[Tuple[int, int, List[str]]]:
+    """
+    [start, end) minutes and resource ids of every non-cancelled appointment.
+    Rows without end_time fall back to their treatment duration, then to
+    slot_minutes.
+    """
+    catalog = get_treatment_catalog(clinic_id)
+    default_minutes = int(settings.get("slot_minutes") or 30)
+    spans: List[Tuple[int, int, List[str]]] = []
+    for a in appointments:
+        if a.get("status") == "cancelled" or not a.get("start_time"):
+            continue
+        start = parse_hhmm(a["start_time"])
+        if a.get("end_time"):
+            end = parse_hhmm(a["end_time"])
+        else:
+            treatment = catalog.get(a.get("treatment_id"))
+            end = start + int((treatment or {}).get("duration_minutes") or default_minutes)
+        spans.append((start, end, a.get("resource_ids") or []))
+    return spans
+
+
+def build_day_timeline(clinic_id: str, settings: Dict, appointments: List[Dict]) -> OccupancyTimeline:
+    """Occupancy of one day, with the clinic's buffer_between_appointments applied."""
+    return OccupancyTimeline(
+        [(start, end) for start, end, _ in _appointment_spans(clinic_id, settings, appointments)],
+        int(settings.get("buffer_between_appointments") or 0),
+    )
+
+
+def build_day_occupancy(
+    clinic_id: str,
+    settings: Dict,
+    day: str,
+    appointments: List[Dict],
+) -> Union[OccupancyTimeline, ResourceDay]:
+    """Pool timeline, or per-resource bitsets when resource_scheduling is on."""
+    if uses_resources(settings):
+        return ResourceDay(
+            settings,
+            get_resource_catalog(clinic_id),
+            day,
+            _appointment_spans(clinic_id, settings, appointments),
+        )
+    return build_day_timeline(clinic_id, settings, appointments)
+
+
+def _free_in(
+    occupancy: Union[OccupancyTimeline, ResourceDay],
+    treatment_id: Optional[str],
+    slot_starts: Sequence[int],
+    duration: int,
+    max_per_slot: int,
+) -> List[int]:
+    if isinstance(occupancy, ResourceDay):
+        # Resources define capacity: one appointment per resource at a time
+        return occupancy.free_slots(treatment_id, slot_starts, duration)
+    return occupancy.free_slots(slot_starts, duration, max_per_slot)
+
+
+def _free_slot_minutes(
+    clinic_id: str,
+    settings: Dict,
+    treatment_id: Optional[str],
+    day: str,
+    duration: int,
+    appointments: List[Dict],
+    max_per_slot: int,
+) -> List[int]:
+    """
+    Slots (minutes) of one work day whose whole [start, start + duration)
+    stays below max_per_slot concurrent appointments, or, with resource
+    scheduling, where every required resource kind has a free resource.
+    """
+    occupancy = build_day_occupancy(clinic_id, settings, day, appointments)
+    return _free_in(occupancy, treatment_id, day_slot_minutes(settings, duration), duration, max_per_slot)
+
+
+def _get_appointments_in_range(
+    clinic_id: str,
+    start_date: str,
+    end_date: str,
+    columns: str = _APPOINTMENT_COLUMNS,
+) -> Dict[str, List[Dict]]:
+    """Non-cancelled appointments between two dates (inclusive), grouped by date."""
+    res = (
+        supabase.table("appointments")
+        .select(columns)
+        .eq("clinic_id", clinic_id)
+        .gte("date", start_date)
+        .lte("date", end_date)
+        .or_(NOT_CANCELLED_FILTER)
+        .execute()
+    )
+    by_date: Dict[str, List[Dict]] = {}
+    for a in res.data or []:
+        by_date.setdefault(a.get("date"), []).append(a)
+    return by_date
+
+
+slot_inventory = SlotInventory(
+    loader=_get_appointments_in_range,
+    timeline_builder=build_day_timeline,
+    today=clinic_today,
+    horizon_days=int(os.getenv("SLOT_INVENTORY_HORIZON_DAYS") or "60"),
+    ttl_seconds=float(os.getenv("SLOT_INVENTORY_TTL") or "300"),
+)
+
+
+# Coalesces concurrent identical availability queries (routes and bot)
+availability_flight = SingleFlight("availability")
+
+
+def record_appointment_change(appointment: Dict) -> None:
+    """Keep the slot inventory in sync after any appointment write."""
+    slot_inventory.apply_change(appointment)
+
+
 def get_available_slots(
     clinic_id: str,
     date: str,
     treatment_id: str,
     allow_double_booking: bool = False,
+    exclude_appointment_id: Optional[str] = None,
 ) -> List[str]:
     """
     Return available slots for a date/treatment.
 
     If allow_double_booking is True, allow multiple appointments per slot
     up to clinic_settings.max_appointments_per_slot.
+    exclude_appointment_id ignores one appointment (the one being rescheduled).
     """
     settings = get_clinic_settings(clinic_id)
     if not settings:
         return []
 
-    blocked_dates = settings.get("blocked_dates", [])
-    blocked_periods = settings.get("blocked_periods", [])
-    if is_date_blocked(blocked_dates, blocked_periods, date):
+    if get_blocked_index(clinic_id, settings).is_blocked(date):
         return []
 
     work_days = settings.get("work_days", [0, 1, 2, 3, 4])
     if not is_work_day(work_days, date):
         return []
 
-    try:
-        treatment = (
-            supabase.table("treatments")
-            .select("duration_minutes")
-            .eq("id", treatment_id)
-            .single()
-            .execute()
-        )
-    except APIError as exc:
-        if exc.code == "PGRST116":
-            return []
-        raise
-    if not treatment.data:
+    duration = _get_treatment_duration(clinic_id, treatment_id)
+    if not duration:
         return []
 
-    duration = treatment.data["duration_minutes"]
-
-    lunch_start = settings.get("lunch_start")
-    lunch_end = settings.get("lunch_end")
+    allow_overbooking = allow_double_booking or settings.get("allow_double_booking", False)
+    max_per_slot = _get_max_per_slot(settings, allow_overbooking)
 
-    if lunch_start and lunch_end:
-        all_slots = generate_slots_with_lunch(
-            settings["open_time"],
-            settings["close_time"],
-            lunch_start,
-            lunch_end,
-            duration,
-        )
-    else:
-        all_slots = generate_slots(
-            settings["open_time"],
-            settings["close_time"],
-            duration,
-        )
+    if not exclude_appointment_id and not uses_resources(settings):
+        slots = slot_inventory.get_slots(clinic_id, settings, date, duration, max_per_slot)
+        if slots is not None:
+            return list(slots)
 
     appointments = (
         supabase.table("appointments")
-        .select("start_time,status")
+        .select(_appointment_columns(settings))
         .eq("clinic_id", clinic_id)
         .eq("date", date)
         .execute()
     )
-
-    busy_slots = [
-        a["start_time"]
-        for a in (appointments.data or [])
-        if a.get("status") != "cancelled"
+    day_appointments = [
+        a for a in appointments.data or [] if a.get("id") != exclude_appointment_id
     ]
-    allow_overbooking = allow_double_booking or settings.get("allow_double_booking", False)
-    max_per_slot = _get_max_per_slot(settings, allow_overbooking)
 
-    slot_counts: Dict[str, int] = {}
-    for slot in busy_slots:
-        slot_counts[slot] = slot_counts.get(slot, 0) + 1
-
-    available = [slot for slot in all_slots if slot_counts.get(slot, 0) < max_per_slot]
-    return available
+    return format_slots(
+        _free_slot_minutes(
+            clinic_id, settings, treatment_id, date, duration, day_appointments, max_per_slot
+        )
+    )
 
 
 def get_available_dates_for_clinic(
@@ -126,25 +295,55 @@ def get_available_dates_for_clinic(
     treatment_id: str,
     days_ahead: int = 30,
 ) -> List[Dict]:
-    """Return upcoming dates with slot counts."""
+    """
+    Return upcoming dates with slot counts.
+
+    Range mode: settings, the treatment and every appointment in the window
+    are read once (three queries total); per-day counts are computed in memory.
+    """
     settings = get_clinic_settings(clinic_id)
     if not settings:
         return []
 
-    work_days = settings.get("work_days", [0, 1, 2, 3, 4])
-    blocked_dates = settings.get("blocked_dates", [])
-    blocked_periods = settings.get("blocked_periods", [])
+    # Copies: the calendar's day dicts are shared
+    available = [dict(day) for day in get_clinic_calendar(clinic_id, settings).days(days_ahead)]
+    open_dates = [d["date"] for d in available if d["available"]]
+    if not open_dates:
+        for date_info in available:
+            date_info["available_slots_count"] = 0
+        return available
 
-    available = get_available_dates(work_days, blocked_dates, blocked_periods, days_ahead)
+    duration = _get_treatment_duration(clinic_id, treatment_id)
+    max_per_slot = _get_max_per_slot(settings, settings.get("allow_double_booking", False))
+    use_inventory = (
+        bool(duration)
+        and not uses_resources(settings)
+        and slot_inventory.covers(clinic_id, settings, open_dates[-1])
+    )
+    appointments_by_date = (
+        _get_appointments_in_range(
+            clinic_id, open_dates[0], open_dates[-1], _appointment_columns(settings)
+        )
+        if duration and not use_inventory
+        else {}
+    )
 
     for date_info in available:
-        if date_info["available"]:
-            slots = get_available_slots(
-                clinic_id,
-                date_info["date"],
-                treatment_id,
-                allow_double_booking=settings.get("allow_double_booking", False),
-            )
+        if date_info["available"] and duration:
+            if use_inventory:
+                slots = slot_inventory.get_slots(
+                    clinic_id, settings, date_info["date"], duration, max_per_slot
+                )
+            else:
+                slots = _free_slot_minutes(
+                    clinic_id,
+                    settings,
+                    treatment_id,
+                    date_info["date"],
+                    duration,
+                    appointments_by_date.get(date_info["date"], []),
+                    max_per_slot,
+                )
             date_info["available_slots_count"] = len(slots)
         else:
             date_info["available_slots_count"] = 0
@@ -152,6 +351,315 @@ def get_available_dates_for_clinic(
     return available
 
 
+def get_availability_matrix(
+    clinic_id: str,
+    treatment_ids: List[str],
+    start_date: str,
+    end_date: str,
+    allow_double_booking: bool = False,
+) -> Dict:
+    """
+    Slot matrix for many treatments over a date range:
+    {"dates": [...], "slots": {treatment_id: {date: ["HH:MM", ...]}}}.
+
+    One settings read and one appointments range query; each day's occupancy
+    (timeline or resource bitsets) is built once and shared by every treatment.
+    """
+    settings = get_clinic_settings(clinic_id)
+    first_day = date_cls.fromisoformat(start_date)
+    last_day = date_cls.fromisoformat(end_date)
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    matrix: Dict[str, Dict[str, List[str]]] = {t: {} for t in treatment_ids}
+    if not settings or not days:
+        return {"dates": [d.isoformat() for d in days], "slots": matrix}
+
+    durations: Dict[str, int] = {}
+    for treatment_id in treatment_ids:
+        duration = _get_treatment_duration(clinic_id, treatment_id)
+        if duration:
+            durations[treatment_id] = duration
+
+    work_days = set(settings.get("work_days", [0, 1, 2, 3, 4]))
+    blocked = get_blocked_index(clinic_id, settings).blocked_mask(days)
+    open_days = [d for d, b in zip(days, blocked) if not b and d.weekday() in work_days]
+
+    appointments_by_date: Dict[str, List[Dict]] = {}
+    if open_days and durations:
+        appointments_by_date = _get_appointments_in_range(
+            clinic_id,
+            open_days[0].isoformat(),
+            open_days[-1].isoformat(),
+            _appointment_columns(settings),
+        )
+
+    allow_overbooking = allow_double_booking or settings.get("allow_double_booking", False)
+    max_per_slot = _get_max_per_slot(settings, allow_overbooking)
+    open_set = set(open_days)
+
+    for day in days:
+        day_str = day.isoformat()
+        occupancy = None
+        if day in open_set and durations:
+            occupancy = build_day_occupancy(
+                clinic_id, settings, day_str, appointments_by_date.get(day_str, [])
+            )
+        for treatment_id in treatment_ids:
+            duration = durations.get(treatment_id)
+            if occupancy is None or not duration:
+                matrix[treatment_id][day_str] = []
+                continue
+            free = _free_in(
+                occupancy, treatment_id, day_slot_minutes(settings, duration), duration, max_per_slot
+            )
+            matrix[treatment_id][day_str] = format_slots(free)
+
+    return {"dates": [d.isoformat() for d in days], "slots": matrix}
+
+
+class InvalidSearch(ValueError):
+    """Malformed `after` or `preference` in a slot search (a 400, not a 500)."""
+
+
+def _preference_window(preference: Optional[str], settings: Dict) -> Tuple[int, int]:
+    """
+    Time-of-day preference as [from, to) minutes: "morning" / "manana",
+    "afternoon" / "tarde" (split at lunch_start or 13:00) or "HH:MM-HH:MM".
+    Raises InvalidSearch for anything else.
+    """
+    if not preference:
+        return 0, MINUTES_PER_DAY
+    value = preference.strip().lower()
+    split = parse_hhmm(settings.get("lunch_start") or "13:00")
+    if value in ("morning", "manana", "mañana"):
+        return 0, split
+    if value in ("afternoon", "tarde"):
+        return split, MINUTES_PER_DAY
+    if "-" in value:
+        start, end = value.split("-", 1)
+        try:
+            window = parse_hhmm(start.strip()), parse_hhmm(end.strip())
+        except ValueError:
+            raise InvalidSearch(f"Preferencia horaria inválida: {preference!r}")
+        if window[0] >= window[1]:
+            raise InvalidSearch(f"Preferencia horaria inválida: {preference!r}")
+        return window
+    raise InvalidSearch(f"Preferencia horaria inválida: {preference!r}")
+
+
+def _search_start(settings: Dict, after: Optional[str]) -> Tuple[date_cls, int]:
+    """
+    First day and first minute of a search from `after` ("YYYY-MM-DD" or
+    "YYYY-MM-DDTHH:MM", default now). Never earlier than the clinic's
+    current minute: slots that already passed today are not offered.
+    Raises InvalidSearch for a malformed `after`.
+    """
+    now = clinic_now(settings)
+    today = now.date()
+    first_day, not_before = today, 0
+    if after:
+        try:
+            first_day = date_cls.fromisoformat(after[:10])
+            if len(after) > 10:
+                if after[10] not in "T ":
+                    raise ValueError(after)
+                not_before = parse_hhmm(after[11:16])
+        except ValueError:
+            raise InvalidSearch(f"after inválido (YYYY-MM-DD o YYYY-MM-DDTHH:MM): {after!r}")
+    # Hoy (o una fecha pasada): desde el minuto siguiente al actual
+    current = now.hour * 60 + now.minute + 1
+    if first_day < today:
+        first_day, not_before = today, current
+    elif first_day == today:
+        not_before = max(not_before, current)
+    return first_day, not_before
+
+
+def _iter_open_days(
+    clinic_id: str,
+    settings: Dict,
+    first_day: date_cls,
+    max_days: int,
+    window_days: int,
+) -> Iterator[Tuple[date_cls, List[Dict]]]:
+    """
+    Open days from first_day with their appointments, prefetched with one
+    range query per window of `window_days` (lazily, so callers that stop
+    early never load later windows).
+    """
+    blocked_index = get_blocked_index(clinic_id, settings)
+    work_days = set(settings.get("work_days", [0, 1, 2, 3, 4]))
+    for window_start in range(0, max_days, window_days):
+        days = [
+            first_day + timedelta(days=i)
+            for i in range(window_start, min(window_start + window_days, max_days))
+        ]
+        open_days = [
+            day
+            for day, blocked in zip(days, blocked_index.blocked_mask(days))
+            if not blocked and day.weekday() in work_days
+        ]
+        if not open_days:
+            continue
+
+        appointments_by_date = _get_appointments_in_range(
+            clinic_id,
+            open_days[0].isoformat(),
+            open_days[-1].isoformat(),
+            _appointment_columns(settings),
+        )
+        for day in open_days:
+            yield day, appointments_by_date.get(day.isoformat(), [])
+
+
+def find_next_available(
+    clinic_id: str,
+    treatment_id: str,
+    after: Optional[str] = None,
+    limit: int = 5,
+    preference: Optional[str] = None,
+    max_days: int = 30,
+    window_days: int = 7,
+) -> List[Dict]:
+    """
+    First `limit` free slots from `after` ("YYYY-MM-DD" or "YYYY-MM-DDTHH:MM",
+    default today) onwards, walking day by day and stopping as soon as enough
+    slots are found.
+
+    Appointments are prefetched in windows of `window_days` with one range
+    query each, so a typical search costs a single query (settings and
+    treatments come from the caches).
+    """
+    settings = get_clinic_settings(clinic_id)
+    if not settings or limit <= 0:
+        return []
+    duration = _get_treatment_duration(clinic_id, treatment_id)
+    if not duration:
+        return []
+
+    first_day, not_before = _search_start(settings, after)
+    pref_from, pref_to = _preference_window(preference, settings)
+    max_per_slot = _get_max_per_slot(settings, settings.get("allow_double_booking", False))
+    grid = [
+        slot
+        for slot in day_slot_minutes(settings, duration)
+        if pref_from <= slot and slot + duration <= pref_to
+    ]
+    if not grid:
+        return []
+
+    found: List[Dict] = []
+    for day, appointments in _iter_open_days(clinic_id, settings, first_day, max_days, window_days):
+        day_str = day.isoformat()
+        day_grid = grid if day != first_day or not not_before else [s for s in grid if s >= not_before]
+        occupancy = build_day_occupancy(clinic_id, settings, day_str, appointments)
+        for slot in _free_in(occupancy, treatment_id, day_grid, duration, max_per_slot):
+            found.append({"date": day_str, "time": format_hhmm(slot)})
+            if len(found) >= limit:
+                return found
+    return found
+
+
+def suggest_slots(
+    clinic_id: str,
+    treatment_id: str,
+    after: Optional[str] = None,
+    limit: int = 5,
+    max_days: int = 30,
+    window_days: int = 7,
+) -> Dict:
+    """
+    First day from `after` (default today) with free slots and its best
+    `limit` slots for packing the agenda (see availability.rank_slots),
+    returned in time order: {"date": "YYYY-MM-DD" | None, "slots": [...]}.
+
+    Same queries as find_next_available; the ranking reuses the day's
+    appointments and the cached catalog (shortest treatment = unusable gap).
+    """
+    settings = get_clinic_settings(clinic_id)
+    duration = _get_treatment_duration(clinic_id, treatment_id) if settings else None
+    if not settings or not duration or limit <= 0:
+        return {"date": None, "slots": []}
+
+    first_day, not_before = _search_start(settings, after)
+    max_per_slot = _get_max_per_slot(settings, settings.get("allow_double_booking", False))
+    grid = day_slot_minutes(settings, duration)
+    windows = build_open_windows(
+        parse_hhmm(settings.get("open_time") or "09:00"),
+        parse_hhmm(settings.get("close_time") or "18:00"),
+        settings_break_windows(settings),
+    )
+    durations = [
+        int(t["duration_minutes"])
+        for t in get_treatment_catalog(clinic_id).rows
+        if t.get("duration_minutes")
+    ]
+    min_gap = min(durations, default=int(settings.get("slot_minutes") or 30))
+
+    for day, appointments in _iter_open_days(clinic_id, settings, first_day, max_days, window_days):
+        day_str = day.isoformat()
+        occupancy = build_day_occupancy(clinic_id, settings, day_str, appointments)
+        day_grid = grid if day != first_day or not not_before else [s for s in grid if s >= not_before]
+        free = _free_in(occupancy, treatment_id, day_grid, duration, max_per_slot)
+        if not free:
+            continue
+        timeline = occupancy if isinstance(occupancy, OccupancyTimeline) else build_day_timeline(
+            clinic_id, settings, appointments
+        )
+        best = rank_slots(free, duration, timeline, windows, min_gap)[:limit]
+        return {"date": day_str, "slots": format_slots(sorted(best))}
+    return {"date": None, "slots": []}
+
+
+_booking_rpc_available = True
+
+
+def _overbooking_fee(settings: Dict, base_price) -> float:
+    fee_value = settings.get("overbooking_extra_fee", 0) or 0
+    fee_type = settings.get("overbooking_fee_type", "fixed")
+    if fee_type == "percent":
+        return round((base_price or 0) * float(fee_value) / 100, 2)
+    return float(fee_value)
+
+
+def _validate_booking_slot(clinic_id: str, settings: Dict, date: str, start_time: str, duration: int) -> bool:
+    """In-memory checks: open day, not blocked and start_time on the slot grid."""
+    if get_blocked_index(clinic_id, settings).is_blocked(date):
+        return False
+    if not is_work_day(settings.get("work_days", [0, 1, 2, 3, 4]), date):
+        return False
+    try:
+        start_minute = parse_hhmm(start_time)
+    except ValueError:
+        return False
+    return start_minute in day_slot_minutes(settings, duration)
+
+
+def _assign_resources(
+    clinic_id: str,
+    settings: Dict,
+    treatment_id: Optional[str],
+    date: str,
+    start_time: str,
+    duration: int,
+    exclude_appointment_id: Optional[str] = None,
+    appointments: Optional[List[Dict]] = None,
+) -> Optional[List[str]]:
+    """One free eligible resource per required kind for the slot, or None."""
+    if appointments is None:
+        appointments = (
+            supabase.table("appointments")
+            .select(_appointment_columns(settings))
+            .eq("clinic_id", clinic_id)
+            .eq("date", date)
+            .or_(NOT_CANCELLED_FILTER)
+            .execute()
+        ).data or []
+    if exclude_appointment_id:
+        appointments = [a for a in appointments if a.get("id") != exclude_appointment_id]
+    resource_day = build_day_occupancy(clinic_id, settings, date, appointments)
+    return resource_day.assign(treatment_id, parse_hhmm(start_time), duration)
+
+
 def create_appointment(
     clinic_id: str,
     patient_name: str,
@@ -162,11 +670,105 @@ def create_appointment(
     allow_double_booking: bool = False,
     patient_id: Optional[str] = None,
 ) -> Dict:
-    """Create appointment with validation."""
+    """
+    Create appointment with validation.
+
+    Settings, treatment and slot-grid checks run in memory; patient lookup,
+    daily limit, slot capacity and the insert run atomically in the
+    book_appointment Postgres function (one round trip, see
+    SQL_BOOKING_ATOMIC.sql). Conflicts come back as {"error", "code"}.
+
+    With resource_scheduling the resources are picked here and the RPC
+    re-checks that none of them got booked meanwhile (SQL_RECURSOS.sql).
+    """
+    global _booking_rpc_available
+
     settings = get_clinic_settings(clinic_id)
     if not settings:
-        return {"error": "Clinica no encontrada"}
+        return {"error": "Clinica no encontrada", "code": "clinic_not_found"}
 
+    treatment = get_treatment(clinic_id, treatment_id)
+    if not treatment:
+        return {"error": "Tratamiento no registrado", "code": "treatment_not_found"}
+    duration = treatment.get("duration_minutes") or 30
+    base_price = treatment.get("base_price", 0)
+
+    if not _validate_booking_slot(clinic_id, settings, date, start_time, duration):
+        return {"error": "Horario no disponible", "code": "slot_unavailable"}
+
+    allow_overbooking = allow_double_booking or settings.get("allow_double_booking", False)
+    start_time = format_hhmm(parse_hhmm(start_time))
+    end_time = format_hhmm(min(parse_hhmm(start_time) + duration, MINUTES_PER_DAY))
+
+    if _booking_rpc_available:
+        params = {
+            "p_clinic_id": clinic_id,
+            "p_patient_id": patient_id,
+            "p_patient_name": patient_name,
+            "p_patient_phone": patient_phone,
+            "p_date": date,
+            "p_start_time": start_time,
+            "p_end_time": end_time,
+            "p_treatment_id": treatment_id,
+            "p_buffer_minutes": int(settings.get("buffer_between_appointments") or 0),
+            "p_default_minutes": int(settings.get("slot_minutes") or 30),
+            "p_max_per_slot": _get_max_per_slot(settings, allow_overbooking),
+            "p_max_per_day": settings.get("max_appointments_per_day", 20),
+            "p_allow_overbooking": bool(allow_overbooking),
+            "p_overbooking_fee": _overbooking_fee(settings, base_price),
+            "p_confirmation_required": settings.get("confirmation_required", True),
+        }
+        if uses_resources(settings):
+            resource_ids = _assign_resources(clinic_id, settings, treatment_id, date, start_time, duration)
+            if resource_ids is None:
+                return {"error": "Horario no disponible", "code": "resource_conflict"}
+            params["p_resource_ids"] = resource_ids
+        try:
+            booked = supabase.rpc("book_appointment", params).execute()
+        except APIError as exc:
+            # PGRST202: the function is not deployed; use the multi-query path
+            if exc.code != "PGRST202":
+                raise
+            _booking_rpc_available = False
+        else:
+            if booked.data:
+                if booked.data.get("appointment"):
+                    record_appointment_change(booked.data["appointment"])
+                return booked.data
+            return {"error": "No se pudo crear el turno", "code": "insert_failed"}
+
+    return _create_appointment_unlocked(
+        clinic_id,
+        settings,
+        treatment,
+        patient_name,
+        patient_phone,
+        date,
+        start_time,
+        end_time,
+        treatment_id,
+        allow_overbooking,
+        patient_id,
+    )
+
+
+def _create_appointment_unlocked(
+    clinic_id: str,
+    settings: Dict,
+    treatment: Dict,
+    patient_name: str,
+    patient_phone: str,
+    date: str,
+    start_time: str,
+    end_time: str,
+    treatment_id: str,
+    allow_overbooking: bool,
+    patient_id: Optional[str],
+) -> Dict:
+    """
+    Fallback for databases without book_appointment: same checks as the RPC
+    with separate queries, so concurrent bookings are not serialized.
+    """
     if not patient_id:
         patient_lookup = (
             supabase.table("patients")
@@ -177,99 +779,75 @@ def create_appointment(
             .execute()
         )
         if not patient_lookup.data:
-            return {"error": "Paciente no registrado"}
+            return {"error": "Paciente no registrado", "code": "patient_not_found"}
         patient_id = patient_lookup.data[0]["id"]
 
-    allow_overbooking = allow_double_booking or settings.get("allow_double_booking", False)
-    available = get_available_slots(
-        clinic_id,
-        date,
-        treatment_id,
-        allow_double_booking=allow_overbooking,
-    )
-    if start_time not in available:
-        return {"error": "Horario no disponible"}
-
     max_appointments = settings.get("max_appointments_per_day", 20)
     today_appointments = (
         supabase.table("appointments")
-        .select("id")
+        .select(_appointment_columns(settings))
         .eq("clinic_id", clinic_id)
         .eq("date", date)
         .execute()
     )
     if len(today_appointments.data or []) >= max_appointments:
-        return {"error": "Limite de turnos por dia alcanzado"}
+        return {"error": "Limite de turnos por dia alcanzado", "code": "daily_limit"}
 
-    try:
-        treatment = (
-            supabase.table("treatments")
-            .select("duration_minutes, base_price")
-            .eq("id", treatment_id)
-            .single()
-            .execute()
+    resource_ids = None
+    if uses_resources(settings):
+        resource_ids = _assign_resources(
+            clinic_id,
+            settings,
+            treatment_id,
+            date,
+            start_time,
+            parse_hhmm(end_time) - parse_hhmm(start_time),
+            appointments=[a for a in today_appointments.data or [] if a.get("status") != "cancelled"],
         )
-    except APIError as exc:
-        if exc.code == "PGRST116":
-            return {"error": "Tratamiento no registrado"}
-        raise
-    if not treatment.data:
-        return {"error": "Tratamiento no registrado"}
-    duration = treatment.data["duration_minutes"] if treatment.data else 30
-    base_price = treatment.data.get("base_price", 0) if treatment.data else 0
-
-    start_dt = datetime.strptime(start_time, "%H:%M")
-    end_dt = start_dt + timedelta(minutes=duration)
-    end_time = end_dt.strftime("%H:%M")
-
-    existing_at_slot = (
-        supabase.table("appointments")
-        .select("id")
-        .eq("clinic_id", clinic_id)
-        .eq("date", date)
-        .eq("start_time", start_time)
-        .execute()
-    )
+        if resource_ids is None:
+            return {"error": "Horario no disponible", "code": "resource_conflict"}
 
-    already_count = len(existing_at_slot.data or [])
+    timeline = build_day_timeline(clinic_id, settings, today_appointments.data or [])
+    already_count = timeline.max_overlap(parse_hhmm(start_time), parse_hhmm(end_time))
     max_per_slot = _get_max_per_slot(settings, allow_overbooking)
-    is_overbooked = allow_overbooking and already_count > 0 and already_count < max_per_slot
+    if resource_ids is None and already_count >= max_per_slot:
+        return {
+            "error": "Horario no disponible",
+            "code": "slot_conflict",
+            "overlapping": already_count,
+            "capacity": max_per_slot,
+        }
+    is_overbooked = resource_ids is None and bool(allow_overbooking) and already_count > 0
 
     extra_fee = 0
     if is_overbooked:
-        fee_value = settings.get("overbooking_extra_fee", 0) or 0
-        fee_type = settings.get("overbooking_fee_type", "fixed")
-        if fee_type == "percent":
-            extra_fee = round((base_price or 0) * float(fee_value) / 100, 2)
-        else:
-            extra_fee = float(fee_value)
+        extra_fee = _overbooking_fee(settings, treatment.get("base_price", 0))
 
-    result = (
-        supabase.table("appointments")
-        .insert(
-            {
-                "clinic_id": clinic_id,
-                "patient_id": patient_id,
-                "patient_name": patient_name,
-                "patient_phone": patient_phone,
-                "date": date,
-                "start_time": start_time,
-                "end_time": end_time,
-                "treatment_id": treatment_id,
-                "double_booked": is_overbooked,
-                "overbooked": is_overbooked,
-                "extra_fee": extra_fee,
-                "status": "pending",
-                "confirmation_required": settings.get("confirmation_required", True),
-            }
-        )
-        .execute()
-    )
+    row = {
+        "clinic_id": clinic_id,
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "patient_phone": patient_phone,
+        "date": date,
+        "start_time": start_time,
+        "end_time": end_time,
+        "treatment_id": treatment_id,
+        "double_booked": is_overbooked,
+        "overbooked": is_overbooked,
+        "extra_fee": extra_fee,
+        "status": "pending",
+        "confirmation_required": settings.get("confirmation_required", True),
+    }
+    if resource_ids is not None:
+        row["resource_ids"] = resource_ids
+
+    result = supabase.table("appointments").insert(row).execute()
 
     if result.data:
+        record_appointment_change(result.data[0])
         return {"success": True, "appointment": result.data[0]}
 
-    return {"error": "No se pudo crear el turno"}
+    return {"error": "No se pudo crear el turno", "code": "insert_failed"}
 
 
 def reschedule_appointment(
@@ -295,18 +873,357 @@ def reschedule_appointment(
         new_date,
         apt.data["treatment_id"],
         allow_double_booking=settings.get("allow_double_booking", False),
+        exclude_appointment_id=appointment_id,
     )
     if new_time not in available:
         return {"error": "Nuevo horario no disponible"}
 
+    update = {"date": new_date, "start_time": new_time, "status": "pending"}
+    treatment = get_treatment(clinic_id, apt.data["treatment_id"])
+    if treatment and treatment.get("duration_minutes"):
+        update["end_time"] = format_hhmm(
+            min(parse_hhmm(new_time) + treatment["duration_minutes"], MINUTES_PER_DAY)
+        )
+    if uses_resources(settings):
+        resource_ids = _assign_resources(
+            clinic_id,
+            settings,
+            apt.data["treatment_id"],
+            new_date,
+            new_time,
+            (treatment or {}).get("duration_minutes") or int(settings.get("slot_minutes") or 30),
+            exclude_appointment_id=appointment_id,
+        )
+        if resource_ids is None:
+            return {"error": "Nuevo horario no disponible"}
+        update["resource_ids"] = resource_ids
+
     result = (
         supabase.table("appointments")
-        .update({"date": new_date, "start_time": new_time, "status": "pending"})
+        .update(update)
         .eq("id", appointment_id)
         .execute()
     )
 
     if result.data:
+        record_appointment_change(result.data[0])
         return {"success": True, "appointment": result.data[0]}
 
     return {"error": "No se pudo reagendar"}
+
+
+REBOOKING_BATCH_SIZE = int(os.getenv("REBOOKING_BATCH_SIZE") or "500")
+
+
+# Lo único que escribe un movimiento: el resto de la fila puede haber cambiado
+_MOVE_COLUMNS = ("date", "start_time", "end_time", "status")
+
+
+def _chunks(rows: List, size: int) -> Iterator[List]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _write_moves(clinic_id: str, rows: List[Dict], with_resources: bool) -> List[Dict]:
+    """
+    Persist moved rows touching only date, start_time, end_time, status (and
+    resource_ids with resource scheduling): one update per distinct target,
+    in id chunks, so edits made to other columns since the rows were read
+    are kept. Rows cancelled in the meantime are not revived. Returns the
+    rows as stored, in the order of `rows`.
+    """
+    columns = _MOVE_COLUMNS + (("resource_ids",) if with_resources else ())
+    groups: Dict[Tuple, List[str]] = {}
+    for row in rows:
+        target = tuple(
+            tuple(row.get(c) or ()) if c == "resource_ids" else row.get(c) for c in columns
+        )
+        groups.setdefault(target, []).append(row["id"])
+    written: Dict[str, Dict] = {}
+    for target, ids in groups.items():
+        changes = {c: list(v) if c == "resource_ids" else v for c, v in zip(columns, target)}
+        for chunk in _chunks(ids, REBOOKING_BATCH_SIZE):
+            for stored in (
+                supabase.table("appointments")
+                .update(changes)
+                .eq("clinic_id", clinic_id)
+                .in_("id", chunk)
+                .or_(NOT_CANCELLED_FILTER)
+                .execute()
+            ).data or []:
+                written[stored["id"]] = stored
+    return [written[row["id"]] for row in rows if row["id"] in written]
+
+
+def reschedule_appointments(clinic_id: str, moves: Sequence[Dict]) -> Dict:
+    """
+    Bulk reschedule: moves = [{"appointment_id", "new_date", "new_time"}].
+
+    One query loads the moved rows and one the target days; every move is
+    checked like reschedule_appointment, against a shared per-day occupancy
+    that already reflects the earlier moves of the batch, so two moves never
+    take the same last free seat. Valid moves are written with _write_moves
+    (only the moved columns). Returns
+    {"rescheduled": [rows], "failed": [{appointment_id, error}]}.
+    """
+    settings = get_clinic_settings(clinic_id)
+    if not settings:
+        return {"error": "Clinica no encontrada", "code": "clinic_not_found"}
+
+    result: Dict = {"rescheduled": [], "failed": []}
+    if not moves:
+        return result
+    ids = [move["appointment_id"] for move in moves]
+    rows_by_id = {
+        row["id"]: row
+        for row in (
+            supabase.table("appointments")
+            .select("*")
+            .eq("clinic_id", clinic_id)
+            .in_("id", ids)
+            .execute()
+        ).data or []
+    }
+    target_dates = sorted({move["new_date"] for move in moves})
+    day_rows: Dict[str, List[Dict]] = {day: [] for day in target_dates}
+    for row in (
+        supabase.table("appointments")
+        .select(_appointment_columns(settings))
+        .eq("clinic_id", clinic_id)
+        .in_("date", target_dates)
+        .or_(NOT_CANCELLED_FILTER)
+        .execute()
+    ).data or []:
+        day_rows[row["date"]].append(row)
+
+    occupancy: Dict[str, Union[OccupancyTimeline, ResourceDay]] = {}
+    max_per_slot = _get_max_per_slot(settings, settings.get("allow_double_booking", False))
+    default_minutes = int(settings.get("slot_minutes") or 30)
+
+    def leave(day: str, appointment_id: str) -> Optional[Dict]:
+        rows = day_rows.get(day)
+        for i, row in enumerate(rows or []):
+            if row.get("id") == appointment_id:
+                occupancy.pop(day, None)
+                return rows.pop(i)
+        return None
+
+    moved: List[Dict] = []
+    for move in moves:
+        appointment_id = move["appointment_id"]
+        new_date, new_time = move["new_date"], move["new_time"]
+        row = rows_by_id.get(appointment_id)
+        if not row:
+            result["failed"].append({"appointment_id": appointment_id, "error": "Turno no encontrado"})
+            continue
+        duration = _get_treatment_duration(clinic_id, row.get("treatment_id")) or default_minutes
+        if not _validate_booking_slot(clinic_id, settings, new_date, new_time, duration):
+            result["failed"].append({"appointment_id": appointment_id, "error": "Nuevo horario no disponible"})
+            continue
+
+        # The row's current seat does not count against its own new slot
+        previous = leave(row["date"], appointment_id)
+        day_occupancy = occupancy.get(new_date)
+        if day_occupancy is None:
+            day_occupancy = occupancy[new_date] = build_day_occupancy(
+                clinic_id, settings, new_date, day_rows[new_date]
+            )
+        start = parse_hhmm(new_time)
+        if not _free_in(day_occupancy, row.get("treatment_id"), [start], duration, max_per_slot):
+            if previous is not None:
+                day_rows[row["date"]].append(previous)
+                occupancy.pop(row["date"], None)
+            result["failed"].append({"appointment_id": appointment_id, "error": "Nuevo horario no disponible"})
+            continue
+
+        updated = {
+            **row,
+            "date": new_date,
+            "start_time": format_hhmm(start),
+            "end_time": format_hhmm(min(start + duration, MINUTES_PER_DAY)),
+            "status": "pending",
+        }
+        if isinstance(day_occupancy, ResourceDay):
+            updated["resource_ids"] = day_occupancy.assign(row.get("treatment_id"), start, duration)
+        day_rows[new_date].append(updated)
+        occupancy.pop(new_date, None)
+        rows_by_id[appointment_id] = updated
+        moved.append(updated)
+
+    # A row moved twice in one batch is written once, in its final position
+    final = list({row["id"]: row for row in moved}.values())
+    written = _write_moves(clinic_id, final, uses_resources(settings))
+    written_ids = {row["id"] for row in written}
+    for row in final:
+        if row["id"] not in written_ids:
+            result["failed"].append({"appointment_id": row["id"], "error": "Turno cancelado"})
+    for row in written:
+        record_appointment_change(row)
+    result["rescheduled"] = written
+    return result
+
+
+def rebook_blocked_appointments(
+    clinic_id: str,
+    dates: Sequence[str] = (),
+    periods: Sequence[Dict] = (),
+    apply: bool = False,
+    notify: bool = True,
+    search_days: int = 30,
+) -> Dict:
+    """
+    Impact of blocking `dates`/`periods`: every non-cancelled appointment on
+    those days (from today on) with a replacement slot, the first open day
+    with room on or after its date, closest to its original time.
+
+    One range query loads the blocked days and the search horizon; all
+    replacements are placed on one shared per-day occupancy, so two moved
+    appointments never get the same slot. With apply=True the moves are
+    written with _write_moves (only the moved columns, status back to
+    pending), plus batched appointment_changes and patient_notifications
+    rows. Bookings made between the plan and the write are not re-checked;
+    appointments cancelled in between are left cancelled.
+    """
+    settings = get_clinic_settings(clinic_id)
+    if not settings:
+        return {"error": "Clinica no encontrada", "code": "clinic_not_found"}
+
+    new_block = BlockedIndex(dates, periods)
+    bounds = [d for d in dates if d] + [
+        edge for p in periods if p.get("start") and p.get("end") for edge in (p["start"], p["end"])
+    ]
+    today = clinic_today(settings)
+    first_day = max(date_cls.fromisoformat(min(bounds)), today) if bounds else today
+    last_blocked = date_cls.fromisoformat(max(bounds)) if bounds else today
+    result: Dict = {"affected": 0, "rebooked": [], "unplaced": [], "applied": False, "notifications": 0}
+    if not bounds or last_blocked < first_day:
+        return result
+
+    horizon_end = last_blocked + timedelta(days=search_days)
+    rows_by_date = _get_appointments_in_range(
+        clinic_id, first_day.isoformat(), horizon_end.isoformat(), "*"
+    )
+    affected = sorted(
+        (
+            row
+            for day, rows in rows_by_date.items()
+            if new_block.is_blocked(day)
+            for row in rows
+            if row.get("start_time")
+        ),
+        key=lambda row: (row["date"], row["start_time"]),
+    )
+    result["affected"] = len(affected)
+    if not affected:
+        return result
+
+    blocked = BlockedIndex(
+        list(settings.get("blocked_dates") or []) + list(dates),
+        list(settings.get("blocked_periods") or []) + list(periods),
+    )
+    work_days = set(settings.get("work_days", [0, 1, 2, 3, 4]))
+    candidates = [
+        day.isoformat()
+        for day in (first_day + timedelta(days=i) for i in range((horizon_end - first_day).days + 1))
+        if day.weekday() in work_days and not blocked.is_blocked_ordinal(day.toordinal())
+    ]
+    day_rows = {day: list(rows_by_date.get(day, [])) for day in candidates}
+    occupancy: Dict[str, Union[OccupancyTimeline, ResourceDay]] = {}
+    max_per_slot = _get_max_per_slot(settings, settings.get("allow_double_booking", False))
+    max_per_day = settings.get("max_appointments_per_day", 20)
+    default_minutes = int(settings.get("slot_minutes") or 30)
+
+    moved: List[Dict] = []
+    for row in affected:
+        original = parse_hhmm(row["start_time"])
+        if row.get("end_time"):
+            duration = parse_hhmm(row["end_time"]) - original
+        else:
+            duration = _get_treatment_duration(clinic_id, row.get("treatment_id")) or default_minutes
+        grid = day_slot_minutes(settings, duration)
+        placed = None
+        for day in candidates[bisect_left(candidates, row["date"]):]:
+            rows = day_rows[day]
+            if len(rows) >= max_per_day:
+                continue
+            day_occupancy = occupancy.get(day)
+            if day_occupancy is None:
+                day_occupancy = occupancy[day] = build_day_occupancy(clinic_id, settings, day, rows)
+            free = _free_in(day_occupancy, row.get("treatment_id"), grid, duration, max_per_slot)
+            if not free:
+                continue
+            slot = min(free, key=lambda s: (abs(s - original), s))
+            placed = {
+                **row,
+                "date": day,
+                "start_time": format_hhmm(slot),
+                "end_time": format_hhmm(min(slot + duration, MINUTES_PER_DAY)),
+                "status": "pending",
+            }
+            if isinstance(day_occupancy, ResourceDay):
+                placed["resource_ids"] = day_occupancy.assign(row.get("treatment_id"), slot, duration)
+            rows.append(placed)
+            occupancy.pop(day, None)
+            break
+
+        summary = {
+            "appointment_id": row.get("id"),
+            "patient_name": row.get("patient_name"),
+            "patient_phone": row.get("patient_phone"),
+            "from": {"date": row["date"], "time": format_hhmm(original)},
+        }
+        if placed is None:
+            result["unplaced"].append(summary)
+            continue
+        summary["to"] = {"date": placed["date"], "time": placed["start_time"]}
+        result["rebooked"].append(summary)
+        moved.append(placed)
+
+    if not apply or not moved:
+        return result
+
+    old_by_id = {row.get("id"): row for row in affected}
+    moved = _write_moves(clinic_id, moved, uses_resources(settings))
+    written_ids = {row["id"] for row in moved}
+    result["rebooked"] = [s for s in result["rebooked"] if s["appointment_id"] in written_ids]
+    changes = [
+        {
+            "clinic_id": clinic_id,
+            "appointment_id": row["id"],
+            "change_type": "reschedule",
+            "old_value": {
+                "date": old_by_id[row["id"]]["date"],
+                "start_time": old_by_id[row["id"]]["start_time"],
+            },
+            "new_value": {"date": row["date"], "start_time": row["start_time"]},
+            "changed_by": "blocked_dates",
+        }
+        for row in moved
+    ]
+    for chunk in _chunks(changes, REBOOKING_BATCH_SIZE):
+        supabase.table("appointment_changes").insert(chunk).execute()
+    for row in moved:
+        record_appointment_change(row)
+    result["applied"] = True
+
+    if notify:
+        notifications = [
+            {
+                "clinic_id": clinic_id,
+                "appointment_id": row["id"],
+                "patient_id": row.get("patient_id"),
+                "patient_phone": row.get("patient_phone"),
+                "kind": "reschedule",
+                "body": (
+                    f"Hola {row.get('patient_name') or ''}, tu turno del "
+                    f"{old_by_id[row['id']]['date']} fue reprogramado para el "
+                    f"{row['date']} a las {row['start_time']}. Respondé para confirmar."
+                ),
+                "status": "pending",
+            }
+            for row in moved
+        ]
+        for chunk in _chunks(notifications, REBOOKING_BATCH_SIZE):
+            supabase.table("patient_notifications").insert(chunk).execute()
+        result["notifications"] = len(notifications)
+    return result
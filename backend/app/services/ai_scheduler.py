@@ -1,16 +1,18 @@
 import json
 import os
-import re
 import urllib.request
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional, Tuple
 
 from app.main import supabase
-from app.services.agenda_logic import create_appointment, get_available_dates_for_clinic, get_available_slots
+from app.services.agenda_logic import availability_flight, create_appointment, suggest_slots
 from app.services.ai_service import classify_intent, get_reply_for_intent
+from app.services.idempotency import IdempotencyConflict, appointment_idempotency
+from app.services.treatment_catalog import get_treatment_catalog
 
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+SUGGESTED_SLOTS = 5
 
 
 def _http_post(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
@@ -21,10 +23,6 @@ def _http_post(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Di
         return json.loads(body)
 
 
-def _normalize(text: str) -> str:
-    return re.sub(r"\s+", " ", text.strip().lower())
-
-
 def _extract_with_openai(text: str, treatments: List[str]) -> Dict[str, Any]:
     if not OPENAI_API_KEY:
         return {}
@@ -78,29 +76,12 @@ def _parse_time(time_str: Optional[str]) -> Optional[str]:
 
 
 def _find_treatment_id(clinic_id: str, treatment_name: Optional[str]) -> Optional[str]:
-    if not treatment_name:
-        return None
-    name = _normalize(treatment_name)
-    res = (
-        supabase.table("treatments")
-        .select("id,name")
-        .eq("clinic_id", clinic_id)
-        .execute()
-    )
-    for t in res.data or []:
-        if name in _normalize(t.get("name", "")):
-            return t.get("id")
-    return None
+    treatment = get_treatment_catalog(clinic_id).find_by_name(treatment_name)
+    return treatment.get("id") if treatment else None
 
 
 def _get_treatments_names(clinic_id: str) -> List[str]:
-    res = (
-        supabase.table("treatments")
-        .select("name")
-        .eq("clinic_id", clinic_id)
-        .execute()
-    )
-    return [t.get("name") for t in (res.data or []) if t.get("name")]
+    return get_treatment_catalog(clinic_id).names()
 
 
 def _ensure_patient(clinic_id: str, patient_name: str, phone: str) -> Optional[str]:
@@ -130,23 +111,24 @@ def _ensure_patient(clinic_id: str, patient_name: str, phone: str) -> Optional[s
 
 
 def _suggest_slots(clinic_id: str, treatment_id: str, date: Optional[str]) -> Tuple[Optional[str], List[str]]:
-    if date:
-        slots = get_available_slots(clinic_id, date, treatment_id)
-        if slots:
-            return date, slots
-    dates = get_available_dates_for_clinic(clinic_id, treatment_id, days_ahead=7)
-    for d in dates:
-        if d.get("available"):
-            slots = get_available_slots(clinic_id, d.get("date"), treatment_id)
-            return d.get("date"), slots
-    return None, []
+    """First day (from `date`, or today) with free slots, and its best-packing slots."""
+    suggestion = availability_flight.do(
+        ("suggest", clinic_id, treatment_id, date, SUGGESTED_SLOTS),
+        lambda: suggest_slots(clinic_id, treatment_id, after=date, limit=SUGGESTED_SLOTS),
+    )
+    return suggestion["date"], suggestion["slots"]
 
 
 def build_ai_reply(
     clinic_id: str,
     incoming_text: str,
     phone: str,
+    message_id: Optional[str] = None,
 ) -> str:
+    """
+    message_id (el id del mensaje de WhatsApp) hace idempotente la reserva:
+    si Meta reenvía el mismo mensaje, se responde con el turno ya creado.
+    """
     treatments = _get_treatments_names(clinic_id)
     ai = _extract_with_openai(incoming_text, treatments)
 
@@ -176,23 +158,35 @@ def build_ai_reply(
         sug_date, slots = _suggest_slots(clinic_id, treatment_id, date)
         if not sug_date:
             return "No encuentro horarios disponibles en los proximos dias."
-        sample = ", ".join(slots[:5]) if slots else ""
+        sample = ", ".join(slots[:SUGGESTED_SLOTS]) if slots else ""
         return f"Disponibilidad para {sug_date}: {sample}. Decime horario."
 
     patient_id = _ensure_patient(clinic_id, patient_name, phone)
     if not patient_id:
         return "No pude registrar el paciente, intenta de nuevo."
 
-    result = create_appointment(
-        clinic_id=clinic_id,
-        patient_id=patient_id,
-        patient_name=patient_name,
-        patient_phone=phone,
-        date=date,
-        start_time=time,
-        treatment_id=treatment_id,
-        allow_double_booking=False,
-    )
+    booking = {
+        "clinic_id": clinic_id,
+        "patient_id": patient_id,
+        "patient_name": patient_name,
+        "patient_phone": phone,
+        "date": date,
+        "start_time": time,
+        "treatment_id": treatment_id,
+        "allow_double_booking": False,
+    }
+    if message_id:
+        try:
+            result, _ = appointment_idempotency.run(
+                ("whatsapp", clinic_id, message_id),
+                booking,
+                lambda: create_appointment(**booking),
+            )
+        except IdempotencyConflict:
+            # La IA interpretó distinto el mismo mensaje: no reservar dos veces
+            return "Ya registre tu pedido de turno, en breve te confirmamos."
+    else:
+        result = create_appointment(**booking)
     if result.get("error"):
         return f"No pude agendar: {result['error']}. Decime otro horario."
 
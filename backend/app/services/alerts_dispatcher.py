@@ -1,6 +1,7 @@
 from typing import Any, Dict, Optional, List
 from app.main import supabase
 from app.services.alerts_sender import send_email, send_webhook, send_whatsapp
+from app.services.whatsapp_accounts import sender_credentials
 
 
 def _build_message(event_type: str, payload: Dict[str, Any]) -> str:
@@ -35,7 +36,7 @@ def dispatch_alerts(
             if channel == "webhook":
                 ok, error = send_webhook(target, {"event_type": event_type, "payload": payload})
             elif channel == "whatsapp":
-                ok, error = send_whatsapp(target, message)
+                ok, error = send_whatsapp(target, message, **sender_credentials(clinic_id))
             else:
                 ok, error = send_email(target, f"Alert: {event_type}", message)
 
@@ -3,7 +3,7 @@ import os
 import smtplib
 import urllib.request
 from email.message import EmailMessage
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
 
 def _post_json(url: str, payload: Dict[str, Any], headers: Dict[str, str]) -> Tuple[bool, str]:
@@ -48,9 +48,15 @@ def send_email(target: str, subject: str, body: str) -> Tuple[bool, str]:
         return False, str(exc)
 
 
-def send_whatsapp(target: str, body: str) -> Tuple[bool, str]:
-    token = os.getenv("WHATSAPP_TOKEN")
-    phone_id = os.getenv("WHATSAPP_PHONE_NUMBER_ID")
+def send_whatsapp(
+    target: str,
+    body: str,
+    phone_number_id: Optional[str] = None,
+    token: Optional[str] = None,
+) -> Tuple[bool, str]:
+    # Credenciales de la cuenta de la clínica (whatsapp_accounts) o las del .env
+    token = token or os.getenv("WHATSAPP_TOKEN")
+    phone_id = phone_number_id or os.getenv("WHATSAPP_PHONE_NUMBER_ID")
     if not token or not phone_id or not target:
         return False, "whatsapp config missing"
 
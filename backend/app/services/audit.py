@@ -1,7 +1,27 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from app.main import supabase
 
 
+def audit_rows(
+    clinic_id: str,
+    action: str,
+    entity: str,
+    entries: List[Tuple[str, Optional[Dict[str, Any]]]],
+    actor_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    return [
+        {
+            "clinic_id": clinic_id,
+            "actor_id": actor_id,
+            "action": action,
+            "entity": entity,
+            "entity_id": entity_id,
+            "changes": changes or {},
+        }
+        for entity_id, changes in entries
+    ]
+
+
 def log_audit(
     clinic_id: str,
     action: str,
@@ -12,14 +32,7 @@ def log_audit(
 ) -> None:
     try:
         supabase.table("audit_logs").insert(
-            {
-                "clinic_id": clinic_id,
-                "actor_id": actor_id,
-                "action": action,
-                "entity": entity,
-                "entity_id": entity_id,
-                "changes": changes or {},
-            }
+            audit_rows(clinic_id, action, entity, [(entity_id, changes)], actor_id)[0]
         ).execute()
     except Exception:
         # best-effort
@@ -1,5 +1,6 @@
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from app.main import supabase
+from app.services.treatment_catalog import get_treatment
 
 
 def _render_template(template: str, data: Dict[str, Any]) -> str:
@@ -9,17 +10,11 @@ def _render_template(template: str, data: Dict[str, Any]) -> str:
     return result
 
 
-def _get_treatment_name(treatment_id: Optional[str]) -> str:
-    if not treatment_id:
+def _get_treatment_name(clinic_id: str, treatment_id: Optional[str]) -> str:
+    treatment = get_treatment(clinic_id, treatment_id)
+    if not treatment:
         return ""
-    res = (
-        supabase.table("treatments")
-        .select("name")
-        .eq("id", treatment_id)
-        .single()
-        .execute()
-    )
-    return res.data.get("name") if res.data else ""
+    return treatment.get("name") or ""
 
 
 def _get_patient_contact(clinic_id: str, patient_id: Optional[str], patient_name: str):
@@ -99,7 +94,7 @@ def run_automations_for_appointment(trigger: str, appointment: Dict[str, Any]):
     )
     rules_list = rules.data or []
 
-    treatment_name = _get_treatment_name(appointment.get("treatment_id"))
+    treatment_name = _get_treatment_name(clinic_id, appointment.get("treatment_id"))
     contact = _get_patient_contact(
         clinic_id,
         appointment.get("patient_id"),
@@ -132,6 +127,125 @@ def run_automations_for_appointment(trigger: str, appointment: Dict[str, Any]):
     return created_messages
 
 
+def _thread_key(appointment: Dict[str, Any], contact: Dict[str, str]):
+    if appointment.get("patient_id"):
+        return ("patient_id", appointment["patient_id"])
+    if contact.get("contact_number"):
+        return ("contact_number", contact["contact_number"])
+    return None
+
+
+def run_automations_for_appointments(trigger: str, appointments: List[Dict[str, Any]]):
+    """
+    Batched run_automations_for_appointment: per clinic, one rules query,
+    one patients query, one threads lookup, one insert for the missing
+    threads and one multi-row insert for the messages.
+    """
+    by_clinic: Dict[str, List[Dict[str, Any]]] = {}
+    for appointment in appointments:
+        if appointment.get("clinic_id"):
+            by_clinic.setdefault(appointment["clinic_id"], []).append(appointment)
+
+    created_messages = []
+    for clinic_id, clinic_appointments in by_clinic.items():
+        rules_list = (
+            supabase.table("automation_rules")
+            .select("*")
+            .eq("clinic_id", clinic_id)
+            .eq("trigger", trigger)
+            .eq("enabled", True)
+            .execute()
+        ).data or []
+        if not rules_list:
+            continue
+
+        patient_ids = sorted({a["patient_id"] for a in clinic_appointments if a.get("patient_id")})
+        patients = {}
+        if patient_ids:
+            patients = {
+                p["id"]: p
+                for p in (
+                    supabase.table("patients")
+                    .select("id,full_name,phone")
+                    .eq("clinic_id", clinic_id)
+                    .in_("id", patient_ids)
+                    .execute()
+                ).data or []
+            }
+
+        contacts = []
+        for appointment in clinic_appointments:
+            patient = patients.get(appointment.get("patient_id")) or {}
+            contacts.append(
+                {
+                    "contact_name": patient.get("full_name") or appointment.get("patient_name", ""),
+                    "contact_number": patient.get("phone") or "",
+                }
+            )
+
+        keys = [_thread_key(a, c) for a, c in zip(clinic_appointments, contacts)]
+        threads: Dict[Any, Dict[str, Any]] = {}
+        for column in ("patient_id", "contact_number"):
+            values = sorted({key[1] for key in keys if key and key[0] == column})
+            if not values:
+                continue
+            for thread in (
+                supabase.table("message_threads")
+                .select("*")
+                .eq("clinic_id", clinic_id)
+                .in_(column, values)
+                .execute()
+            ).data or []:
+                threads.setdefault((column, thread.get(column)), thread)
+
+        missing = {}
+        for appointment, contact, key in zip(clinic_appointments, contacts, keys):
+            if key and key not in threads and key not in missing:
+                missing[key] = {
+                    "clinic_id": clinic_id,
+                    "patient_id": appointment.get("patient_id"),
+                    "contact_number": contact.get("contact_number") or "",
+                    "contact_name": contact.get("contact_name", appointment.get("patient_name", "")),
+                    "channel": "whatsapp",
+                }
+        if missing:
+            created = supabase.table("message_threads").insert(list(missing.values())).execute()
+            for key, thread in zip(missing, created.data or []):
+                threads[key] = thread
+
+        messages = []
+        for appointment, contact, key in zip(clinic_appointments, contacts, keys):
+            if key is None:
+                # Sin paciente ni teléfono: mismo criterio que el camino individual
+                thread = _ensure_thread(clinic_id, None, "", contact.get("contact_name", ""))
+            else:
+                thread = threads.get(key)
+            if not thread:
+                continue
+            context = {
+                "patient_name": appointment.get("patient_name", ""),
+                "date": appointment.get("date", ""),
+                "time": appointment.get("start_time", ""),
+                "treatment": _get_treatment_name(clinic_id, appointment.get("treatment_id")),
+                "clinic_id": clinic_id,
+            }
+            for rule in rules_list:
+                messages.append(
+                    {
+                        "clinic_id": clinic_id,
+                        "thread_id": thread["id"],
+                        "direction": "out",
+                        "body": _render_template(rule.get("template", ""), context),
+                        "status": "sent",
+                    }
+                )
+        if messages:
+            res = supabase.table("messages").insert(messages).execute()
+            created_messages.extend(res.data or [])
+
+    return created_messages
+
+
 def run_automations_for_date(clinic_id: str, trigger: str, date: str):
     appointments = (
         supabase.table("appointments")
@@ -141,7 +255,4 @@ def run_automations_for_date(clinic_id: str, trigger: str, date: str):
         .eq("status", "pending")
         .execute()
     )
-    created = []
-    for apt in appointments.data or []:
-        created.extend(run_automations_for_appointment(trigger, apt))
-    return created
+    return run_automations_for_appointments(trigger, appointments.data or [])
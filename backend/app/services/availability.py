@@ -1,40 +1,309 @@
-from datetime import datetime, timedelta, date
-from typing import List, Dict
+from bisect import bisect_right
+from collections import deque
+from datetime import date
+from functools import lru_cache
+from typing import Dict, Iterable, List, Sequence, Tuple
 
-def _parse_time_hhmm(value: str) -> datetime:
+# Ventana abierta del día en minutos desde medianoche: (inicio, fin)
+Window = Tuple[int, int]
+
+MINUTES_PER_DAY = 24 * 60
+
+# Filtro PostgREST de turnos que ocupan lugar. neq("status", "cancelled")
+# descarta también status NULL; la RPC book_appointment los cuenta
+# (coalesce(status, '') <> 'cancelled'), así que se usa este or_.
+NOT_CANCELLED_FILTER = "status.is.null,status.neq.cancelled"
+
+# Tabla precalculada minuto -> "HH:MM": formatear es un acceso a lista.
+_HHMM = [f"{m // 60:02d}:{m % 60:02d}" for m in range(MINUTES_PER_DAY + 1)]
+
+
+@lru_cache(maxsize=4096)
+def parse_hhmm(value: str) -> int:
+    """
+    Convierte 'HH:MM' (o 'HH:MM:SS', como lo devuelve Postgres) a minutos
+    desde medianoche.
+    """
+    parts = value.split(":")
+    if len(parts) < 2:
+        raise ValueError(f"Hora inválida: {value!r}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > MINUTES_PER_DAY:
+        raise ValueError(f"Hora inválida: {value!r}")
+    return hours * 60 + minutes
+
+
+def format_hhmm(minutes: int) -> str:
+    """Convierte minutos desde medianoche a 'HH:MM'."""
+    return _HHMM[minutes]
+
+
+def format_slots(slot_minutes: Iterable[int]) -> List[str]:
+    """Formatea una secuencia de slots en minutos a 'HH:MM' (borde de la API)."""
+    return [_HHMM[m] for m in slot_minutes]
+
+
+def build_open_windows(
+    open_minute: int,
+    close_minute: int,
+    breaks: Sequence[Window] = (),
+) -> Tuple[Window, ...]:
+    """
+    Recorta la jornada [open, close) con las pausas (almuerzo, reuniones...).
+
+    Las pausas pueden venir desordenadas, solaparse o salirse de la jornada.
+    Devuelve ventanas ordenadas y disjuntas.
+    """
+    if close_minute <= open_minute:
+        return ()
+
+    windows: List[Window] = []
+    cursor = open_minute
+    for b_start, b_end in sorted(breaks):
+        if b_end <= cursor or b_end <= b_start:
+            continue
+        if b_start >= close_minute:
+            break
+        if b_start > cursor:
+            windows.append((cursor, b_start))
+        cursor = max(cursor, b_end)
+    if cursor < close_minute:
+        windows.append((cursor, close_minute))
+    return tuple(windows)
+
+
+def generate_slot_minutes(
+    windows: Sequence[Window],
+    duration_minutes: int,
+    buffer_minutes: int = 0,
+) -> Tuple[int, ...]:
+    """
+    Genera inicios de slot (minutos) dentro de cada ventana.
+
+    Cada slot ocupa duration_minutes y el siguiente empieza tras
+    buffer_minutes de margen. Un slot es válido si entra completo en su
+    ventana: inicio + duration <= fin de ventana.
+    """
+    if duration_minutes <= 0:
+        return ()
+    step = duration_minutes + max(buffer_minutes, 0)
+    slots: List[int] = []
+    for w_start, w_end in windows:
+        slots.extend(range(w_start, w_end - duration_minutes + 1, step))
+    return tuple(slots)
+
+
+def settings_break_windows(settings: Dict) -> Tuple[Window, ...]:
+    """
+    Pausas configuradas en clinic_settings: almuerzo (lunch_start/lunch_end)
+    más cualquier entrada de breaks [{"start": "HH:MM", "end": "HH:MM"}].
+    """
+    breaks: List[Window] = []
+    lunch_start = settings.get("lunch_start")
+    lunch_end = settings.get("lunch_end")
+    if lunch_start and lunch_end:
+        breaks.append((parse_hhmm(lunch_start), parse_hhmm(lunch_end)))
+    for item in settings.get("breaks") or []:
+        if item.get("start") and item.get("end"):
+            breaks.append((parse_hhmm(item["start"]), parse_hhmm(item["end"])))
+    return tuple(breaks)
+
+
+@lru_cache(maxsize=8192)
+def _cached_day_slots(
+    open_time: str,
+    close_time: str,
+    breaks: Tuple[Window, ...],
+    duration_minutes: int,
+    buffer_minutes: int,
+) -> Tuple[int, ...]:
+    windows = build_open_windows(parse_hhmm(open_time), parse_hhmm(close_time), breaks)
+    return generate_slot_minutes(windows, duration_minutes, buffer_minutes)
+
+
+def day_slot_minutes(settings: Dict, duration_minutes: int) -> Tuple[int, ...]:
+    """
+    Slots de un día laborable para una configuración de clínica, en minutos.
+
+    El resultado depende sólo de horarios, pausas, duración y buffer, así que
+    se memoiza: miles de clínicas con la misma jornada comparten la tupla.
+    """
+    return _cached_day_slots(
+        settings.get("open_time") or "09:00",
+        settings.get("close_time") or "18:00",
+        settings_break_windows(settings),
+        int(duration_minutes),
+        int(settings.get("buffer_between_appointments") or 0),
+    )
+
+
+class OccupancyTimeline:
+    """
+    Ocupación de un día como función escalonada, armada con un barrido
+    (sweep line) sobre los intervalos [inicio, fin) de los turnos.
+
+    Cada turno se expande buffer_minutes a ambos lados, así un slot nuevo
+    respeta el margen antes y después de los turnos existentes.
+    """
+
+    def __init__(self, intervals: Iterable[Window], buffer_minutes: int = 0) -> None:
+        buffer_minutes = max(buffer_minutes, 0)
+        deltas: Dict[int, int] = {}
+        for start, end in intervals:
+            if end <= start:
+                continue
+            deltas[start - buffer_minutes] = deltas.get(start - buffer_minutes, 0) + 1
+            deltas[end + buffer_minutes] = deltas.get(end + buffer_minutes, 0) - 1
+
+        # points[i] marca desde dónde rige levels[i]; antes de points[0] y
+        # después del último punto la ocupación es 0.
+        self.points: List[int] = sorted(deltas)
+        self.levels: List[int] = []
+        level = 0
+        for point in self.points:
+            level += deltas[point]
+            self.levels.append(level)
+
+    def max_overlap(self, start: int, end: int) -> int:
+        """Ocupación máxima dentro de [start, end)."""
+        i = bisect_right(self.points, start) - 1
+        peak = self.levels[i] if i >= 0 else 0
+        i += 1
+        while i < len(self.points) and self.points[i] < end:
+            peak = max(peak, self.levels[i])
+            i += 1
+        return peak
+
+    def free_slots(
+        self,
+        slot_starts: Sequence[int],
+        duration_minutes: int,
+        capacity: int,
+    ) -> List[int]:
+        """
+        Slots (ordenados) cuyo intervalo [s, s + duration) nunca alcanza
+        capacity. Ventana deslizante con deque monótona: O(turnos + slots).
+        """
+        points, levels = self.points, self.levels
+        n = len(points)
+        if n == 0:
+            return list(slot_starts) if capacity > 0 else []
+
+        free: List[int] = []
+        window: deque = deque()  # índices de segmento con niveles decrecientes
+        nxt = 0  # próximo segmento a entrar en la ventana
+        for start in slot_starts:
+            end = start + duration_minutes
+            while nxt < n and points[nxt] < end:
+                while window and levels[window[-1]] <= levels[nxt]:
+                    window.pop()
+                window.append(nxt)
+                nxt += 1
+            # El segmento i termina en points[i + 1]; el último no termina
+            while window and window[0] + 1 < n and points[window[0] + 1] <= start:
+                window.popleft()
+            peak = levels[window[0]] if window else 0
+            if peak < capacity:
+                free.append(start)
+        return free
+
+
+# Pesos del ranking de slots: pegarse a un turno/borde suma, dejar un hueco
+# más corto que el turno más corto posible (inutilizable) resta.
+ADJACENT_SCORE = 2
+HOLE_PENALTY = 3
+
+
+def rank_slots(
+    slot_starts: Sequence[int],
+    duration_minutes: int,
+    timeline: OccupancyTimeline,
+    windows: Sequence[Window],
+    min_gap: int,
+) -> List[int]:
     """
-    Convierte 'HH:MM' a datetime (fecha dummy), para operar con timedelta.
+    Ordena slots libres según cuánto compactan el día (mejor primero).
+
+    Los bordes son los cambios de ocupación del timeline (turnos con buffer)
+    y los límites de las ventanas abiertas (apertura, almuerzo, pausas,
+    cierre). Para cada slot se mira el hueco que deja a cada lado: 0 suma
+    ADJACENT_SCORE, menor que min_gap resta HOLE_PENALTY. Empates: hueco
+    más chico y después más temprano. Una sola pasada con dos punteros, ya
+    que inicios y fines de los slots crecen juntos.
     """
-    return datetime.strptime(value, "%H:%M")
+    edges = sorted(set(timeline.points).union(*windows))
+    n = len(edges)
+    scored: List[Tuple[int, int, int]] = []
+    left = 0  # primer borde > start
+    right = 0  # primer borde >= end
+    for start in slot_starts:
+        end = start + duration_minutes
+        while left < n and edges[left] <= start:
+            left += 1
+        while right < n and edges[right] < end:
+            right += 1
+        gaps = (
+            start - edges[left - 1] if left else None,
+            edges[right] - end if right < n else None,
+        )
+        score = 0
+        for gap in gaps:
+            if gap == 0:
+                score += ADJACENT_SCORE
+            elif gap is not None and gap < min_gap:
+                score -= HOLE_PENALTY
+        smallest = min((g for g in gaps if g is not None), default=MINUTES_PER_DAY)
+        scored.append((-score, smallest, start))
+    scored.sort()
+    return [start for _, _, start in scored]
+
 
 def generate_slots(start_time: str, end_time: str, duration_minutes: int):
     """
     Genera slots en formato 'HH:MM' desde start_time a end_time,
     avanzando duration_minutes.
     Ej: start=09:00 end=12:00 duration=30 => 09:00,09:30,10:00...
-    
-    Maneja almuerzo si está configurado.
     """
-    if duration_minutes <= 0:
-        return []
+    windows = build_open_windows(parse_hhmm(start_time), parse_hhmm(end_time))
+    return format_slots(generate_slot_minutes(windows, duration_minutes))
+
+
+class BlockedIndex:
+    """
+    Fechas y períodos bloqueados compilados una sola vez:
+    set de ordinales para fechas sueltas y intervalos ordenados y fusionados
+    para períodos. Consulta O(log n) por fecha.
+    """
 
-    start_dt = _parse_time_hhmm(start_time)
-    end_dt = _parse_time_hhmm(end_time)
+    def __init__(self, blocked_dates: Iterable[str], blocked_periods: Iterable[Dict]) -> None:
+        self.dates = {date.fromisoformat(d).toordinal() for d in blocked_dates or [] if d}
 
-    # Si end <= start, no hay rango válido
-    if end_dt <= start_dt:
-        return []
+        intervals = sorted(
+            (date.fromisoformat(p["start"]).toordinal(), date.fromisoformat(p["end"]).toordinal())
+            for p in blocked_periods or []
+            if p.get("start") and p.get("end") and p["start"] <= p["end"]
+        )
+        merged: List[List[int]] = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._starts = [m[0] for m in merged]
+        self._ends = [m[1] for m in merged]
 
-    step = timedelta(minutes=duration_minutes)
-    slots = []
-    current = start_dt
+    def is_blocked_ordinal(self, ordinal: int) -> bool:
+        if ordinal in self.dates:
+            return True
+        i = bisect_right(self._starts, ordinal) - 1
+        return i >= 0 and ordinal <= self._ends[i]
 
-    # Slot válido si entra completo en el rango: current + duration <= end
-    while current + step <= end_dt:
-        slots.append(current.strftime("%H:%M"))
-        current += step
+    def is_blocked(self, check_date: str) -> bool:
+        return self.is_blocked_ordinal(date.fromisoformat(check_date).toordinal())
 
-    return slots
+    def blocked_mask(self, days: Iterable[date]) -> List[bool]:
+        """Consulta masiva: para cada fecha, si está bloqueada."""
+        return [self.is_blocked_ordinal(d.toordinal()) for d in days]
 
 
 def is_date_blocked(
@@ -48,20 +317,17 @@ def is_date_blocked(
     blocked_dates: lista de strings "YYYY-MM-DD"
     blocked_periods: lista de {"start": "YYYY-MM-DD", "end": "YYYY-MM-DD"}
     check_date: "YYYY-MM-DD"
+
+    Para consultas repetidas sobre la misma configuración usar BlockedIndex.
     """
-    # Check directos
     if check_date in blocked_dates:
         return True
-    
-    # Check en períodos
-    check_dt = datetime.strptime(check_date, "%Y-%m-%d")
+
+    # Fechas ISO: la comparación de strings equivale a la de fechas
     for period in blocked_periods:
-        start_dt = datetime.strptime(period["start"], "%Y-%m-%d")
-        end_dt = datetime.strptime(period["end"], "%Y-%m-%d")
-        
-        if start_dt <= check_dt <= end_dt:
+        if period["start"] <= check_date <= period["end"]:
             return True
-    
+
     return False
 
 
@@ -72,52 +338,10 @@ def is_work_day(work_days: List[int], check_date: str) -> bool:
     work_days: [0=Lun, 1=Mar, 2=Mié, 3=Jue, 4=Vie]
     check_date: "YYYY-MM-DD"
     """
-    dt = datetime.strptime(check_date, "%Y-%m-%d")
-    weekday = dt.weekday()  # 0=Lun, 6=Dom
-    
-    return weekday in work_days
+    return date.fromisoformat(check_date).weekday() in work_days
 
 
-def get_available_dates(
-    work_days: List[int],
-    blocked_dates: List[str],
-    blocked_periods: List[Dict],
-    days_ahead: int = 30
-) -> List[Dict]:
-    """
-    Retorna próximas N fechas disponibles.
-    
-    Returns:
-        [
-            {"date": "2026-01-27", "day_name": "Lunes", "available": True},
-            ...
-        ]
-    """
-    available_dates = []
-    current_date = datetime.now()
-    
-    day_names = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
-    
-    for i in range(days_ahead):
-        check_date = current_date + timedelta(days=i)
-        date_str = check_date.strftime("%Y-%m-%d")
-        
-        # No incluir fechas pasadas
-        if check_date.date() < date.today():
-            continue
-        
-        is_available = (
-            is_work_day(work_days, date_str) and
-            not is_date_blocked(blocked_dates, blocked_periods, date_str)
-        )
-        
-        available_dates.append({
-            "date": date_str,
-            "day_name": day_names[check_date.weekday()],
-            "available": is_available
-        })
-    
-    return available_dates
+DAY_NAMES = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo"]
 
 
 def generate_slots_with_lunch(
@@ -132,27 +356,10 @@ def generate_slots_with_lunch(
     """
     if not lunch_start or not lunch_end:
         return generate_slots(start_time, end_time, duration_minutes)
-    
-    # Slots antes de almuerzo
-    lunch_start_dt = _parse_time_hhmm(lunch_start)
-    morning_slots = []
-    
-    start_dt = _parse_time_hhmm(start_time)
-    step = timedelta(minutes=duration_minutes)
-    current = start_dt
-    
-    while current + step <= lunch_start_dt:
-        morning_slots.append(current.strftime("%H:%M"))
-        current += step
-    
-    # Slots después de almuerzo
-    lunch_end_dt = _parse_time_hhmm(lunch_end)
-    end_dt = _parse_time_hhmm(end_time)
-    afternoon_slots = []
-    
-    current = lunch_end_dt
-    while current + step <= end_dt:
-        afternoon_slots.append(current.strftime("%H:%M"))
-        current += step
-    
-    return morning_slots + afternoon_slots
+
+    windows = build_open_windows(
+        parse_hhmm(start_time),
+        parse_hhmm(end_time),
+        [(parse_hhmm(lunch_start), parse_hhmm(lunch_end))],
+    )
+    return format_slots(generate_slot_minutes(windows, duration_minutes))
@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+_registry: List["TTLCache"] = []
+
+
+class TTLCache:
+    """
+    Process-wide cache with per-entry TTL, explicit invalidation and hit/miss
+    counters. Thread-safe: sync FastAPI routes run in a threadpool.
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int = 10000) -> None:
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        _registry.append(self)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires_at"] <= time.monotonic():
+                return None
+            return entry["value"]
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expires_at"] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry["value"]
+            self.misses += 1
+
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def derive(self, key: Hashable, name: str, value: Any, builder: Callable[[Any], Any]) -> Any:
+        """
+        Memoize builder(value) on the cache entry that holds value, so derived
+        structures are rebuilt only when the entry is reloaded or invalidated.
+        Falls back to an uncached build when value is no longer the cached one.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["value"] is value:
+                derived = entry.setdefault("derived", {})
+                if name in derived:
+                    return derived[name]
+            else:
+                entry = None
+
+        result = builder(value)
+        if entry is not None:
+            with self._lock:
+                entry.setdefault("derived", {})[name] = result
+        return result
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one key, or every entry when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def cache_stats() -> List[Dict[str, Any]]:
+    return [cache.stats() for cache in _registry]
@@ -0,0 +1,235 @@
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.main import supabase
+from app.services.availability import (
+    MINUTES_PER_DAY,
+    NOT_CANCELLED_FILTER,
+    BlockedIndex,
+    build_open_windows,
+    day_slot_minutes,
+    parse_hhmm,
+    settings_break_windows,
+)
+from app.services.clinic_calendar import clinic_today
+from app.services.treatment_catalog import get_treatment_catalog
+
+# Tope del período simulado: la matriz de ocupación es de días x 1440 minutos
+MAX_SIMULATION_DAYS = 731
+
+# Campos de ClinicSettings que se pueden variar en una simulación
+SIMULATED_FIELDS = {
+    "open_time",
+    "close_time",
+    "lunch_start",
+    "lunch_end",
+    "breaks",
+    "work_days",
+    "blocked_dates",
+    "blocked_periods",
+    "slot_minutes",
+    "max_appointments_per_day",
+    "buffer_between_appointments",
+    "max_appointments_per_slot",
+    "allow_double_booking",
+    "overbooking_extra_fee",
+    "overbooking_fee_type",
+}
+
+
+class Demand:
+    """
+    Demanda histórica en arrays paralelos: un elemento por pedido de turno,
+    en orden de llegada (created_at, o fecha/hora si falta).
+    """
+
+    def __init__(self, first_day: date, rows: List[Dict], catalog_rows: List[Dict]) -> None:
+        treatments = {t["id"]: t for t in catalog_rows if t.get("id")}
+        rows = sorted(
+            (r for r in rows if r.get("date") and r.get("start_time")),
+            key=lambda r: (r.get("created_at") or "", r["date"], r["start_time"]),
+        )
+        self.first_day = first_day
+        self.day = np.array(
+            [date.fromisoformat(r["date"]).toordinal() - first_day.toordinal() for r in rows],
+            dtype=np.int64,
+        )
+        self.start = np.array([parse_hhmm(r["start_time"]) for r in rows], dtype=np.int64)
+        # Duración del tratamiento (0 = usar slot_minutes de la configuración)
+        self.treatment_minutes = np.array(
+            [int((treatments.get(r.get("treatment_id")) or {}).get("duration_minutes") or 0) for r in rows],
+            dtype=np.int64,
+        )
+        self.base_price = np.array(
+            [float((treatments.get(r.get("treatment_id")) or {}).get("base_price") or 0) for r in rows],
+            dtype=np.float64,
+        )
+        self.arrival = np.arange(len(rows), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.arrival)
+
+
+def _snap_to_grid(settings: Dict, start: np.ndarray, duration: np.ndarray) -> np.ndarray:
+    """Slot de la grilla más cercano al horario pedido (-1 si no hay grilla)."""
+    snapped = np.full(len(start), -1, dtype=np.int64)
+    for minutes in np.unique(duration):
+        grid = np.array(day_slot_minutes(settings, int(minutes)), dtype=np.int64)
+        mask = duration == minutes
+        if len(grid) < 2:
+            snapped[mask] = grid[0] if len(grid) else -1
+            continue
+        pos = np.clip(np.searchsorted(grid, start[mask]), 1, len(grid) - 1)
+        left, right = grid[pos - 1], grid[pos]
+        snapped[mask] = np.where(np.abs(start[mask] - left) <= np.abs(right - start[mask]), left, right)
+    return snapped
+
+
+def simulate(settings: Dict, demand: Demand, n_days: int) -> Dict[str, Any]:
+    """
+    Reproduce la demanda contra una configuración y devuelve métricas.
+
+    Cada pedido se ubica en el slot de la grilla (availability.day_slot_minutes)
+    más cercano a su horario y se acepta con las mismas reglas que
+    create_appointment: día abierto, ocupación (buffer incluido) menor a la
+    capacidad y límite diario; si se superpone con otro turno es sobreturno
+    y paga recargo. El orden de llegada se respeta dentro de cada día y los
+    días son independientes, así que la ronda k evalúa a la vez el k-ésimo
+    pedido de todos los días sobre una matriz día x minuto.
+
+    utilization = minutos reservados / (minutos abiertos x turnos simultáneos
+    permitidos), así que nunca supera 1.
+    """
+    total = len(demand)
+    allow_overbooking = bool(settings.get("allow_double_booking"))
+    capacity = max(int(settings.get("max_appointments_per_slot") or 1), 1) if allow_overbooking else 1
+    max_per_day = int(settings.get("max_appointments_per_day") or 20)
+    buffer_minutes = max(int(settings.get("buffer_between_appointments") or 0), 0)
+    default_minutes = int(settings.get("slot_minutes") or 30)
+
+    work_days = set(settings.get("work_days", [0, 1, 2, 3, 4]))
+    blocked = BlockedIndex(settings.get("blocked_dates") or [], settings.get("blocked_periods") or [])
+    first_ordinal = demand.first_day.toordinal()
+    day_open = np.array(
+        [
+            date.fromordinal(first_ordinal + i).weekday() in work_days
+            and not blocked.is_blocked_ordinal(first_ordinal + i)
+            for i in range(n_days)
+        ],
+        dtype=bool,
+    )
+    windows = build_open_windows(
+        parse_hhmm(settings.get("open_time") or "09:00"),
+        parse_hhmm(settings.get("close_time") or "18:00"),
+        settings_break_windows(settings),
+    )
+    open_minutes = sum(end - start for start, end in windows) * int(day_open.sum())
+
+    duration = np.where(demand.treatment_minutes > 0, demand.treatment_minutes, default_minutes)
+    start = _snap_to_grid(settings, demand.start, duration)
+    day = np.clip(demand.day, 0, n_days - 1)
+    candidate = (demand.day >= 0) & (demand.day < n_days) & day_open[day] & (start >= 0)
+    end = np.minimum(start + duration, MINUTES_PER_DAY)
+    # El buffer se suma al final: dos turnos chocan si quedan a menos de buffer
+    busy_end = np.minimum(end + buffer_minutes, MINUTES_PER_DAY)
+
+    # Pedidos candidatos ordenados por (día, llegada) y su ronda = posición en el día
+    queue = np.flatnonzero(candidate)
+    queue = queue[np.lexsort((demand.arrival[queue], day[queue]))]
+    queue_days = day[queue]
+    rank = np.arange(len(queue)) - np.searchsorted(queue_days, queue_days, side="left")
+
+    load = np.zeros((n_days, MINUTES_PER_DAY), dtype=np.int16)
+    booked_per_day = np.zeros(n_days, dtype=np.int64)
+    minutes = np.arange(MINUTES_PER_DAY)
+    accepted = np.zeros(total, dtype=bool)
+    overbooked = np.zeros(total, dtype=bool)
+    rejected_capacity = 0
+    rejected_daily = 0
+    for k in range(int(rank.max()) + 1 if len(rank) else 0):
+        batch = queue[rank == k]  # a lo sumo un pedido por día
+        rows = day[batch]
+        span = (minutes >= start[batch, None]) & (minutes < busy_end[batch, None])
+        peak = np.where(span, load[rows], 0).max(axis=1)
+        fits = peak < capacity
+        under_limit = booked_per_day[rows] < max_per_day
+        ok = fits & under_limit
+        rejected_capacity += int((~fits).sum())
+        rejected_daily += int((fits & ~under_limit).sum())
+
+        accepted[batch[ok]] = True
+        overbooked[batch[ok]] = peak[ok] > 0
+        load[rows[ok]] += span[ok]
+        booked_per_day[rows[ok]] += 1
+
+    fee_value = float(settings.get("overbooking_extra_fee") or 0)
+    if settings.get("overbooking_fee_type", "fixed") == "percent":
+        fees = demand.base_price * fee_value / 100
+    else:
+        fees = np.full(total, fee_value)
+    booked_minutes = int((end - start)[accepted].sum())
+
+    return {
+        "requests": total,
+        "accepted": int(accepted.sum()),
+        "rejected": total - int(accepted.sum()),
+        "rejected_closed": total - len(queue),
+        "rejected_capacity": rejected_capacity,
+        "rejected_daily_limit": rejected_daily,
+        "booked_minutes": booked_minutes,
+        "open_minutes": open_minutes,
+        "slot_capacity": capacity,
+        "utilization": round(booked_minutes / (open_minutes * capacity), 4) if open_minutes else 0.0,
+        "overbooked": int(overbooked.sum()),
+        "extra_fee_revenue": round(float(fees[overbooked].sum()), 2),
+    }
+
+
+def load_demand(clinic_id: str, start_date: date, end_date: date) -> Demand:
+    """Turnos no cancelados del período, en una sola consulta."""
+    res = (
+        supabase.table("appointments")
+        .select("date,start_time,treatment_id,status,created_at")
+        .eq("clinic_id", clinic_id)
+        .gte("date", start_date.isoformat())
+        .lte("date", end_date.isoformat())
+        .or_(NOT_CANCELLED_FILTER)
+        .execute()
+    )
+    return Demand(start_date, res.data or [], get_treatment_catalog(clinic_id).rows)
+
+
+def run_capacity_simulation(
+    clinic_id: str,
+    settings: Dict,
+    configs: Sequence[Dict],
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Simula la configuración actual y cada candidata (overrides de
+    SIMULATED_FIELDS sobre settings) contra la demanda del período
+    (por defecto, los últimos 365 días, como mucho MAX_SIMULATION_DAYS).
+    """
+    last = date.fromisoformat(end_date) if end_date else clinic_today(settings) - timedelta(days=1)
+    first = date.fromisoformat(start_date) if start_date else last - timedelta(days=364)
+    if last < first:
+        raise ValueError("start_date debe ser anterior a end_date")
+    n_days = (last - first).days + 1
+    if n_days > MAX_SIMULATION_DAYS:
+        raise ValueError(f"Rango máximo {MAX_SIMULATION_DAYS} días")
+    demand = load_demand(clinic_id, first, last)
+
+    results = []
+    for overrides in [{}] + list(configs):
+        candidate = {**settings, **{k: v for k, v in overrides.items() if k in SIMULATED_FIELDS}}
+        results.append({"config": overrides, **simulate(candidate, demand, n_days)})
+    return {
+        "clinic_id": clinic_id,
+        "from": first.isoformat(),
+        "to": last.isoformat(),
+        "baseline": results[0],
+        "candidates": results[1:],
+    }
@@ -0,0 +1,73 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+import pytz
+
+from app.services.availability import DAY_NAMES, BlockedIndex
+
+DEFAULT_TIMEZONE = "America/Argentina/Buenos_Aires"
+
+
+@lru_cache(maxsize=512)
+def _get_timezone(name: Optional[str]) -> pytz.BaseTzInfo:
+    try:
+        return pytz.timezone(name or DEFAULT_TIMEZONE)
+    except pytz.UnknownTimeZoneError:
+        return pytz.timezone(DEFAULT_TIMEZONE)
+
+
+def clinic_now(settings: Dict) -> datetime:
+    """Fecha y hora local de la clínica (ClinicSettings.timezone)."""
+    return datetime.now(_get_timezone(settings.get("timezone")))
+
+
+def clinic_today(settings: Dict) -> date:
+    """Día actual en la zona horaria de la clínica, no la del servidor."""
+    return clinic_now(settings).date()
+
+
+class ClinicCalendar:
+    """
+    Días de la clínica desde su "hoy" local, con metadatos ya calculados
+    (nombre, laborable, bloqueado, disponible). Se arma una vez por versión
+    de settings y día local; los dicts son compartidos y de solo lectura.
+    """
+
+    def __init__(
+        self,
+        settings: Dict,
+        blocked_index: BlockedIndex,
+        today: date,
+        horizon_days: int = 90,
+    ) -> None:
+        self.today = today
+        self._work_days = set(settings.get("work_days", [0, 1, 2, 3, 4]))
+        self._blocked_index = blocked_index
+        self._days = self._build(0, horizon_days)
+
+    def _build(self, start: int, count: int) -> List[Dict]:
+        days = [self.today + timedelta(days=i) for i in range(start, count)]
+        built = []
+        for day, is_blocked in zip(days, self._blocked_index.blocked_mask(days)):
+            work_day = day.weekday() in self._work_days
+            built.append(
+                {
+                    "date": day.isoformat(),
+                    "day_name": DAY_NAMES[day.weekday()],
+                    "work_day": work_day,
+                    "blocked": is_blocked,
+                    "available": work_day and not is_blocked,
+                }
+            )
+        return built
+
+    def days(self, count: int) -> List[Dict]:
+        """Los próximos count días (hoy incluido)."""
+        if count <= len(self._days):
+            return self._days[:count]
+        # Más allá del horizonte: se calcula sin guardar (objeto compartido)
+        return self._days + self._build(len(self._days), count)
+
+    def open_dates(self, count: int) -> List[str]:
+        return [d["date"] for d in self.days(count) if d["available"]]
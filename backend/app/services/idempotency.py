@@ -0,0 +1,64 @@
+import json
+import os
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from app.services.cache import TTLCache
+from app.services.single_flight import SingleFlight
+
+
+class IdempotencyConflict(ValueError):
+    """La misma clave llegó con un payload distinto al original."""
+
+
+class IdempotencyStore:
+    """
+    Resultados por clave de idempotencia (header Idempotency-Key, id del
+    mensaje de WhatsApp). Un reintento dentro del TTL devuelve el resultado
+    guardado sin volver a validar ni insertar; los duplicados concurrentes
+    esperan al primero (SingleFlight) en lugar de correr en paralelo.
+
+    Acotado: TTLCache descarta las claves más viejas al superar max_entries.
+    Es por proceso; con varios workers cada uno tiene su propio store.
+    Las excepciones no se guardan: el cliente puede reintentar.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float, max_entries: int) -> None:
+        self._results = TTLCache(name, ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._flight = SingleFlight(name)
+
+    @staticmethod
+    def fingerprint(payload: Any) -> str:
+        return json.dumps(payload, sort_keys=True, default=str)
+
+    def run(self, key: Hashable, payload: Any, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Ejecuta fn una sola vez por key y devuelve (resultado, replayed).
+        Lanza IdempotencyConflict si key ya se usó con otro payload.
+        """
+        fingerprint = self.fingerprint(payload)
+        stored = self._results.get(key)
+        if stored is None:
+            owner = object()
+            stored = self._flight.do(key, lambda: self._execute(key, fingerprint, owner, fn))
+            # Quien esperó al líder también recibe una repetición
+            replayed = stored["owner"] is not owner
+        else:
+            replayed = True
+        if stored["fingerprint"] != fingerprint:
+            raise IdempotencyConflict("Idempotency-Key reutilizada con otro payload")
+        return stored["result"], replayed
+
+    def _execute(self, key: Hashable, fingerprint: str, owner: object, fn: Callable[[], Any]) -> Dict:
+        stored = self._results.get(key)
+        if stored is not None:
+            return stored
+        stored = {"fingerprint": fingerprint, "result": fn(), "owner": owner}
+        self._results.set(key, stored)
+        return stored
+
+
+appointment_idempotency = IdempotencyStore(
+    "appointment_idempotency",
+    ttl_seconds=float(os.getenv("IDEMPOTENCY_TTL") or "86400"),
+    max_entries=int(os.getenv("IDEMPOTENCY_MAX_KEYS") or "50000"),
+)
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import anyio
+from postgrest.exceptions import APIError
+
+from app.main import supabase
+from app.services.alerts_dispatcher import dispatch_alerts
+from app.services.audit import audit_rows
+from app.services.automation_runner import run_automations_for_appointments
+from app.services.realtime import broadcast_change
+from app.services.socket_server import broadcast_change as socket_broadcast_change
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or "100")
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS") or "2")
+OUTBOX_LEASE_SECONDS = int(os.getenv("OUTBOX_LEASE_SECONDS") or "60")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or "8")
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS") or "5")
+OUTBOX_INSERT_ATTEMPTS = int(os.getenv("OUTBOX_INSERT_ATTEMPTS") or "2")
+
+# Tabla inexistente: 42P01 de Postgres, PGRST205 del schema cache de PostgREST
+_MISSING_TABLE_CODES = {"42P01", "PGRST205"}
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+# ===============================
+# EFECTOS (lo que registran las rutas)
+# ===============================
+def effect_broadcast(event: str, data: Dict[str, Any]) -> Dict:
+    return {"kind": "broadcast", "payload": {"event": event, "data": data}}
+
+
+def effect_automations(trigger: str, appointments: List[Dict[str, Any]]) -> Dict:
+    return {"kind": "automations", "payload": {"trigger": trigger, "appointments": appointments}}
+
+
+def effect_audit(
+    clinic_id: str,
+    action: str,
+    entity: str,
+    entries: List[Tuple[str, Optional[Dict[str, Any]]]],
+    actor_id: Optional[str] = None,
+) -> Dict:
+    return {"kind": "audit", "payload": {"rows": audit_rows(clinic_id, action, entity, entries, actor_id)}}
+
+
+def effect_event(event_type: str, payload: Dict[str, Any]) -> Dict:
+    return {"kind": "event", "payload": {"event_type": event_type, "payload": payload}}
+
+
+def _split(clinic_id: Optional[str], effect: Dict) -> List[Tuple[Optional[str], str, Dict]]:
+    """
+    (clinic_id, kind, payload) de cada fila: una clínica y una escritura por
+    fila, para que reintentar una fila no repita lo que otra ya hizo.
+    """
+    kind, payload = effect["kind"], effect["payload"]
+    if kind == "event":
+        # system_events y alertas son escrituras independientes
+        return [(clinic_id, "event", payload), (clinic_id, "alerts", payload)]
+    if kind == "automations":
+        by_clinic: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for appointment in payload["appointments"]:
+            by_clinic.setdefault(appointment.get("clinic_id") or clinic_id, []).append(appointment)
+        return [
+            (owner, kind, {"trigger": payload["trigger"], "appointments": appointments})
+            for owner, appointments in by_clinic.items()
+        ]
+    return [(clinic_id, kind, payload)]
+
+
+def record_effects(clinic_id: Optional[str], effects: List[Dict]) -> None:
+    """
+    Registra los efectos en outbox_events (un insert) y despierta al
+    dispatcher. La ruta no espera SMTP, webhooks ni WhatsApp.
+
+    Cada fila es un solo efecto de una sola clínica: un evento se guarda
+    como dos filas (system_events y alertas) y las automatizaciones, una
+    fila por clínica. Así un reintento no vuelve a insertar mensajes ni
+    eventos que ya se escribieron.
+
+    Si la tabla no existe (SQL_OUTBOX.sql sin aplicar) los efectos corren en
+    línea, como antes. Cualquier otro error se reintenta hasta
+    OUTBOX_INSERT_ATTEMPTS veces y después se propaga: la ruta no vuelve a
+    esperar SMTP ni webhooks por un error transitorio.
+    """
+    if not effects:
+        return
+    now = _utcnow().isoformat()
+    rows = [
+        {
+            "clinic_id": owner,
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "available_at": now,
+        }
+        for effect in effects
+        for owner, kind, payload in _split(clinic_id, effect)
+    ]
+    for attempt in range(1, OUTBOX_INSERT_ATTEMPTS + 1):
+        try:
+            supabase.table("outbox_events").insert(rows).execute()
+            break
+        except Exception as exc:
+            if isinstance(exc, APIError) and exc.code in _MISSING_TABLE_CODES:
+                logger.warning("outbox_events missing; running %d effects inline", len(rows))
+                _run_inline(rows)
+                return
+            if attempt == OUTBOX_INSERT_ATTEMPTS:
+                logger.exception("outbox insert failed; %d effects not recorded", len(rows))
+                raise
+    outbox_dispatcher.wake()
+
+
+def _run_inline(rows: List[Dict]) -> None:
+    for row in rows:
+        try:
+            _run_sync(row)
+        except Exception:
+            # best-effort, como los efectos en línea originales
+            continue
+
+
+# ===============================
+# HANDLERS
+# ===============================
+def _run_sync(row: Dict) -> None:
+    kind, payload, clinic_id = row["kind"], row.get("payload") or {}, row.get("clinic_id")
+    if kind == "broadcast":
+        broadcast_change(clinic_id, payload["event"], payload["data"])
+    elif kind == "automations":
+        # Una clínica por fila: los mensajes salen en un solo insert multi-fila
+        run_automations_for_appointments(payload["trigger"], payload["appointments"])
+    elif kind == "audit":
+        supabase.table("audit_logs").insert(payload["rows"]).execute()
+    elif kind == "event":
+        supabase.table("system_events").insert(
+            {"clinic_id": clinic_id, "event_type": payload["event_type"], "payload": payload["payload"]}
+        ).execute()
+    elif kind == "alerts":
+        dispatch_alerts(payload["event_type"], payload["payload"], clinic_id=clinic_id)
+    else:
+        raise ValueError(f"Tipo de efecto desconocido: {kind}")
+
+
+def _handle_audit(rows: List[Dict]) -> None:
+    # Todas las filas de auditoría del lote en un solo insert (todo o nada)
+    supabase.table("audit_logs").insert(
+        [audit for row in rows for audit in row["payload"]["rows"]]
+    ).execute()
+
+
+# ===============================
+# CLAIM / ACK
+# ===============================
+_claim_rpc_available = True
+
+
+def claim_batch(limit: int = OUTBOX_BATCH_SIZE) -> List[Dict]:
+    """Eventos listos para procesar, alquilados por OUTBOX_LEASE_SECONDS."""
+    global _claim_rpc_available
+
+    if _claim_rpc_available:
+        try:
+            res = supabase.rpc(
+                "claim_outbox_events",
+                {"p_limit": limit, "p_lease_seconds": OUTBOX_LEASE_SECONDS},
+            ).execute()
+            return res.data or []
+        except APIError as exc:
+            # PGRST202: la función no está desplegada; un solo dispatcher sin SKIP LOCKED
+            if exc.code != "PGRST202":
+                raise
+            _claim_rpc_available = False
+            logger.warning(
+                "claim_outbox_events not deployed (SQL_OUTBOX.sql): claiming without SKIP LOCKED, "
+                "which is only safe with a single dispatcher process"
+            )
+
+    now = _utcnow()
+    rows = (
+        supabase.table("outbox_events")
+        .select("*")
+        .eq("status", "pending")
+        .lte("available_at", now.isoformat())
+        .order("available_at")
+        .limit(limit)
+        .execute()
+    ).data or []
+    lease = (now + timedelta(seconds=OUTBOX_LEASE_SECONDS)).isoformat()
+    for row in rows:
+        row["attempts"] = int(row.get("attempts") or 0) + 1
+        row["available_at"] = lease
+    if rows:
+        supabase.table("outbox_events").upsert(rows).execute()
+    return rows
+
+
+def _retry_delay(attempts: int) -> float:
+    return OUTBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+
+
+def _finish(done: List[Dict], failed: List[Tuple[Dict, str]]) -> None:
+    now = _utcnow()
+    if done:
+        supabase.table("outbox_events").update(
+            {"status": "done", "processed_at": now.isoformat(), "last_error": None}
+        ).in_("id", [row["id"] for row in done]).execute()
+    for row, error in failed:
+        attempts = int(row.get("attempts") or 1)
+        update = {"last_error": error[:1000]}
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            update.update({"status": "failed", "processed_at": now.isoformat()})
+        else:
+            update["available_at"] = (now + timedelta(seconds=_retry_delay(attempts))).isoformat()
+        supabase.table("outbox_events").update(update).eq("id", row["id"]).execute()
+
+
+# ===============================
+# DISPATCHER
+# ===============================
+class OutboxDispatcher:
+    """
+    Tarea asyncio que drena outbox_events en lotes: broadcasts en el loop,
+    el resto en el threadpool (la auditoría del lote en un solo insert). Un fallo reprograma el evento con backoff exponencial; tras
+    OUTBOX_MAX_ATTEMPTS queda en status failed.
+    """
+
+    def __init__(self, batch_size: int = OUTBOX_BATCH_SIZE, poll_seconds: float = OUTBOX_POLL_SECONDS) -> None:
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def wake(self) -> None:
+        """Llamable desde cualquier hilo (rutas sync en el threadpool)."""
+        if self._loop is not None and self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                # loop cerrado
+                return
+
+    async def _run(self) -> None:
+        while True:
+            # Se limpia antes de drenar: un wake() durante el lote no se pierde
+            self._wake.clear()
+            try:
+                handled = await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("outbox dispatch failed")
+                handled = 0
+            if handled < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain_once(self) -> int:
+        rows = await anyio.to_thread.run_sync(claim_batch, self.batch_size)
+        if not rows:
+            return 0
+        done: List[Dict] = []
+        failed: List[Tuple[Dict, str]] = []
+
+        grouped: Dict[str, List[Dict]] = {}
+        for row in rows:
+            grouped.setdefault(row["kind"], []).append(row)
+
+        for row in grouped.pop("broadcast", []):
+            payload = row.get("payload") or {}
+            try:
+                await socket_broadcast_change(row.get("clinic_id"), payload["event"], payload["data"])
+                done.append(row)
+            except Exception as exc:
+                failed.append((row, str(exc)))
+
+        # La auditoría se agrupa en un insert atómico; el resto va fila por
+        # fila para que un fallo reintente solo esa clínica y ese efecto
+        audit = grouped.pop("audit", [])
+        if audit:
+            try:
+                await anyio.to_thread.run_sync(_handle_audit, audit)
+                done.extend(audit)
+            except Exception as exc:
+                failed.extend((row, str(exc)) for row in audit)
+
+        for row in (row for group in grouped.values() for row in group):
+            try:
+                await anyio.to_thread.run_sync(_run_sync, row)
+                done.append(row)
+            except Exception as exc:
+                failed.append((row, str(exc)))
+
+        await anyio.to_thread.run_sync(_finish, done, failed)
+        with self._lock:
+            self.batches += 1
+            self.processed += len(done)
+            self.failed += sum(1 for row, _ in failed if int(row.get("attempts") or 1) >= OUTBOX_MAX_ATTEMPTS)
+            self.retried += sum(1 for row, _ in failed if int(row.get("attempts") or 1) < OUTBOX_MAX_ATTEMPTS)
+        return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._task is not None and not self._task.done(),
+                "batches": self.batches,
+                "processed": self.processed,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
+
+
+outbox_dispatcher = OutboxDispatcher()
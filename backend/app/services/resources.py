@@ -0,0 +1,230 @@
+import os
+from datetime import date
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.main import supabase
+from app.services.availability import (
+    MINUTES_PER_DAY,
+    build_open_windows,
+    parse_hhmm,
+    settings_break_windows,
+)
+from app.services.cache import TTLCache
+
+# Resolución de los bitsets: un bit = GRAIN_MINUTES minutos del día
+GRAIN_MINUTES = 5
+GRAINS_PER_DAY = MINUTES_PER_DAY // GRAIN_MINUTES
+
+_resource_cache = TTLCache(
+    "resource_catalog",
+    ttl_seconds=float(os.getenv("RESOURCE_CATALOG_CACHE_TTL") or "300"),
+)
+
+
+class ResourceCatalog:
+    """
+    Enabled resources (dentists, chairs...) of one clinic and which of them
+    each treatment may use. A treatment needs one free resource of every
+    kind the clinic has: eligibility narrows the kinds it mentions, and a
+    kind it does not mention (e.g. only dentists listed) still requires any
+    resource of that kind, so chairs cannot be overbooked.
+    """
+
+    def __init__(self, resources: List[Dict], eligibility: List[Dict]) -> None:
+        self.resources = [r for r in resources if r.get("enabled", True) and r.get("id")]
+        self.by_id = {r["id"]: r for r in self.resources}
+        self.by_kind: Dict[str, List[str]] = {}
+        for resource in self.resources:
+            self.by_kind.setdefault(resource.get("kind") or "dentist", []).append(resource["id"])
+        self.eligible: Dict[str, List[str]] = {}
+        for row in eligibility:
+            if row.get("resource_id") in self.by_id:
+                self.eligible.setdefault(row["treatment_id"], []).append(row["resource_id"])
+
+    def requirements(self, treatment_id: Optional[str]) -> Dict[str, List[str]]:
+        """kind -> eligible resource ids for a treatment (every kind of the clinic)."""
+        eligible = set(self.eligible.get(treatment_id) or []) if treatment_id else set()
+        groups: Dict[str, List[str]] = {}
+        for kind, ids in self.by_kind.items():
+            narrowed = [resource_id for resource_id in ids if resource_id in eligible]
+            groups[kind] = narrowed or list(ids)
+        return groups
+
+
+def resource_hours_error(
+    settings: Dict,
+    work_days: Optional[List[int]] = None,
+    open_time: Optional[str] = None,
+    close_time: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Los horarios de un recurso solo pueden acotar los de la clínica: la
+    grilla de turnos sale del horario de la clínica. None si son válidos.
+    """
+    clinic_days = settings.get("work_days", [0, 1, 2, 3, 4])
+    if work_days is not None and not set(work_days) <= set(clinic_days):
+        return "work_days del recurso fuera de los días de la clínica"
+    clinic_open = parse_hhmm(settings.get("open_time") or "09:00")
+    clinic_close = parse_hhmm(settings.get("close_time") or "18:00")
+    try:
+        start = parse_hhmm(open_time) if open_time else clinic_open
+        end = parse_hhmm(close_time) if close_time else clinic_close
+    except ValueError:
+        return "Horario inválido (HH:MM)"
+    if start < clinic_open or end > clinic_close:
+        return "Horario del recurso fuera del horario de la clínica"
+    if start >= end:
+        return "open_time debe ser anterior a close_time"
+    return None
+
+
+def _load_catalog(clinic_id: str) -> ResourceCatalog:
+    resources = (
+        supabase.table("resources")
+        .select("*")
+        .eq("clinic_id", clinic_id)
+        .execute()
+    )
+    eligibility = (
+        supabase.table("treatment_resources")
+        .select("treatment_id,resource_id")
+        .eq("clinic_id", clinic_id)
+        .execute()
+    )
+    return ResourceCatalog(resources.data or [], eligibility.data or [])
+
+
+def get_resource_catalog(clinic_id: str) -> ResourceCatalog:
+    return _resource_cache.get_or_load(clinic_id, lambda: _load_catalog(clinic_id))
+
+
+def invalidate_resource_catalog(clinic_id: str) -> None:
+    _resource_cache.invalidate(clinic_id)
+
+
+def uses_resources(settings: Dict) -> bool:
+    return bool(settings.get("resource_scheduling"))
+
+
+def _grain_span(start: int, end: int) -> Tuple[int, int]:
+    """Grains covered by [start, end) minutes, rounding outwards."""
+    return start // GRAIN_MINUTES, -(-end // GRAIN_MINUTES)
+
+
+def _span_mask(lo: int, hi: int) -> int:
+    lo, hi = max(lo, 0), min(hi, GRAINS_PER_DAY)
+    if hi <= lo:
+        return 0
+    return ((1 << (hi - lo)) - 1) << lo
+
+
+def runs_mask(free: int, length: int) -> int:
+    """Bit i set iff bits i .. i + length - 1 of free are all set (O(log length))."""
+    result, span = free, 1
+    while span < length:
+        step = min(span, length - span)
+        result &= result >> step
+        span += step
+    return result
+
+
+class ResourceDay:
+    """
+    Free-time bitsets of every resource for one day: the resource's work
+    hours minus clinic breaks minus its appointments (widened by the clinic
+    buffer). Built once per day and reused for any treatment or duration.
+    """
+
+    def __init__(
+        self,
+        settings: Dict,
+        catalog: ResourceCatalog,
+        day: str,
+        intervals: Sequence[Tuple[int, int, Sequence[str]]],
+    ) -> None:
+        self.catalog = catalog
+        weekday = date.fromisoformat(day).weekday()
+        breaks = settings_break_windows(settings)
+        buffer_minutes = int(settings.get("buffer_between_appointments") or 0)
+        clinic_open = parse_hhmm(settings.get("open_time") or "09:00")
+        clinic_close = parse_hhmm(settings.get("close_time") or "18:00")
+
+        self.free: Dict[str, int] = {}
+        for resource in catalog.resources:
+            # Los horarios del recurso solo acotan los de la clínica (filas viejas incluidas)
+            clinic_days = settings.get("work_days", [0, 1, 2, 3, 4])
+            work_days = resource.get("work_days")
+            if work_days is None:
+                work_days = clinic_days
+            if weekday not in work_days or weekday not in clinic_days:
+                self.free[resource["id"]] = 0
+                continue
+            windows = build_open_windows(
+                max(clinic_open, parse_hhmm(resource.get("open_time") or settings.get("open_time") or "09:00")),
+                min(clinic_close, parse_hhmm(resource.get("close_time") or settings.get("close_time") or "18:00")),
+                breaks,
+            )
+            mask = 0
+            for w_start, w_end in windows:
+                # Las ventanas de trabajo se redondean hacia adentro
+                mask |= _span_mask(-(-w_start // GRAIN_MINUTES), w_end // GRAIN_MINUTES)
+            self.free[resource["id"]] = mask
+
+        for start, end, resource_ids in intervals:
+            busy = _span_mask(*_grain_span(start - buffer_minutes, end + buffer_minutes))
+            targets = [r for r in resource_ids if r in self.free]
+            if not targets:
+                # Turno sin recursos asignados (previo a recursos): ocupa el
+                # primer recurso libre de cada tipo para no sobrevender.
+                targets = self._first_free_per_kind(busy)
+            for resource_id in targets:
+                self.free[resource_id] &= ~busy
+
+    def _first_free_per_kind(self, busy: int) -> List[str]:
+        chosen: Dict[str, str] = {}
+        for resource in self.catalog.resources:
+            kind = resource.get("kind") or "dentist"
+            if kind not in chosen and self.free[resource["id"]] & busy == busy:
+                chosen[kind] = resource["id"]
+        return list(chosen.values())
+
+    def free_slots(self, treatment_id: Optional[str], slot_starts: Sequence[int], duration: int) -> List[int]:
+        """Slots where every required kind has at least one eligible free resource."""
+        groups = self.catalog.requirements(treatment_id)
+        if not groups:
+            return []
+        startable: Dict[int, int] = {}
+        result: List[int] = []
+        for start in slot_starts:
+            lo, hi = _grain_span(start, start + duration)
+            length = hi - lo
+            mask = startable.get(length)
+            if mask is None:
+                mask = -1
+                for resource_ids in groups.values():
+                    kind_mask = 0
+                    for resource_id in resource_ids:
+                        kind_mask |= runs_mask(self.free.get(resource_id, 0), length)
+                    mask &= kind_mask
+                startable[length] = mask
+            if mask >> lo & 1:
+                result.append(start)
+        return result
+
+    def assign(self, treatment_id: Optional[str], start: int, duration: int) -> Optional[List[str]]:
+        """
+        One free eligible resource per required kind at start, or None. A
+        clinic without enabled resources has nothing to assign: None, like
+        free_slots showing no slots, never an empty (unconstrained) booking.
+        """
+        groups = self.catalog.requirements(treatment_id)
+        if not groups:
+            return None
+        busy = _span_mask(*_grain_span(start, start + duration))
+        chosen: List[str] = []
+        for resource_ids in groups.values():
+            resource_id = next((r for r in resource_ids if self.free.get(r, 0) & busy == busy), None)
+            if resource_id is None:
+                return None
+            chosen.append(resource_id)
+        return chosen
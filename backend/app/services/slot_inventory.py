@@ -0,0 +1,245 @@
+import threading
+import time
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.services.availability import OccupancyTimeline, day_slot_minutes, format_slots
+from app.services.single_flight import SingleFlight
+
+# (clinic_id, start_date, end_date) -> {date: [appointment rows]}
+RangeLoader = Callable[[str, str, str], Dict[str, List[Dict]]]
+# (clinic_id, settings, rows) -> timeline of that day
+TimelineBuilder = Callable[[str, Dict, List[Dict]], OccupancyTimeline]
+# settings -> the clinic's current local date
+TodayFn = Callable[[Dict], date]
+
+
+class _ClinicInventory:
+    def __init__(self, first_day: date, last_day: date, settings: Dict) -> None:
+        self.first_day = first_day
+        self.last_day = last_day
+        self.settings = settings
+        self.built_at = time.monotonic()
+        self.rows_by_id: Dict[str, Dict] = {}
+        self.rows_by_date: Dict[str, Dict[str, Dict]] = {}
+        self.timelines: Dict[str, OccupancyTimeline] = {}
+        # (date, duration, max_per_slot) -> ["HH:MM", ...]
+        self.slots: Dict[Tuple[str, int, int], List[str]] = {}
+
+    def covers(self, day: str) -> bool:
+        return self.first_day.isoformat() <= day <= self.last_day.isoformat()
+
+
+class SlotInventory:
+    """
+    Rolling, precomputed free-slot inventory per clinic, day and duration.
+
+    A clinic is loaded with one range query over the horizon; afterwards
+    reads are dictionary lookups and appointment writes update only the
+    affected days (apply_change). Settings changes and the TTL (which also
+    picks up writes from other processes) trigger a rebuild.
+
+    The range query runs outside the lock, coalesced per clinic, so one
+    clinic's rebuild never stalls another clinic's reads; changes applied
+    while it is in flight are replayed on the new inventory before it is
+    swapped in.
+    """
+
+    def __init__(
+        self,
+        loader: RangeLoader,
+        timeline_builder: TimelineBuilder,
+        horizon_days: int = 60,
+        ttl_seconds: float = 300,
+        today: TodayFn = lambda settings: date.today(),
+    ) -> None:
+        self.loader = loader
+        self.timeline_builder = timeline_builder
+        self.today = today
+        self.horizon_days = horizon_days
+        self.ttl_seconds = ttl_seconds
+        self._clinics: Dict[str, _ClinicInventory] = {}
+        self._lock = threading.RLock()
+        self._loads = SingleFlight("slot_inventory")
+        # clinic_id -> changes seen while its range query is in flight
+        self._pending: Dict[str, List[Dict]] = {}
+        # clinic_id -> bumped by invalidate(), so a load started earlier is not kept
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.incremental_updates = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.horizon_days > 0
+
+    def _build(self, clinic_id: str, settings: Dict) -> _ClinicInventory:
+        first_day = self.today(settings)
+        last_day = first_day + timedelta(days=self.horizon_days - 1)
+        inventory = _ClinicInventory(first_day, last_day, settings)
+        by_date = self.loader(clinic_id, first_day.isoformat(), last_day.isoformat())
+        for day, rows in by_date.items():
+            for row in rows:
+                if row.get("id"):
+                    inventory.rows_by_id[row["id"]] = row
+                    inventory.rows_by_date.setdefault(day, {})[row["id"]] = row
+        return inventory
+
+    def _load(self, clinic_id: str, settings: Dict) -> _ClinicInventory:
+        with self._lock:
+            generation = self._generations.get(clinic_id, 0)
+            self._pending.setdefault(clinic_id, [])
+        try:
+            inventory = self._build(clinic_id, settings)
+        except BaseException:
+            with self._lock:
+                self._pending.pop(clinic_id, None)
+            raise
+        with self._lock:
+            for appointment in self._pending.pop(clinic_id, []):
+                self._apply(clinic_id, inventory, appointment)
+            if self._generations.get(clinic_id, 0) == generation:
+                self._clinics[clinic_id] = inventory
+            self.rebuilds += 1
+        return inventory
+
+    def _get(self, clinic_id: str, settings: Dict) -> _ClinicInventory:
+        with self._lock:
+            inventory = self._clinics.get(clinic_id)
+            if (
+                inventory is not None
+                and inventory.first_day == self.today(settings)
+                and time.monotonic() - inventory.built_at <= self.ttl_seconds
+            ):
+                if inventory.settings is not settings:
+                    # Settings row reloaded: slot grids may differ, appointments do not
+                    inventory.settings = settings
+                    inventory.timelines.clear()
+                    inventory.slots.clear()
+                return inventory
+        # Sin el lock: las demás clínicas siguen leyendo durante la consulta
+        return self._loads.do(clinic_id, lambda: self._load(clinic_id, settings))
+
+    def _timeline(self, clinic_id: str, inventory: _ClinicInventory, day: str) -> OccupancyTimeline:
+        timeline = inventory.timelines.get(day)
+        if timeline is None:
+            rows = list(inventory.rows_by_date.get(day, {}).values())
+            timeline = self.timeline_builder(clinic_id, inventory.settings, rows)
+            inventory.timelines[day] = timeline
+        return timeline
+
+    def get_slots(
+        self,
+        clinic_id: str,
+        settings: Dict,
+        day: str,
+        duration: int,
+        max_per_slot: int,
+    ) -> Optional[List[str]]:
+        """Free slots for an open day, or None when the day is outside the horizon."""
+        if not self.enabled:
+            return None
+        inventory = self._get(clinic_id, settings)
+        with self._lock:
+            if not inventory.covers(day):
+                return None
+            key = (day, duration, max_per_slot)
+            slots = inventory.slots.get(key)
+            if slots is not None:
+                self.hits += 1
+                return slots
+            self.misses += 1
+            timeline = self._timeline(clinic_id, inventory, day)
+            slots = format_slots(
+                timeline.free_slots(day_slot_minutes(inventory.settings, duration), duration, max_per_slot)
+            )
+            inventory.slots[key] = slots
+            return slots
+
+    def covers(self, clinic_id: str, settings: Dict, last_day: str) -> bool:
+        if not self.enabled:
+            return False
+        return self._get(clinic_id, settings).covers(last_day)
+
+    def apply_change(self, appointment: Dict) -> None:
+        """
+        Record a created/updated/cancelled appointment row and recompute only
+        the days it left and entered.
+        """
+        clinic_id = appointment.get("clinic_id")
+        if not clinic_id or not appointment.get("id"):
+            return
+        with self._lock:
+            if clinic_id in self._pending:
+                self._pending[clinic_id].append(appointment)
+            inventory = self._clinics.get(clinic_id)
+            if inventory is None:
+                return
+            self._apply(clinic_id, inventory, appointment)
+            self.incremental_updates += 1
+
+    def _apply(self, clinic_id: str, inventory: _ClinicInventory, appointment: Dict) -> None:
+        appointment_id = appointment["id"]
+        dirty = set()
+        previous = inventory.rows_by_id.pop(appointment_id, None)
+        if previous is not None:
+            dirty.add(previous.get("date"))
+            inventory.rows_by_date.get(previous.get("date"), {}).pop(appointment_id, None)
+            # Partial rows (e.g. a status-only update) keep the old times
+            appointment = {**previous, **appointment}
+
+        day = appointment.get("date")
+        if appointment.get("status") != "cancelled" and day and inventory.covers(day):
+            inventory.rows_by_id[appointment_id] = appointment
+            inventory.rows_by_date.setdefault(day, {})[appointment_id] = appointment
+            dirty.add(day)
+
+        for day in dirty:
+            self._refresh_day(clinic_id, inventory, day)
+
+    def _refresh_day(self, clinic_id: str, inventory: _ClinicInventory, day: str) -> None:
+        inventory.timelines.pop(day, None)
+        keys = [key for key in inventory.slots if key[0] == day]
+        if not keys:
+            return
+        timeline = self._timeline(clinic_id, inventory, day)
+        for key in keys:
+            _, duration, max_per_slot = key
+            inventory.slots[key] = format_slots(
+                timeline.free_slots(day_slot_minutes(inventory.settings, duration), duration, max_per_slot)
+            )
+
+    def invalidate(self, clinic_id: Optional[str] = None) -> None:
+        with self._lock:
+            clinic_ids = list(self._clinics) + list(self._pending) if clinic_id is None else [clinic_id]
+            for key in clinic_ids:
+                self._clinics.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def rebuild(self, clinic_id: str, settings: Dict) -> Dict[str, Any]:
+        """Drop and reload a clinic from the database (recovery command)."""
+        if not self.enabled:
+            return {"clinic_id": clinic_id, "enabled": False}
+        self.invalidate(clinic_id)
+        inventory = self._get(clinic_id, settings)
+        with self._lock:
+            return {
+                "clinic_id": clinic_id,
+                "enabled": True,
+                "from": inventory.first_day.isoformat(),
+                "to": inventory.last_day.isoformat(),
+                "appointments": len(inventory.rows_by_id),
+            }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "horizon_days": self.horizon_days,
+                "clinics": len(self._clinics),
+                "hits": self.hits,
+                "misses": self.misses,
+                "rebuilds": self.rebuilds,
+                "incremental_updates": self.incremental_updates,
+            }
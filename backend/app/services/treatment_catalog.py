@@ -0,0 +1,97 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.main import supabase
+from app.services.cache import TTLCache
+
+_catalog_cache = TTLCache(
+    "treatment_catalog",
+    ttl_seconds=float(os.getenv("TREATMENT_CATALOG_CACHE_TTL") or "300"),
+)
+
+# Un id desconocido recarga el catálogo de la clínica como mucho cada tantos
+# segundos: un tratamiento creado por otro proceso se ve sin esperar al TTL,
+# y un id basura o de otra clínica no recarga el catálogo en cada request.
+TREATMENT_CATALOG_MISS_REFRESH_SECONDS = float(os.getenv("TREATMENT_CATALOG_MISS_REFRESH_SECONDS") or "30")
+
+_miss_lock = threading.Lock()
+_last_miss_refresh: Dict[str, float] = {}
+
+
+def normalize_name(text: str) -> str:
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+class TreatmentCatalog:
+    """In-memory treatments of one clinic, indexed by id and normalized name."""
+
+    def __init__(self, rows: List[Dict]) -> None:
+        self.rows = rows
+        self.by_id: Dict[str, Dict] = {}
+        self.by_name: Dict[str, Dict] = {}
+        for row in rows:
+            if row.get("id"):
+                self.by_id[row["id"]] = row
+            name = normalize_name(row.get("name", ""))
+            if name:
+                self.by_name.setdefault(name, row)
+
+    def get(self, treatment_id: Optional[str]) -> Optional[Dict]:
+        return self.by_id.get(treatment_id) if treatment_id else None
+
+    def find_by_name(self, name: Optional[str]) -> Optional[Dict]:
+        """Exact normalized match first, then the first name containing it."""
+        needle = normalize_name(name or "")
+        if not needle:
+            return None
+        exact = self.by_name.get(needle)
+        if exact:
+            return exact
+        for key, row in self.by_name.items():
+            if needle in key:
+                return row
+        return None
+
+    def names(self) -> List[str]:
+        return [row["name"] for row in self.rows if row.get("name")]
+
+
+def _load_catalog(clinic_id: str) -> TreatmentCatalog:
+    res = (
+        supabase.table("treatments")
+        .select("*")
+        .eq("clinic_id", clinic_id)
+        .execute()
+    )
+    return TreatmentCatalog(res.data or [])
+
+
+def get_treatment_catalog(clinic_id: str) -> TreatmentCatalog:
+    return _catalog_cache.get_or_load(clinic_id, lambda: _load_catalog(clinic_id))
+
+
+def get_treatment(clinic_id: str, treatment_id: Optional[str]) -> Optional[Dict]:
+    """
+    Treatment row by id. A miss reloads the clinic catalog, in case the
+    treatment was created by another process after the catalog was cached,
+    at most once per TREATMENT_CATALOG_MISS_REFRESH_SECONDS per clinic.
+    """
+    if not treatment_id:
+        return None
+    treatment = get_treatment_catalog(clinic_id).get(treatment_id)
+    if treatment is not None:
+        return treatment
+    with _miss_lock:
+        now = time.monotonic()
+        if now - _last_miss_refresh.get(clinic_id, float("-inf")) < TREATMENT_CATALOG_MISS_REFRESH_SECONDS:
+            return None
+        _last_miss_refresh[clinic_id] = now
+    invalidate_treatment_catalog(clinic_id)
+    return get_treatment_catalog(clinic_id).get(treatment_id)
+
+
+def invalidate_treatment_catalog(clinic_id: str) -> None:
+    _catalog_cache.invalidate(clinic_id)
@@ -0,0 +1,343 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+import anyio
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WEBHOOK_QUEUE_PATH = os.getenv("WEBHOOK_QUEUE_PATH") or os.path.join(BACKEND_DIR, "webhook_queue.sqlite3")
+# Trabajo de I/O (base, OpenAI, Graph API): varios workers por core
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS") or str(min(32, (os.cpu_count() or 1) * 4)))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS") or "5")
+WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv("WEBHOOK_RETRY_BASE_SECONDS") or "2")
+
+# Ventana de muestras para los percentiles de espera y procesamiento
+_SAMPLES = 1000
+
+
+class SqliteQueueStore:
+    """
+    Respaldo local y durable de la cola: cada payload se escribe antes de
+    responder a Meta y se borra al procesarse. Al reiniciar, lo pendiente
+    vuelve a la cola. Los que agotan los reintentos quedan con status failed.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(
+            """
+            create table if not exists webhook_queue (
+              id integer primary key autoincrement,
+              payload text not null,
+              status text not null default 'pending',
+              attempts integer not null default 0,
+              last_error text,
+              enqueued_at real not null
+            )
+            """
+        )
+
+    def put(self, payload: Dict[str, Any], enqueued_at: float) -> int:
+        with self._lock:
+            cur = self._conn.execute(
+                "insert into webhook_queue (payload, enqueued_at) values (?, ?)",
+                (json.dumps(payload), enqueued_at),
+            )
+            return cur.lastrowid
+
+    def pending(self) -> List[Tuple[int, Dict[str, Any], float, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "select id, payload, enqueued_at, attempts from webhook_queue"
+                " where status = 'pending' order by id"
+            ).fetchall()
+        return [(row[0], json.loads(row[1]), row[2], row[3]) for row in rows]
+
+    def ack(self, item_id: int) -> None:
+        with self._lock:
+            self._conn.execute("delete from webhook_queue where id = ?", (item_id,))
+
+    def retry(self, item_id: int, attempts: int, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "update webhook_queue set attempts = ?, last_error = ? where id = ?",
+                (attempts, error[:1000], item_id),
+            )
+
+    def dead(self, item_id: int, attempts: int, error: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "update webhook_queue set status = 'failed', attempts = ?, last_error = ? where id = ?",
+                (attempts, error[:1000], item_id),
+            )
+
+    def count(self, status: str = "pending") -> int:
+        with self._lock:
+            return self._conn.execute(
+                "select count(*) from webhook_queue where status = ?", (status,)
+            ).fetchone()[0]
+
+
+class _Item:
+    __slots__ = ("id", "payload", "enqueued_at", "attempts", "key")
+
+    def __init__(
+        self,
+        item_id: int,
+        payload: Dict[str, Any],
+        enqueued_at: float,
+        attempts: int = 0,
+        key: Optional[Hashable] = None,
+    ) -> None:
+        self.id = item_id
+        self.payload = payload
+        self.enqueued_at = enqueued_at
+        self.attempts = attempts
+        self.key = key
+
+
+class KeyedLanes:
+    """
+    Per-key FIFO lanes for a worker pool. Items of one key run strictly one
+    at a time and in order; items of different keys run concurrently. An
+    item arriving while its key is owned waits in that key's lane, and the
+    worker that finishes the owner picks the next one up, so no worker ever
+    blocks on a busy key. Items with key None are never ordered.
+
+    Confined to the event loop thread: no locking needed.
+    """
+
+    def __init__(self) -> None:
+        self._owner: Dict[Hashable, int] = {}
+        self._waiting: Dict[Hashable, Deque[_Item]] = {}
+
+    def acquire(self, item: _Item) -> bool:
+        """True if item may run now; False if it was parked behind its key."""
+        if item.key is None:
+            return True
+        owner = self._owner.get(item.key)
+        if owner is None or owner == item.id:
+            self._owner[item.key] = item.id
+            return True
+        self._waiting.setdefault(item.key, deque()).append(item)
+        return False
+
+    def release(self, item: _Item) -> Optional[_Item]:
+        """Frees item's key and returns the next item of its lane, now owning it."""
+        if item.key is None:
+            return None
+        lane = self._waiting.get(item.key)
+        if not lane:
+            self._waiting.pop(item.key, None)
+            self._owner.pop(item.key, None)
+            return None
+        following = lane.popleft()
+        self._owner[item.key] = following.id
+        return following
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active_keys": len(self._owner),
+            "waiting": sum(len(lane) for lane in self._waiting.values()),
+        }
+
+
+def _summary(samples: Deque[float]) -> Dict[str, float]:
+    if not samples:
+        return {"avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "avg": round(sum(ordered) / len(ordered), 2),
+        "p50": round(ordered[len(ordered) // 2], 2),
+        "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+class WebhookQueue:
+    """
+    Cola "ack-first" del webhook: enqueue() persiste el payload y vuelve;
+    un pool de workers asyncio lo procesa con handler (sync, en el
+    threadpool). Fallos: reintento con backoff exponencial hasta
+    WEBHOOK_MAX_ATTEMPTS. Métricas: profundidad, en curso, espera y
+    tiempo de procesamiento (ms).
+
+    Con key_fn, los items de la misma clave (una conversación) se procesan
+    de a uno y en el orden de la cola, también entre reintentos: un item
+    que falla retiene su clave hasta resolverse. Claves distintas corren
+    en paralelo en todo el pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Dict[str, Any]], Any],
+        store: SqliteQueueStore,
+        workers: int = WEBHOOK_WORKERS,
+        max_attempts: int = WEBHOOK_MAX_ATTEMPTS,
+        key_fn: Optional[Callable[[Dict[str, Any]], Optional[Hashable]]] = None,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.key_fn = key_fn
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._lanes = KeyedLanes()
+        self._enqueue_lock: Optional[asyncio.Lock] = None
+        # Items aceptados y aún sin ack ni failed (incluye reintentos en espera y lanes)
+        self._unfinished = 0
+        self._idle: Optional[asyncio.Event] = None
+        self._lock = threading.Lock()
+        self._wait_ms: Deque[float] = deque(maxlen=_SAMPLES)
+        self._processing_ms: Deque[float] = deque(maxlen=_SAMPLES)
+        self.in_flight = 0
+        self.enqueued = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _item(self, item_id: int, payload: Dict[str, Any], enqueued_at: float, attempts: int = 0) -> _Item:
+        key = self.key_fn(payload) if self.key_fn is not None else None
+        return _Item(item_id, payload, enqueued_at, attempts, key)
+
+    def _put(self, item: _Item) -> None:
+        self._unfinished += 1
+        self._idle.clear()
+        self._queue.put_nowait(item)
+
+    def _done(self) -> None:
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._lanes = KeyedLanes()
+        self._enqueue_lock = asyncio.Lock()
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        # Lo que quedó sin procesar antes del último reinicio
+        for item_id, payload, enqueued_at, attempts in self.store.pending():
+            self._put(self._item(item_id, payload, enqueued_at, attempts))
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._queue = None
+        self._enqueue_lock = None
+        self._idle = None
+
+    async def enqueue(self, payload: Dict[str, Any]) -> int:
+        enqueued_at = time.time()
+        if self._enqueue_lock is None:
+            # Sin workers (tests, scripts): solo se persiste
+            item_id = await anyio.to_thread.run_sync(self.store.put, payload, enqueued_at)
+            with self._lock:
+                self.enqueued += 1
+            return item_id
+        # Mismo orden en SQLite y en la cola: el orden de una conversación sobrevive a un reinicio
+        async with self._enqueue_lock:
+            item_id = await anyio.to_thread.run_sync(self.store.put, payload, enqueued_at)
+            with self._lock:
+                self.enqueued += 1
+            if self._queue is not None:
+                self._put(self._item(item_id, payload, enqueued_at))
+        return item_id
+
+    async def _worker(self) -> None:
+        while True:
+            item = await self._queue.get()
+            self._queue.task_done()
+            if not self._lanes.acquire(item):
+                # Su conversación está en curso: el worker que la tiene lo retoma
+                continue
+            while item is not None:
+                retrying = await self._process(item)
+                # Un item que se reintenta conserva su clave; si no, sigue su lane
+                item = None if retrying else self._lanes.release(item)
+
+    async def _process(self, item: _Item) -> bool:
+        """Corre el handler; True si el item quedó programado para reintento."""
+        started = time.time()
+        with self._lock:
+            self.in_flight += 1
+            self._wait_ms.append((started - item.enqueued_at) * 1000)
+        try:
+            await anyio.to_thread.run_sync(self.handler, item.payload)
+        except Exception as exc:
+            logger.exception("%s: item %s failed", self.name, item.id)
+            return await self._failed(item, str(exc))
+        else:
+            await anyio.to_thread.run_sync(self.store.ack, item.id)
+            with self._lock:
+                self.processed += 1
+            self._done()
+            return False
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+                self._processing_ms.append((time.time() - started) * 1000)
+
+    async def _failed(self, item: _Item, error: str) -> bool:
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            await anyio.to_thread.run_sync(self.store.dead, item.id, item.attempts, error)
+            with self._lock:
+                self.failed += 1
+            self._done()
+            return False
+        await anyio.to_thread.run_sync(self.store.retry, item.id, item.attempts, error)
+        with self._lock:
+            self.retried += 1
+        delay = WEBHOOK_RETRY_BASE_SECONDS * (2 ** (item.attempts - 1))
+        queue = self._queue
+        asyncio.get_running_loop().call_later(delay, queue.put_nowait, item)
+        return True
+
+    async def join(self) -> None:
+        """Espera a que todo lo aceptado termine, reintentos incluidos (tests y apagado ordenado)."""
+        if self._idle is not None:
+            await self._idle.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "running": bool(self._tasks),
+                "workers": self.workers,
+                "depth": self._queue.qsize() if self._queue is not None else self.store.count(),
+                "in_flight": self.in_flight,
+                "conversations": self._lanes.stats(),
+                "enqueued": self.enqueued,
+                "processed": self.processed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "wait_ms": _summary(self._wait_ms),
+                "processing_ms": _summary(self._processing_ms),
+            }
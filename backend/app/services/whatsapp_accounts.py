@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.main import supabase
+from app.services.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Un número desconocido fuerza una recarga como mucho cada tantos segundos:
+# una cuenta dada de alta desde otro proceso se ve sin esperar al TTL, y
+# los payloads con ids basura no golpean la base en cada mensaje.
+WA_ACCOUNTS_MISS_REFRESH_SECONDS = float(os.getenv("WA_ACCOUNTS_MISS_REFRESH_SECONDS") or "30")
+
+_accounts_cache = TTLCache(
+    "whatsapp_accounts",
+    ttl_seconds=float(os.getenv("WA_ACCOUNTS_CACHE_TTL") or "300"),
+    max_entries=2,
+)
+_INDEX_KEY = "all"
+_FALLBACK_KEY = "fallback"
+_miss_lock = threading.Lock()
+_last_miss_refresh = 0.0
+
+
+class WhatsAppAccountIndex:
+    """
+    Routing table of the whole deployment: phone_number_id -> account and
+    clinic_id -> its first enabled account, both O(1) dict lookups.
+    """
+
+    def __init__(self, accounts: List[Dict]) -> None:
+        self.accounts = [a for a in accounts if a.get("enabled", True) and a.get("phone_number_id")]
+        self.by_phone_number_id: Dict[str, Dict] = {a["phone_number_id"]: a for a in self.accounts}
+        self.by_clinic: Dict[str, Dict] = {}
+        for account in self.accounts:
+            self.by_clinic.setdefault(account["clinic_id"], account)
+
+
+def _load_index() -> WhatsAppAccountIndex:
+    try:
+        accounts = supabase.table("whatsapp_accounts").select("*").execute().data or []
+    except Exception:
+        # SQL_WHATSAPP_ACCOUNTS.sql sin aplicar: un solo número, el del .env
+        logger.exception("whatsapp_accounts unavailable; using env credentials")
+        accounts = []
+    return WhatsAppAccountIndex(accounts)
+
+
+def _load_fallback_clinic_id() -> Dict[str, Optional[str]]:
+    # Envuelto en un dict: TTLCache no distingue un None guardado de un miss
+    clinic_id = os.getenv("DEFAULT_CLINIC_ID")
+    if not clinic_id:
+        first = supabase.table("clinic_settings").select("clinic_id").limit(1).execute()
+        clinic_id = first.data[0]["clinic_id"] if first.data else None
+    return {"clinic_id": clinic_id}
+
+
+def get_account_index() -> WhatsAppAccountIndex:
+    return _accounts_cache.get_or_load(_INDEX_KEY, _load_index)
+
+
+def fallback_clinic_id() -> Optional[str]:
+    """
+    Single-tenant default for numbers without an account: DEFAULT_CLINIC_ID,
+    else the first clinic_settings row. Cached like the index, so it is one
+    query per TTL instead of one per message.
+    """
+    return _accounts_cache.get_or_load(_FALLBACK_KEY, _load_fallback_clinic_id)["clinic_id"]
+
+
+def invalidate_whatsapp_accounts() -> None:
+    _accounts_cache.invalidate()
+
+
+def account_for_phone_number_id(phone_number_id: Optional[str]) -> Optional[Dict]:
+    global _last_miss_refresh
+
+    if not phone_number_id:
+        return None
+    account = get_account_index().by_phone_number_id.get(phone_number_id)
+    if account is not None:
+        return account
+    with _miss_lock:
+        now = time.monotonic()
+        if now - _last_miss_refresh < WA_ACCOUNTS_MISS_REFRESH_SECONDS:
+            return None
+        _last_miss_refresh = now
+    invalidate_whatsapp_accounts()
+    return get_account_index().by_phone_number_id.get(phone_number_id)
+
+
+def resolve_clinic_id(phone_number_id: Optional[str], clinic_id: Optional[str] = None) -> Optional[str]:
+    """
+    Clínica dueña del número que recibió el mensaje. Sin cuenta registrada:
+    clinic_id explícito del payload o el fallback single-tenant.
+    """
+    account = account_for_phone_number_id(phone_number_id)
+    if account is not None:
+        return account["clinic_id"]
+    return clinic_id or fallback_clinic_id()
+
+
+def sender_credentials(clinic_id: Optional[str], phone_number_id: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """
+    kwargs de send_whatsapp para responder desde la cuenta de la clínica:
+    el número que recibió el mensaje si es suyo, si no su primera cuenta.
+    Vacío sin cuenta registrada (se usan WHATSAPP_TOKEN/WHATSAPP_PHONE_NUMBER_ID).
+    """
+    index = get_account_index()
+    account = index.by_phone_number_id.get(phone_number_id) if phone_number_id else None
+    if account is None or account["clinic_id"] != clinic_id:
+        account = index.by_clinic.get(clinic_id) if clinic_id else None
+    if account is None:
+        return {}
+    return {"phone_number_id": account["phone_number_id"], "token": account.get("access_token")}
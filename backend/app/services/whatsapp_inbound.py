@@ -0,0 +1,301 @@
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Tuple
+
+from app.main import supabase
+from app.services.agenda_logic import get_clinic_settings
+from app.services.ai_scheduler import build_ai_reply
+from app.services.alerts_sender import send_whatsapp
+from app.services.cache import TTLCache
+from app.services.webhook_queue import WEBHOOK_QUEUE_PATH, SqliteQueueStore, WebhookQueue
+from app.services.whatsapp_accounts import resolve_clinic_id, sender_credentials
+
+
+# Orden de los estados de Meta: un lote puede traer sent, delivered y read
+# del mismo mensaje; se aplica el más avanzado. failed siempre gana.
+STATUS_RANK = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+
+# wamids ya resueltos (guardados y, si tocaba, respondidos): los reenvíos de
+# Meta se descartan antes de tocar la base o la IA. Acotado (LRU + TTL); la
+# clave única en messages.wa_message_id y messages.replied_at cubren lo que
+# el proceso no vio (reinicios, otros workers).
+_seen_messages = TTLCache(
+    "whatsapp_seen_messages",
+    ttl_seconds=float(os.getenv("WA_DEDUP_TTL") or "172800"),
+    max_entries=int(os.getenv("WA_DEDUP_MAX_KEYS") or "200000"),
+)
+
+
+def is_duplicate_delivery(payload: Dict[str, Any]) -> bool:
+    """True si la entrega solo trae mensajes ya vistos (sin statuses)."""
+    seen_any = False
+    for value in iter_changes(payload):
+        if value.get("statuses"):
+            return False
+        for message in value.get("messages") or []:
+            if _seen_messages.get(message.get("id")) is None:
+                return False
+            seen_any = True
+    return seen_any
+
+
+def _message_body(message: Dict[str, Any]) -> str:
+    kind = message.get("type") or "text"
+    if kind == "text":
+        return (message.get("text") or {}).get("body") or ""
+    if kind == "button":
+        return (message.get("button") or {}).get("text") or ""
+    if kind == "interactive":
+        interactive = message.get("interactive") or {}
+        reply = interactive.get("button_reply") or interactive.get("list_reply") or {}
+        return reply.get("title") or ""
+    # image, audio, document, location...: se guarda el tipo
+    return f"[{kind}]"
+
+
+def iter_changes(payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Cada value de cada change de cada entry de la entrega."""
+    for entry in payload.get("entry") or []:
+        for change in entry.get("changes") or []:
+            value = change.get("value")
+            if isinstance(value, dict):
+                yield value
+
+
+def _conversation(payload: Dict[str, Any], value: Dict[str, Any], message: Dict[str, Any]) -> Tuple:
+    # Cada número pertenece a una sola clínica: (número, contacto) equivale a (clínica, contacto)
+    receiver = (value.get("metadata") or {}).get("phone_number_id") or payload.get("clinic_id")
+    return (receiver, message.get("from"))
+
+
+def conversation_key(payload: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    Clave de orden de webhook_queue: la conversación de la entrega. None si
+    solo trae statuses o mezcla conversaciones (payloads encolados antes de
+    split_by_conversation): esos no esperan a nadie.
+    """
+    keys = {
+        _conversation(payload, value, message)
+        for value in iter_changes(payload)
+        for message in value.get("messages") or []
+    }
+    if len(keys) != 1:
+        return None
+    key = keys.pop()
+    return key if key[1] else None
+
+
+def _entry_part(header: Dict[str, Any], change: Dict[str, Any], **fields: Any) -> Dict[str, Any]:
+    """Una entry con un solo change cuyo value reemplaza fields."""
+    return {**header, "changes": [{**change, "value": {**change["value"], **fields}}]}
+
+
+def split_by_conversation(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Parte una entrega en un payload por conversación (más uno con los
+    statuses) para que webhook_queue ordene cada chat por separado. Una
+    entrega de una sola conversación se encola tal cual.
+    """
+    base = {k: v for k, v in payload.items() if k != "entry"}
+    statuses: List[Dict[str, Any]] = []
+    conversations: Dict[Tuple, List[Dict[str, Any]]] = {}
+    for entry in payload.get("entry") or []:
+        header = {k: v for k, v in entry.items() if k != "changes"}
+        for change in entry.get("changes") or []:
+            value = change.get("value")
+            if not isinstance(value, dict):
+                continue
+            if value.get("statuses"):
+                statuses.append(_entry_part(header, change, messages=[], contacts=[]))
+            by_sender: Dict[Tuple, List[Dict[str, Any]]] = {}
+            for message in value.get("messages") or []:
+                by_sender.setdefault(_conversation(payload, value, message), []).append(message)
+            for key, messages in by_sender.items():
+                contacts = [c for c in value.get("contacts") or [] if c.get("wa_id") == key[1]]
+                conversations.setdefault(key, []).append(
+                    _entry_part(header, change, statuses=[], contacts=contacts, messages=messages)
+                )
+    if len(conversations) + (1 if statuses else 0) <= 1:
+        return [payload]
+    parts = [{**base, "entry": statuses}] if statuses else []
+    parts.extend({**base, "entry": entries} for entries in conversations.values())
+    return parts
+
+
+def process_webhook(payload: Dict[str, Any]) -> None:
+    """
+    Procesa una entrega del webhook ya aceptada. Meta agrupa varias entries,
+    changes y messages por entrega: se recorren todos. Los cambios de solo
+    "statuses" van a process_statuses; los mensajes, a process_messages.
+    Corre en los workers de webhook_queue, fuera del request de Meta.
+
+    Cada change trae el número que recibió (metadata.phone_number_id): su
+    clínica sale del índice de whatsapp_accounts, sin consultar la base. Una
+    entrega puede mezclar números de varias clínicas.
+
+    Desde el webhook llega ya partida por conversación: los mensajes de un
+    mismo chat se procesan en orden y de a uno (hilo, paciente, IA), los de
+    chats distintos en paralelo.
+    """
+    inbound: Dict[Tuple[Optional[str], Optional[str]], List[Dict[str, Any]]] = {}
+    statuses: List[Dict[str, Any]] = []
+    for value in iter_changes(payload):
+        statuses.extend(value.get("statuses") or [])
+        if not value.get("messages"):
+            continue
+        phone_number_id = (value.get("metadata") or {}).get("phone_number_id")
+        clinic_id = resolve_clinic_id(phone_number_id, payload.get("clinic_id"))
+        batch = inbound.setdefault((clinic_id, phone_number_id), [])
+        names = {
+            contact.get("wa_id"): (contact.get("profile") or {}).get("name") or ""
+            for contact in value.get("contacts") or []
+        }
+        for message in value.get("messages") or []:
+            if not message.get("from"):
+                continue
+            if message.get("id") and _seen_messages.get(message["id"]) is not None:
+                continue
+            batch.append({**message, "_contact_name": names.get(message["from"], "")})
+
+    if statuses:
+        process_statuses(statuses)
+    for (clinic_id, phone_number_id), messages in inbound.items():
+        if messages:
+            process_messages(clinic_id, messages, phone_number_id)
+
+
+def process_statuses(statuses: List[Dict[str, Any]]) -> None:
+    """Un update por estado (in_ por wa_message_id), con el estado más avanzado de cada mensaje."""
+    latest: Dict[str, str] = {}
+    for status in statuses:
+        wa_id, value = status.get("id"), status.get("status")
+        if not wa_id or value not in STATUS_RANK:
+            continue
+        if STATUS_RANK[value] > STATUS_RANK.get(latest.get(wa_id), 0):
+            latest[wa_id] = value
+    by_status: Dict[str, List[str]] = {}
+    for wa_id, value in latest.items():
+        by_status.setdefault(value, []).append(wa_id)
+    for value, wa_ids in by_status.items():
+        supabase.table("messages").update({"status": value}).in_("wa_message_id", wa_ids).execute()
+
+
+def _ensure_threads(clinic_id: str, messages: List[Dict[str, Any]]) -> Dict[str, str]:
+    """contact_number -> thread_id: una consulta y un insert multi-fila para los nuevos."""
+    numbers = list(dict.fromkeys(m["from"] for m in messages))
+    threads = {
+        t["contact_number"]: t["id"]
+        for t in (
+            supabase.table("message_threads")
+            .select("id,contact_number")
+            .eq("clinic_id", clinic_id)
+            .in_("contact_number", numbers)
+            .execute()
+        ).data or []
+    }
+    names = {m["from"]: m.get("_contact_name") or "" for m in messages}
+    missing = [
+        {
+            "clinic_id": clinic_id,
+            "contact_number": number,
+            "contact_name": names.get(number, ""),
+            "channel": "whatsapp",
+        }
+        for number in numbers
+        if number not in threads
+    ]
+    if missing:
+        created = supabase.table("message_threads").insert(missing).execute()
+        for thread in created.data or []:
+            threads[thread["contact_number"]] = thread["id"]
+    return threads
+
+
+def process_messages(
+    clinic_id: Optional[str],
+    messages: List[Dict[str, Any]],
+    phone_number_id: Optional[str] = None,
+) -> None:
+    """
+    Los mensajes de una clínica en la entrega: hilos resueltos en lote, un
+    insert multi-fila en messages y, si el bot está activo, una respuesta
+    por mensaje de texto en el orden recibido, enviada desde el número que
+    lo recibió con las credenciales de la clínica.
+
+    El insert es un upsert que ignora wamids repetidos y devuelve solo las
+    filas nuevas. Un wamid repetido (reenvío de Meta o reintento del lote)
+    solo vuelve a la IA si su fila no tiene replied_at, que se marca cuando
+    la IA ya lo resolvió (respuesta enviada o ninguna que dar): un fallo
+    antes de responder se reintenta y uno después no duplica la respuesta.
+    """
+    if not clinic_id:
+        return
+    threads = _ensure_threads(clinic_id, messages)
+    rows = [
+        {
+            "clinic_id": clinic_id,
+            "thread_id": threads[m["from"]],
+            "direction": "in",
+            "body": _message_body(m),
+            "status": "received",
+            "wa_message_id": m.get("id"),
+        }
+        for m in messages
+        if threads.get(m["from"])
+    ]
+    if not rows:
+        return
+    inserted = (
+        supabase.table("messages")
+        .upsert(rows, on_conflict="wa_message_id", ignore_duplicates=True)
+        .execute()
+    ).data or []
+    pending = {row.get("wa_message_id") for row in inserted}
+    repeated = [row["wa_message_id"] for row in rows if row["wa_message_id"] and row["wa_message_id"] not in pending]
+    if repeated:
+        pending.update(
+            row["wa_message_id"]
+            for row in (
+                supabase.table("messages")
+                .select("wa_message_id")
+                .in_("wa_message_id", repeated)
+                .is_("replied_at", "null")
+                .execute()
+            ).data or []
+        )
+    messages = [m for m in messages if not m.get("id") or m["id"] in pending]
+    for row in rows:
+        if row["wa_message_id"] and row["wa_message_id"] not in pending:
+            _seen_messages.set(row["wa_message_id"], True)
+
+    # auto-reply with AI if enabled
+    settings = get_clinic_settings(clinic_id)
+    if not (settings.get("bot_enabled") and settings.get("auto_reply_enabled")):
+        _mark_seen(messages)
+        return
+    credentials = sender_credentials(clinic_id, phone_number_id)
+    for message in messages:
+        text = (message.get("text") or {}).get("body") if message.get("type", "text") == "text" else None
+        if text:
+            reply = build_ai_reply(clinic_id, text, message["from"], message.get("id"))
+            if reply:
+                send_whatsapp(message["from"], reply, **credentials)
+            if message.get("id"):
+                supabase.table("messages").update(
+                    {"replied_at": datetime.now(timezone.utc).isoformat()}
+                ).eq("wa_message_id", message["id"]).execute()
+        _mark_seen([message])
+
+
+def _mark_seen(messages: List[Dict[str, Any]]) -> None:
+    for message in messages:
+        if message.get("id"):
+            _seen_messages.set(message["id"], True)
+
+
+webhook_queue = WebhookQueue(
+    "whatsapp_webhook",
+    process_webhook,
+    SqliteQueueStore(WEBHOOK_QUEUE_PATH),
+    key_fn=conversation_key,
+)
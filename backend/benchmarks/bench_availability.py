@@ -0,0 +1,203 @@
+"""
+Availability and booking benchmark against an in-memory Supabase.
+
+Seeds 1, 50 and 500 clinics (3000, 1000 and 200 appointments per month
+each by default) and measures, per tier:
+
+  slot_generation     day_slot_minutes for every treatment
+  available_slots     get_available_slots for a random clinic/day/treatment
+  available_dates     get_available_dates_for_clinic, 30 days
+  matrix              get_availability_matrix, every treatment x 14 days
+  find_next           find_next_available, first 5 slots
+  create_appointment  booking a free slot (fallback multi-query path)
+
+Each operation reports microseconds per op and database queries per op.
+
+    python -m benchmarks.bench_availability
+    python -m benchmarks.bench_availability --json baseline.json
+    python -m benchmarks.bench_availability --compare baseline.json --tolerance 0.25
+
+--compare exits with status 1 when any operation is slower than the
+baseline by more than the tolerance, or issues more queries per op.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+from tests import harness
+from tests.fake_supabase import FakeSupabase
+from app.services import agenda_logic
+from app.services.availability import day_slot_minutes
+from app.services.clinic_calendar import clinic_today
+
+DEFAULT_CLINICS = "1,50,500"
+DEFAULT_APPOINTMENTS = "3000,1000,200"
+
+
+def _measure(db: FakeSupabase, ops: int, fn: Callable[[int], None]) -> Dict[str, float]:
+    queries = db.query_count()
+    started = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    return {
+        "us_per_op": round(elapsed / ops * 1e6, 2),
+        "queries_per_op": round((db.query_count() - queries) / ops, 3),
+    }
+
+
+def run_tier(clinics: int, appointments_per_month: int, ops: int, seed: int) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(seed)
+    db = harness.install(FakeSupabase())
+    harness.reset_caches()
+
+    settings = {}
+    for n in range(clinics):
+        clinic_id = f"clinic-{n}"
+        settings[clinic_id] = harness.seed_clinic(db, clinic_id, rng, appointments_per_month)
+    clinic_ids = list(settings)
+    # Every seeded clinic shares timezone and work days
+    reference = settings[clinic_ids[0]]
+    today = clinic_today(reference)
+    open_days = [
+        d.isoformat()
+        for d in (today + timedelta(days=i) for i in range(30))
+        if d.weekday() in reference["work_days"]
+    ]
+
+    def pick():
+        clinic_id = rng.choice(clinic_ids)
+        treatment_id = f"{clinic_id}-t{rng.randrange(len(harness.TREATMENTS))}"
+        return clinic_id, treatment_id
+
+    results: Dict[str, Dict[str, float]] = {}
+
+    def slot_generation(_):
+        clinic_settings = settings[rng.choice(clinic_ids)]
+        for _name, duration, _price in harness.TREATMENTS:
+            day_slot_minutes(clinic_settings, duration)
+
+    results["slot_generation"] = _measure(db, ops, slot_generation)
+
+    def available_slots(_):
+        clinic_id, treatment_id = pick()
+        agenda_logic.get_available_slots(clinic_id, rng.choice(open_days), treatment_id)
+
+    results["available_slots"] = _measure(db, ops, available_slots)
+
+    def available_dates(_):
+        clinic_id, treatment_id = pick()
+        agenda_logic.get_available_dates_for_clinic(clinic_id, treatment_id, 30)
+
+    results["available_dates"] = _measure(db, max(1, ops // 10), available_dates)
+
+    treatment_count = len(harness.TREATMENTS)
+
+    def matrix(_):
+        clinic_id = rng.choice(clinic_ids)
+        treatment_ids = [f"{clinic_id}-t{i}" for i in range(treatment_count)]
+        agenda_logic.get_availability_matrix(clinic_id, treatment_ids, open_days[0], open_days[9])
+
+    results["matrix"] = _measure(db, max(1, ops // 10), matrix)
+
+    def find_next(_):
+        clinic_id, treatment_id = pick()
+        agenda_logic.find_next_available(clinic_id, treatment_id, limit=5)
+
+    results["find_next"] = _measure(db, ops, find_next)
+
+    def create(_):
+        clinic_id, treatment_id = pick()
+        day = rng.choice(open_days)
+        slots = agenda_logic.get_available_slots(clinic_id, day, treatment_id)
+        if slots:
+            agenda_logic.create_appointment(
+                clinic_id, "Paciente", "5491100000000", day, rng.choice(slots), treatment_id
+            )
+
+    results["create_appointment"] = _measure(db, ops, create)
+    return results
+
+
+def run(clinic_tiers: List[int], appointment_tiers: List[int], ops: int, seed: int) -> Dict:
+    report = {}
+    for clinics, appointments in zip(clinic_tiers, appointment_tiers):
+        report[f"{clinics}x{appointments}"] = run_tier(clinics, appointments, ops, seed)
+    return report
+
+
+def print_report(report: Dict, baseline: Dict = None) -> None:
+    header = f"{'tier':<12}{'operation':<22}{'us/op':>12}{'queries/op':>12}"
+    if baseline:
+        header += f"{'baseline':>12}{'delta':>9}"
+    print(header)
+    for tier, operations in report.items():
+        for name, stats in operations.items():
+            line = f"{tier:<12}{name:<22}{stats['us_per_op']:>12.2f}{stats['queries_per_op']:>12.3f}"
+            base = (baseline or {}).get(tier, {}).get(name)
+            if base:
+                delta = stats["us_per_op"] / base["us_per_op"] - 1 if base["us_per_op"] else 0.0
+                line += f"{base['us_per_op']:>12.2f}{delta:>+9.0%}"
+            print(line)
+
+
+def regressions(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    for tier, operations in baseline.items():
+        for name, base in operations.items():
+            current = report.get(tier, {}).get(name)
+            if not current:
+                continue
+            if current["us_per_op"] > base["us_per_op"] * (1 + tolerance):
+                found.append(f"{tier} {name}: {base['us_per_op']} -> {current['us_per_op']} us/op")
+            if current["queries_per_op"] > base["queries_per_op"]:
+                found.append(
+                    f"{tier} {name}: {base['queries_per_op']} -> {current['queries_per_op']} queries/op"
+                )
+    return found
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clinics", default=DEFAULT_CLINICS, help="clinic tiers, comma separated")
+    parser.add_argument(
+        "--appointments", default=DEFAULT_APPOINTMENTS, help="appointments per clinic per month, per tier"
+    )
+    parser.add_argument("--ops", type=int, default=300, help="operations measured per benchmark")
+    parser.add_argument("--seed", type=int, default=20260118)
+    parser.add_argument("--json", dest="json_path", help="write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    clinic_tiers = [int(v) for v in args.clinics.split(",")]
+    appointment_tiers = [int(v) for v in args.appointments.split(",")]
+    if len(appointment_tiers) != len(clinic_tiers):
+        parser.error("--clinics and --appointments need the same number of tiers")
+
+    report = run(clinic_tiers, appointment_tiers, args.ops, args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_report(report, baseline)
+
+    if args.json_path:
+        with open(args.json_path, "w") as fh:
+            json.dump(report, fh, indent=2)
+
+    if baseline:
+        found = regressions(report, baseline, args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,21 @@
+import random
+
+import pytest
+
+from tests.fake_supabase import FakeSupabase
+# Loaded before any test module: the harness import sets the environment and
+# sys.path that app.main needs, so tests do not have to import it for that
+from tests.harness import install, reset_caches
+
+
+@pytest.fixture
+def db():
+    fake = install(FakeSupabase())
+    reset_caches()
+    yield fake
+    reset_caches()
+
+
+@pytest.fixture
+def rng():
+    return random.Random(20260118)
@@ -0,0 +1,124 @@
+"""
+Python port of the book_appointment Postgres function (SQL_RECURSOS.sql,
+which supersedes SQL_BOOKING_ATOMIC.sql) for FakeSupabase. Same checks in
+the same order and the same {"error", "code"} results; a lock per
+clinic+date stands in for pg_advisory_xact_lock, so concurrent bookings of
+one day are serialized exactly like in the database.
+"""
+
+import copy
+import threading
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from tests.fake_supabase import FakeSupabase
+
+
+def _minutes(value: str) -> int:
+    hours, minutes = str(value).split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+class BookingRpc:
+    def __init__(self, db: FakeSupabase) -> None:
+        self.db = db
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, clinic_id: str, date: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault((clinic_id, date), threading.Lock())
+
+    def _interval(self, row: Dict, durations: Dict, p: Dict) -> Tuple[int, int]:
+        # (lo, hi) of the day CTE: start - buffer, end (or start + duration) + buffer
+        start = _minutes(row["start_time"])
+        if row.get("end_time"):
+            end = _minutes(row["end_time"])
+        else:
+            end = start + (durations.get(row.get("treatment_id")) or p["p_default_minutes"])
+        buffer = p.get("p_buffer_minutes") or 0
+        return start - buffer, end + buffer
+
+    def __call__(self, params: Dict) -> Dict:
+        p = {
+            "p_patient_id": None,
+            "p_buffer_minutes": 0,
+            "p_default_minutes": 30,
+            "p_max_per_slot": 1,
+            "p_max_per_day": 20,
+            "p_allow_overbooking": False,
+            "p_overbooking_fee": 0,
+            "p_confirmation_required": True,
+            "p_resource_ids": None,
+            **params,
+        }
+        clinic_id, date = p["p_clinic_id"], p["p_date"]
+        with self._lock(clinic_id, date):
+            return self._book(p, clinic_id, date)
+
+    def _book(self, p: Dict, clinic_id: str, date: str) -> Dict:
+        patient_id = p["p_patient_id"]
+        if patient_id is None:
+            patient = next(
+                (r for r in self.db.clinic_rows("patients", clinic_id) if r.get("full_name") == p["p_patient_name"]),
+                None,
+            )
+            if patient is None:
+                return {"error": "Paciente no registrado", "code": "patient_not_found"}
+            patient_id = patient["id"]
+
+        # The daily limit counts every row of the day, cancelled included
+        day_rows = [r for r in self.db.clinic_rows("appointments", clinic_id) if r.get("date") == date]
+        if len(day_rows) >= p["p_max_per_day"]:
+            return {"error": "Limite de turnos por dia alcanzado", "code": "daily_limit"}
+
+        durations = {
+            t["id"]: t.get("duration_minutes") for t in self.db.clinic_rows("treatments", clinic_id)
+        }
+        active = [r for r in day_rows if (r.get("status") or "") != "cancelled"]
+        intervals = [self._interval(r, durations, p) for r in active]
+        start, end = _minutes(p["p_start_time"]), _minutes(p["p_end_time"])
+        points = {start} | {lo for lo, _ in intervals if start < lo < end}
+        overlap = max(sum(1 for lo, hi in intervals if lo <= pt < hi) for pt in points)
+
+        resource_ids: Optional[List[str]] = p["p_resource_ids"]
+        if resource_ids:
+            wanted = set(resource_ids)
+            for row, (lo, hi) in zip(active, intervals):
+                if wanted & set(row.get("resource_ids") or []) and lo < end and hi > start:
+                    return {"error": "Horario no disponible", "code": "resource_conflict"}
+            overlap = 0
+        elif overlap >= p["p_max_per_slot"]:
+            return {
+                "error": "Horario no disponible",
+                "code": "slot_conflict",
+                "overlapping": overlap,
+                "capacity": p["p_max_per_slot"],
+            }
+
+        overbooked = bool(p["p_allow_overbooking"]) and overlap > 0
+        row = {
+            "id": str(uuid.uuid4()),
+            "clinic_id": clinic_id,
+            "patient_id": patient_id,
+            "patient_name": p["p_patient_name"],
+            "patient_phone": p["p_patient_phone"],
+            "date": date,
+            "start_time": p["p_start_time"],
+            "end_time": p["p_end_time"],
+            "treatment_id": p["p_treatment_id"],
+            "double_booked": overbooked,
+            "overbooked": overbooked,
+            "extra_fee": p["p_overbooking_fee"] if overbooked else 0,
+            "status": "pending",
+            "confirmation_required": p["p_confirmation_required"],
+            "resource_ids": list(resource_ids or []),
+        }
+        self.db.append("appointments", row)
+        return {"success": True, "appointment": copy.deepcopy(row)}
+
+
+def install_booking_rpc(db: FakeSupabase) -> BookingRpc:
+    """Deploy book_appointment on the fake, like running SQL_RECURSOS.sql."""
+    rpc = db.rpcs["book_appointment"] = BookingRpc(db)
+    return rpc
@@ -0,0 +1,234 @@
+"""
+In-memory stand-in for the part of the supabase-py table API the backend
+uses: select/insert/upsert/update/delete with eq, neq, gte, lte, lt, in_,
+is_, or_, order, limit and single. Comparisons follow SQL: a NULL column
+never matches neq/gte/lte/lt. Rows are plain dicts; every execute() is
+counted per (table, operation) so tests can assert query budgets.
+
+Rows are indexed by clinic_id so that eq("clinic_id", ...) stays cheap with
+hundreds of clinics; seed tables with seed() (or through the API), not by
+assigning to .tables, so the index notices.
+
+RPCs are not deployed unless registered, like a database without
+SQL_BOOKING_ATOMIC.sql: rpc() raises PGRST202 and the backend falls back to
+its multi-query path. tests/fake_booking.py deploys book_appointment.
+"""
+
+import copy
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from postgrest.exceptions import APIError
+
+
+class Result:
+    def __init__(self, data: Any) -> None:
+        self.data = data
+        self.count = len(data) if isinstance(data, list) else None
+
+
+class Query:
+    def __init__(self, db: "FakeSupabase", table: str) -> None:
+        self.db = db
+        self.table = table
+        self.op = "select"
+        self.payload: Any = None
+        self.options: Dict[str, Any] = {}
+        self.filters: List[Callable[[Dict], bool]] = []
+        self._order: Optional[tuple] = None
+        self._limit: Optional[int] = None
+        self._single = False
+        self._clinic_id: Any = None
+
+    # operations
+    def select(self, *_args, **_kwargs) -> "Query":
+        self.op = "select"
+        return self
+
+    def insert(self, payload: Any, **options) -> "Query":
+        self.op, self.payload, self.options = "insert", payload, options
+        return self
+
+    def upsert(self, payload: Any, **options) -> "Query":
+        self.op, self.payload, self.options = "upsert", payload, options
+        return self
+
+    def update(self, payload: Dict) -> "Query":
+        self.op, self.payload = "update", payload
+        return self
+
+    def delete(self) -> "Query":
+        self.op = "delete"
+        return self
+
+    # filters
+    def eq(self, column: str, value: Any) -> "Query":
+        if column == "clinic_id":
+            self._clinic_id = value
+        self.filters.append(lambda r: r.get(column) == value)
+        return self
+
+    def neq(self, column: str, value: Any) -> "Query":
+        self.filters.append(lambda r: r.get(column) is not None and r[column] != value)
+        return self
+
+    def gte(self, column: str, value: Any) -> "Query":
+        self.filters.append(lambda r: r.get(column) is not None and r[column] >= value)
+        return self
+
+    def lte(self, column: str, value: Any) -> "Query":
+        self.filters.append(lambda r: r.get(column) is not None and r[column] <= value)
+        return self
+
+    def lt(self, column: str, value: Any) -> "Query":
+        self.filters.append(lambda r: r.get(column) is not None and r[column] < value)
+        return self
+
+    def in_(self, column: str, values) -> "Query":
+        values = list(values)
+        self.filters.append(lambda r: r.get(column) in values)
+        return self
+
+    def is_(self, column: str, _value: Any) -> "Query":
+        self.filters.append(lambda r: r.get(column) is None)
+        return self
+
+    def or_(self, filters: str) -> "Query":
+        """PostgREST "col.op.value,..." with eq, neq and is.null."""
+        clauses = []
+        for clause in filters.split(","):
+            column, op, value = clause.split(".", 2)
+            if op == "is" and value == "null":
+                clauses.append(lambda r, c=column: r.get(c) is None)
+            elif op == "eq":
+                clauses.append(lambda r, c=column, v=value: r.get(c) is not None and str(r[c]) == v)
+            elif op == "neq":
+                clauses.append(lambda r, c=column, v=value: r.get(c) is not None and str(r[c]) != v)
+            else:
+                raise NotImplementedError(clause)
+        self.filters.append(lambda r: any(f(r) for f in clauses))
+        return self
+
+    def order(self, column: str, desc: bool = False, **_kwargs) -> "Query":
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count: int) -> "Query":
+        self._limit = count
+        return self
+
+    def single(self) -> "Query":
+        self._single = True
+        return self
+
+    def execute(self) -> Result:
+        self.db.calls[(self.table, self.op)] += 1
+        rows = self.db.tables.setdefault(self.table, [])
+
+        if self.op in ("insert", "upsert"):
+            return Result(self._write(rows))
+
+        candidates = rows if self._clinic_id is None else self.db.clinic_rows(self.table, self._clinic_id)
+        matched = [r for r in candidates if all(f(r) for f in self.filters)]
+        if self.op == "update":
+            for row in matched:
+                row.update(copy.deepcopy(self.payload))
+            return Result(copy.deepcopy(matched))
+        if self.op == "delete":
+            for row in matched:
+                rows.remove(row)
+            self.db.versions[self.table] += 1
+            return Result(matched)
+
+        if self._order:
+            column, desc = self._order
+            matched.sort(key=lambda r: (r.get(column) is None, r.get(column)), reverse=desc)
+        if self._limit is not None:
+            matched = matched[: self._limit]
+        matched = [dict(r) for r in matched]
+        if self._single:
+            if len(matched) != 1:
+                raise APIError({"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"})
+            return Result(matched[0])
+        return Result(matched)
+
+    def _write(self, rows: List[Dict]) -> List[Dict]:
+        items = self.payload if isinstance(self.payload, list) else [self.payload]
+        conflict = self.options.get("on_conflict") or ("id" if self.op == "upsert" else None)
+        columns = conflict.split(",") if conflict else []
+        written = []
+        for item in items:
+            item = copy.deepcopy(item)
+            item.setdefault("id", str(uuid.uuid4()))
+            existing = None
+            if columns:
+                scope = rows if "clinic_id" not in item else self.db.clinic_rows(self.table, item["clinic_id"])
+                existing = next(
+                    (r for r in scope if all(r.get(c) == item.get(c) for c in columns)),
+                    None,
+                )
+            if existing is not None:
+                if self.options.get("ignore_duplicates"):
+                    continue
+                existing.update(item)
+                written.append(copy.deepcopy(existing))
+            else:
+                self.db.append(self.table, item)
+                written.append(copy.deepcopy(item))
+        return written
+
+
+class _Rpc:
+    def __init__(self, fn: Optional[Callable[[Dict], Any]], params: Dict) -> None:
+        self.fn = fn
+        self.params = params
+
+    def execute(self) -> Result:
+        if self.fn is None:
+            raise APIError({"code": "PGRST202", "message": "Could not find the function"})
+        return Result(self.fn(self.params))
+
+
+class FakeSupabase:
+    def __init__(self) -> None:
+        self.tables: Dict[str, List[Dict]] = {}
+        self.calls: Counter = Counter()
+        self.rpcs: Dict[str, Callable[[Dict], Any]] = {}
+        self.versions: Counter = Counter()
+        self._index: Dict[str, tuple] = {}
+
+    def seed(self, table: str, rows: List[Dict]) -> None:
+        self.tables.setdefault(table, []).extend(rows)
+        self.versions[table] += 1
+
+    def append(self, table: str, row: Dict) -> None:
+        """Add one row, keeping the clinic index current instead of rebuilding it."""
+        rows = self.tables.setdefault(table, [])
+        cached = self._index.get(table)
+        current = cached is not None and cached[0] == (self.versions[table], len(rows))
+        rows.append(row)
+        if current:
+            cached[1].setdefault(row.get("clinic_id"), []).append(row)
+            self._index[table] = ((self.versions[table], len(rows)), cached[1])
+
+    def clinic_rows(self, table: str, clinic_id: Any) -> List[Dict]:
+        rows = self.tables.get(table, [])
+        key = (self.versions[table], len(rows))
+        cached = self._index.get(table)
+        if cached is None or cached[0] != key:
+            by_clinic: Dict[Any, List[Dict]] = {}
+            for row in rows:
+                by_clinic.setdefault(row.get("clinic_id"), []).append(row)
+            cached = self._index[table] = (key, by_clinic)
+        return cached[1].get(clinic_id, [])
+
+    def table(self, name: str) -> Query:
+        return Query(self, name)
+
+    def rpc(self, name: str, params: Dict) -> _Rpc:
+        self.calls[("rpc", name)] += 1
+        return _Rpc(self.rpcs.get(name), params)
+
+    def query_count(self, table: Optional[str] = None) -> int:
+        return sum(n for (t, _), n in self.calls.items() if table is None or t == table)
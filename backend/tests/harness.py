@@ -0,0 +1,169 @@
+"""
+Shared setup for tests and benchmarks: point the app at a FakeSupabase,
+reset process-wide caches and seed clinics with realistic agendas.
+"""
+
+import os
+import random
+import sys
+import tempfile
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# app.main builds a real client at import time; it never connects until used
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+os.environ.setdefault(
+    "SUPABASE_SERVICE_ROLE",
+    "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.test",
+)
+# The webhook queue's SQLite file goes to a scratch dir, not the checkout
+os.environ.setdefault("WEBHOOK_QUEUE_PATH", os.path.join(tempfile.mkdtemp(), "webhook_queue.sqlite3"))
+
+import app.main  # noqa: E402
+from app.services import (  # noqa: E402
+    agenda_logic,
+    outbox,
+    resources,
+    treatment_catalog,
+    whatsapp_accounts,
+    whatsapp_inbound,
+)
+from app.services.availability import day_slot_minutes, format_hhmm  # noqa: E402
+from app.services.clinic_calendar import clinic_today  # noqa: E402
+from tests.fake_supabase import FakeSupabase  # noqa: E402
+
+TREATMENTS = [
+    # name, duration_minutes, base_price
+    ("Consulta", 30, 8000),
+    ("Limpieza", 45, 15000),
+    ("Ortodoncia", 60, 30000),
+    ("Blanqueamiento", 90, 45000),
+]
+
+
+def install(db: FakeSupabase) -> FakeSupabase:
+    """Route every module-level `supabase` client in app.* to db."""
+    app.main.supabase = db
+    app.main.fastapi_app.state.supabase = db
+    for name, module in list(sys.modules.items()):
+        if name.startswith("app.") and hasattr(module, "supabase"):
+            # routers/clinic_settings.py defines supabase(req) as a helper
+            if not callable(getattr(module, "supabase")):
+                module.supabase = db
+    return db
+
+
+def reset_caches() -> None:
+    agenda_logic._settings_cache.invalidate()
+    treatment_catalog._catalog_cache.invalidate()
+    treatment_catalog._last_miss_refresh.clear()
+    resources._resource_cache.invalidate()
+    agenda_logic.slot_inventory.invalidate()
+    whatsapp_inbound._seen_messages.invalidate()
+    whatsapp_accounts.invalidate_whatsapp_accounts()
+    whatsapp_accounts._last_miss_refresh = 0.0
+    agenda_logic._booking_rpc_available = True
+    outbox._claim_rpc_available = True
+
+
+def clinic_settings(clinic_id: str, **overrides) -> Dict:
+    settings = {
+        "clinic_id": clinic_id,
+        "timezone": "America/Argentina/Buenos_Aires",
+        "open_time": "09:00",
+        "close_time": "18:00",
+        "lunch_start": "13:00",
+        "lunch_end": "14:00",
+        "breaks": [],
+        "work_days": [0, 1, 2, 3, 4],
+        "blocked_dates": [],
+        "blocked_periods": [],
+        "slot_minutes": 30,
+        "max_appointments_per_day": 400,
+        "buffer_between_appointments": 0,
+        "max_appointments_per_slot": 3,
+        "allow_double_booking": True,
+        "overbooking_extra_fee": 0,
+        "overbooking_fee_type": "fixed",
+        "confirmation_required": True,
+    }
+    settings.update(overrides)
+    return settings
+
+
+def treatment_rows(clinic_id: str) -> List[Dict]:
+    return [
+        {
+            "id": f"{clinic_id}-t{i}",
+            "clinic_id": clinic_id,
+            "name": name,
+            "duration_minutes": duration,
+            "base_price": price,
+        }
+        for i, (name, duration, price) in enumerate(TREATMENTS)
+    ]
+
+
+def random_appointments(
+    settings: Dict,
+    treatments: List[Dict],
+    rng: random.Random,
+    first_day: date,
+    days: int,
+    count: int,
+) -> List[Dict]:
+    """
+    Appointments on grid slots of open days; ~10% cancelled, ~10% without
+    end_time and ~10% with a NULL status (legacy rows), like production data.
+    """
+    work_days = set(settings["work_days"])
+    open_days = [
+        first_day + timedelta(days=i)
+        for i in range(days)
+        if (first_day + timedelta(days=i)).weekday() in work_days
+    ]
+    rows = []
+    for _ in range(count if open_days else 0):
+        treatment = rng.choice(treatments)
+        grid = day_slot_minutes(settings, treatment["duration_minutes"])
+        start = rng.choice(grid)
+        row = {
+            "id": f"{settings['clinic_id']}-a{len(rows)}",
+            "clinic_id": settings["clinic_id"],
+            "patient_id": f"{settings['clinic_id']}-p{rng.randrange(500)}",
+            "patient_name": "Paciente",
+            "patient_phone": "5491100000000",
+            "date": rng.choice(open_days).isoformat(),
+            "start_time": format_hhmm(start),
+            "end_time": format_hhmm(start + treatment["duration_minutes"]),
+            "treatment_id": treatment["id"],
+            "status": rng.choice(["pending"] * 6 + ["confirmed"] * 2 + ["cancelled", None]),
+        }
+        if rng.random() < 0.1:
+            row["end_time"] = None
+        rows.append(row)
+    return rows
+
+
+def seed_clinic(
+    db: FakeSupabase,
+    clinic_id: str,
+    rng: random.Random,
+    appointments_per_month: int,
+    days: int = 30,
+    first_day: Optional[date] = None,
+    **overrides,
+) -> Dict:
+    settings = clinic_settings(clinic_id, **overrides)
+    treatments = treatment_rows(clinic_id)
+    first_day = first_day or clinic_today(settings)
+    count = appointments_per_month * days // 30
+    db.seed("clinic_settings", [settings])
+    db.seed("treatments", treatments)
+    db.seed("patients", [{"id": f"{clinic_id}-p0", "clinic_id": clinic_id, "full_name": "Paciente"}])
+    db.seed("appointments", random_appointments(settings, treatments, rng, first_day, days, count))
+    return settings
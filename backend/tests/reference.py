@@ -0,0 +1,212 @@
+"""
+Reference implementations the optimized paths are checked against.
+
+generate_slots, generate_slots_with_lunch, is_date_blocked and is_work_day
+are the original strptime-based versions from before the integer-minute
+engine. The brute-force helpers evaluate occupancy minute by minute, with
+no sweep lines, bitsets or caches.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, List, Sequence, Set, Tuple
+
+from app.services.availability import day_slot_minutes, parse_hhmm
+
+
+def _parse_time_hhmm(value: str) -> datetime:
+    return datetime.strptime(value, "%H:%M")
+
+
+def generate_slots(start_time: str, end_time: str, duration_minutes: int) -> List[str]:
+    if duration_minutes <= 0:
+        return []
+    start_dt = _parse_time_hhmm(start_time)
+    end_dt = _parse_time_hhmm(end_time)
+    if end_dt <= start_dt:
+        return []
+    step = timedelta(minutes=duration_minutes)
+    slots = []
+    current = start_dt
+    while current + step <= end_dt:
+        slots.append(current.strftime("%H:%M"))
+        current += step
+    return slots
+
+
+def generate_slots_with_lunch(
+    start_time: str,
+    end_time: str,
+    lunch_start: str,
+    lunch_end: str,
+    duration_minutes: int,
+) -> List[str]:
+    if not lunch_start or not lunch_end:
+        return generate_slots(start_time, end_time, duration_minutes)
+    step = timedelta(minutes=duration_minutes)
+    slots = []
+    current = _parse_time_hhmm(start_time)
+    while current + step <= _parse_time_hhmm(lunch_start):
+        slots.append(current.strftime("%H:%M"))
+        current += step
+    current = _parse_time_hhmm(lunch_end)
+    while current + step <= _parse_time_hhmm(end_time):
+        slots.append(current.strftime("%H:%M"))
+        current += step
+    return slots
+
+
+def is_date_blocked(blocked_dates: List[str], blocked_periods: List[Dict], check_date: str) -> bool:
+    if check_date in blocked_dates:
+        return True
+    check_dt = datetime.strptime(check_date, "%Y-%m-%d")
+    for period in blocked_periods:
+        start_dt = datetime.strptime(period["start"], "%Y-%m-%d")
+        end_dt = datetime.strptime(period["end"], "%Y-%m-%d")
+        if start_dt <= check_dt <= end_dt:
+            return True
+    return False
+
+
+def is_work_day(work_days: List[int], check_date: str) -> bool:
+    return datetime.strptime(check_date, "%Y-%m-%d").weekday() in work_days
+
+
+def brute_force_overlap(intervals: Sequence[Tuple[int, int]], buffer_minutes: int, start: int, end: int) -> int:
+    """Peak number of buffered intervals covering any minute of [start, end)."""
+    peak = 0
+    for minute in range(start, end):
+        level = sum(1 for s, e in intervals if e > s and s - buffer_minutes <= minute < e + buffer_minutes)
+        peak = max(peak, level)
+    return peak
+
+
+def brute_force_free_slots(
+    intervals: Sequence[Tuple[int, int]],
+    buffer_minutes: int,
+    slot_starts: Sequence[int],
+    duration: int,
+    capacity: int,
+) -> List[int]:
+    return [
+        s
+        for s in slot_starts
+        if brute_force_overlap(intervals, buffer_minutes, s, s + duration) < capacity
+    ]
+
+
+def appointment_interval(row: Dict, treatments: Dict[str, Dict], default_minutes: int) -> Tuple[int, int]:
+    start = parse_hhmm(row["start_time"])
+    if row.get("end_time"):
+        return start, parse_hhmm(row["end_time"])
+    treatment = treatments.get(row.get("treatment_id")) or {}
+    return start, start + int(treatment.get("duration_minutes") or default_minutes)
+
+
+def reference_available_slots(
+    tables: Dict[str, List[Dict]],
+    clinic_id: str,
+    day: str,
+    treatment_id: str,
+    allow_double_booking: bool = False,
+) -> List[str]:
+    """
+    Free slots straight from raw rows: blocked/work-day checks with the
+    original helpers, the slot grid, and minute-by-minute occupancy.
+    """
+    settings = next((s for s in tables.get("clinic_settings", []) if s["clinic_id"] == clinic_id), None)
+    if not settings:
+        return []
+    if is_date_blocked(settings.get("blocked_dates") or [], settings.get("blocked_periods") or [], day):
+        return []
+    if not is_work_day(settings.get("work_days", [0, 1, 2, 3, 4]), day):
+        return []
+    treatments = {t["id"]: t for t in tables.get("treatments", []) if t["clinic_id"] == clinic_id}
+    treatment = treatments.get(treatment_id)
+    if not treatment or not treatment.get("duration_minutes"):
+        return []
+    duration = int(treatment["duration_minutes"])
+
+    default_minutes = int(settings.get("slot_minutes") or 30)
+    intervals = [
+        appointment_interval(a, treatments, default_minutes)
+        for a in tables.get("appointments", [])
+        if a["clinic_id"] == clinic_id
+        and a.get("date") == day
+        and a.get("status") != "cancelled"
+        and a.get("start_time")
+    ]
+    allow = allow_double_booking or settings.get("allow_double_booking", False)
+    capacity = int(settings.get("max_appointments_per_slot", 2) or 2) if allow else 1
+    free = brute_force_free_slots(
+        intervals,
+        int(settings.get("buffer_between_appointments") or 0),
+        day_slot_minutes(settings, duration),
+        duration,
+        capacity,
+    )
+    return [f"{m // 60:02d}:{m % 60:02d}" for m in free]
+
+
+def brute_force_resource_free(
+    free_minutes: Dict[str, Set[int]],
+    requirements: Dict[str, List[str]],
+    slot_starts: Sequence[int],
+    duration: int,
+) -> List[int]:
+    """Slots where every kind has an eligible resource free for every minute."""
+    if not requirements:
+        return []
+    result = []
+    for start in slot_starts:
+        minutes = range(start, start + duration)
+        if all(
+            any(all(m in free_minutes.get(r, set()) for m in minutes) for r in resource_ids)
+            for resource_ids in requirements.values()
+        ):
+            result.append(start)
+    return result
+
+
+
+def reference_simulate(settings: Dict, rows: List[Dict], treatments: List[Dict], first_day: str, n_days: int) -> Dict:
+    """
+    capacity_simulator.simulate one request at a time, in arrival order:
+    snap to the nearest grid slot, then the capacity and daily-limit checks
+    of create_appointment with minute-by-minute occupancy.
+    """
+    by_id = {t["id"]: t for t in treatments}
+    allow_overbooking = bool(settings.get("allow_double_booking"))
+    capacity = max(int(settings.get("max_appointments_per_slot") or 1), 1) if allow_overbooking else 1
+    max_per_day = int(settings.get("max_appointments_per_day") or 20)
+    buffer_minutes = int(settings.get("buffer_between_appointments") or 0)
+    default_minutes = int(settings.get("slot_minutes") or 30)
+    start_dt = datetime.strptime(first_day, "%Y-%m-%d")
+    last = (start_dt + timedelta(days=n_days - 1)).strftime("%Y-%m-%d")
+
+    busy: Dict[str, List[Tuple[int, int]]] = {}
+    result = {"accepted": 0, "overbooked": 0, "rejected_capacity": 0, "rejected_daily_limit": 0, "booked_minutes": 0}
+    ordered = sorted(rows, key=lambda r: (r.get("created_at") or "", r["date"], r["start_time"]))
+    for row in ordered:
+        day = row["date"]
+        if not first_day <= day <= last or not is_work_day(settings.get("work_days", [0, 1, 2, 3, 4]), day):
+            continue
+        if is_date_blocked(settings.get("blocked_dates") or [], settings.get("blocked_periods") or [], day):
+            continue
+        duration = int((by_id.get(row.get("treatment_id")) or {}).get("duration_minutes") or default_minutes)
+        grid = day_slot_minutes(settings, duration)
+        if not grid:
+            continue
+        wanted = parse_hhmm(row["start_time"])
+        start = min(grid, key=lambda s: (abs(s - wanted), s))
+        span = (start, start + duration + buffer_minutes)
+        peak = brute_force_overlap(busy.get(day, []), 0, *span)
+        if peak >= capacity:
+            result["rejected_capacity"] += 1
+        elif len(busy.get(day, [])) >= max_per_day:
+            result["rejected_daily_limit"] += 1
+        else:
+            busy.setdefault(day, []).append(span)
+            result["accepted"] += 1
+            result["overbooked"] += peak > 0
+            result["booked_minutes"] += duration
+    return result
@@ -0,0 +1,358 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from tests import harness, reference
+from tests.fake_booking import install_booking_rpc
+from app.services import agenda_logic
+from app.services.availability import parse_hhmm
+from app.services.clinic_calendar import clinic_now, clinic_today
+
+CLINIC = "clinic-1"
+
+
+def _open_days(settings, count):
+    today = clinic_today(settings)
+    days = [today + timedelta(days=i) for i in range(count)]
+    return [d.isoformat() for d in days if d.weekday() in settings["work_days"]]
+
+
+@pytest.fixture
+def seeded(db, rng):
+    blocked = clinic_today(harness.clinic_settings(CLINIC)) + timedelta(days=3)
+    return harness.seed_clinic(
+        db,
+        CLINIC,
+        rng,
+        appointments_per_month=600,
+        blocked_dates=[blocked.isoformat()],
+        buffer_between_appointments=5,
+    )
+
+
+@pytest.fixture(params=["rpc", "fallback"])
+def booking_path(request, db):
+    """Book through the book_appointment RPC or, without it, the multi-query fallback."""
+    if request.param == "rpc":
+        install_booking_rpc(db)
+    yield request.param
+    rpc_bookings = db.calls[("rpc", "book_appointment")]
+    assert rpc_bookings > 0
+    assert agenda_logic._booking_rpc_available is (request.param == "rpc")
+    if request.param == "rpc":
+        # Every check and the insert ran inside the RPC
+        assert db.calls[("appointments", "insert")] == 0
+
+
+@pytest.mark.parametrize("allow_double", [False, True])
+def test_available_slots_match_reference(db, seeded, allow_double):
+    for day in _open_days(seeded, 14):
+        for treatment in harness.treatment_rows(CLINIC):
+            expected = reference.reference_available_slots(
+                db.tables, CLINIC, day, treatment["id"], allow_double
+            )
+            assert agenda_logic.get_available_slots(CLINIC, day, treatment["id"], allow_double) == expected
+
+
+def test_available_dates_counts_match_per_day_slots(db, seeded):
+    treatment_id = f"{CLINIC}-t1"
+    agenda_logic.get_clinic_settings(CLINIC)
+    agenda_logic._get_treatment_duration(CLINIC, treatment_id)
+    before = db.query_count("appointments")
+    dates = agenda_logic.get_available_dates_for_clinic(CLINIC, treatment_id, 30)
+    assert db.query_count("appointments") - before <= 1
+    assert len(dates) == 30
+    for info in dates:
+        expected = reference.reference_available_slots(db.tables, CLINIC, info["date"], treatment_id)
+        assert info["available_slots_count"] == len(expected)
+
+
+def test_matrix_matches_available_slots(db, seeded):
+    treatment_ids = [t["id"] for t in harness.treatment_rows(CLINIC)]
+    days = _open_days(seeded, 10)
+    matrix = agenda_logic.get_availability_matrix(CLINIC, treatment_ids, days[0], days[-1])
+    for treatment_id in treatment_ids:
+        for day in days:
+            assert matrix["slots"][treatment_id][day] == agenda_logic.get_available_slots(
+                CLINIC, day, treatment_id
+            )
+
+
+def _freeze_clinic_clock(monkeypatch, settings, hhmm):
+    now = clinic_now(settings).replace(hour=int(hhmm[:2]), minute=int(hhmm[3:]), second=0, microsecond=0)
+    monkeypatch.setattr(agenda_logic, "clinic_now", lambda _settings: now)
+    return now
+
+
+@pytest.mark.parametrize("clock", ["00:00", "11:20"])
+def test_find_next_available_matches_scan(db, seeded, monkeypatch, clock):
+    now = _freeze_clinic_clock(monkeypatch, seeded, clock)
+    treatment_id = f"{CLINIC}-t2"
+    found = agenda_logic.find_next_available(CLINIC, treatment_id, limit=40)
+    expected = []
+    for day in _open_days(seeded, 30):
+        for time in reference.reference_available_slots(db.tables, CLINIC, day, treatment_id):
+            # Slots that already started today in the clinic's timezone are gone
+            if day == now.date().isoformat() and parse_hhmm(time) <= now.hour * 60 + now.minute:
+                continue
+            expected.append({"date": day, "time": time})
+    assert found == expected[:40]
+
+
+def test_search_never_starts_before_the_clinic_now(db, seeded, monkeypatch):
+    now = _freeze_clinic_clock(monkeypatch, seeded, "11:20")
+    treatment_id = f"{CLINIC}-t0"
+    yesterday = (now.date() - timedelta(days=1)).isoformat()
+    for after in (None, yesterday, f"{now.date().isoformat()}T08:00"):
+        for slot in agenda_logic.find_next_available(CLINIC, treatment_id, after=after, limit=60):
+            assert (slot["date"], slot["time"]) > (now.date().isoformat(), "11:20")
+    suggestion = agenda_logic.suggest_slots(CLINIC, treatment_id, after=yesterday)
+    if suggestion["date"] == now.date().isoformat():
+        assert all(time > "11:20" for time in suggestion["slots"])
+
+
+@pytest.mark.parametrize("clock", ["00:00", "11:20"])
+def test_suggest_slots_matches_the_first_day_with_room(db, seeded, monkeypatch, clock):
+    now = _freeze_clinic_clock(monkeypatch, seeded, clock)
+    treatment_id = f"{CLINIC}-t1"
+    blocked = seeded["blocked_dates"][0]
+    for after in (None, blocked):
+        expected_day, free = None, []
+        for day in _open_days(seeded, 30):
+            if after and day < after:
+                continue
+            free = [
+                time
+                for time in reference.reference_available_slots(db.tables, CLINIC, day, treatment_id)
+                if day != now.date().isoformat() or parse_hhmm(time) > now.hour * 60 + now.minute
+            ]
+            if free:
+                expected_day = day
+                break
+        suggestion = agenda_logic.suggest_slots(CLINIC, treatment_id, after=after, limit=4)
+        assert suggestion["date"] == expected_day and expected_day != blocked
+        assert suggestion["slots"] == sorted(suggestion["slots"])
+        assert set(suggestion["slots"]) <= set(free)
+        assert len(suggestion["slots"]) == min(4, len(free))
+    assert agenda_logic.suggest_slots(CLINIC, treatment_id, limit=0) == {"date": None, "slots": []}
+    assert agenda_logic.suggest_slots(CLINIC, "unknown") == {"date": None, "slots": []}
+
+
+def test_suggest_slots_packs_the_day_before_spreading(db, rng):
+    harness.seed_clinic(db, CLINIC, rng, appointments_per_month=0, allow_double_booking=False)
+    day = "2030-03-04"  # a Monday, with one 10:00-10:30 appointment
+    db.seed(
+        "appointments",
+        [{"id": "a1", "clinic_id": CLINIC, "date": day, "start_time": "10:00", "end_time": "10:30",
+          "treatment_id": f"{CLINIC}-t0", "status": "confirmed"}],
+    )
+    treatment_id = f"{CLINIC}-t2"  # 60 minutes
+    free = agenda_logic.get_available_slots(CLINIC, day, treatment_id)
+    assert free == ["09:00", "11:00", "12:00", "14:00", "15:00", "16:00", "17:00"]
+
+    # Slots flush with an edge (opening, lunch, closing) come first, the
+    # tightest fit on their other side first; 15:00 and 16:00 touch nothing
+    assert agenda_logic.suggest_slots(CLINIC, treatment_id, after=day, limit=3) == {
+        "date": day,
+        "slots": ["09:00", "12:00", "14:00"],
+    }
+    assert agenda_logic.suggest_slots(CLINIC, treatment_id, after=day, limit=5)["slots"] == [
+        "09:00", "11:00", "12:00", "14:00", "17:00"
+    ]
+    assert agenda_logic.suggest_slots(CLINIC, treatment_id, after=day, limit=20)["slots"] == free
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"after": "mañana"}, {"after": "2026-13-01"}, {"after": "2026-03-02T25:00"}, {"preference": "noche"}],
+)
+def test_malformed_search_params_are_a_400(db, seeded, params):
+    from fastapi.testclient import TestClient
+    import app.main
+
+    client = TestClient(app.main.fastapi_app)
+    response = client.get(
+        "/api/availability/next", params={"clinic_id": CLINIC, "treatment_id": f"{CLINIC}-t0", **params}
+    )
+    assert response.status_code == 400
+
+
+def test_bookings_keep_inventory_consistent_and_within_capacity(db, seeded, rng, booking_path):
+    treatments = harness.treatment_rows(CLINIC)
+    days = _open_days(seeded, 7)
+    # Warm the slot inventory so bookings must keep it current
+    for day in days:
+        for treatment in treatments:
+            agenda_logic.get_available_slots(CLINIC, day, treatment["id"])
+
+    booked = 0
+    for _ in range(150):
+        day = rng.choice(days)
+        treatment = rng.choice(treatments)
+        slots = agenda_logic.get_available_slots(CLINIC, day, treatment["id"])
+        if not slots:
+            continue
+        result = agenda_logic.create_appointment(
+            CLINIC, "Paciente", "5491100000001", day, rng.choice(slots), treatment["id"]
+        )
+        if "error" not in result:
+            booked += 1
+    assert booked > 0
+
+    for day in days:
+        for treatment in treatments:
+            expected = reference.reference_available_slots(db.tables, CLINIC, day, treatment["id"])
+            assert agenda_logic.get_available_slots(CLINIC, day, treatment["id"]) == expected
+
+
+
+def test_sequential_bookings_never_exceed_capacity(db, rng, booking_path):
+    settings = harness.seed_clinic(db, CLINIC, rng, appointments_per_month=0, buffer_between_appointments=10)
+    treatments = harness.treatment_rows(CLINIC)
+    days = _open_days(settings, 3)
+    for _ in range(300):
+        day = rng.choice(days)
+        treatment = rng.choice(treatments)
+        slots = agenda_logic.get_available_slots(CLINIC, day, treatment["id"])
+        if slots:
+            agenda_logic.create_appointment(
+                CLINIC, "Paciente", "5491100000001", day, rng.choice(slots), treatment["id"]
+            )
+
+    by_id = {t["id"]: t for t in treatments}
+    capacity = settings["max_appointments_per_slot"]
+    for day in days:
+        intervals = [
+            reference.appointment_interval(a, by_id, 30)
+            for a in db.tables["appointments"]
+            if a["date"] == day and a["status"] != "cancelled"
+        ]
+        assert intervals
+        # Buffers only separate appointments; each one's own span must fit
+        for start, end in intervals:
+            assert reference.brute_force_overlap(intervals, 0, start, end) <= capacity
+
+
+def test_rpc_serializes_concurrent_bookings_of_one_slot(db, rng):
+    settings = harness.seed_clinic(db, CLINIC, rng, appointments_per_month=0, max_appointments_per_slot=2)
+    install_booking_rpc(db)
+    day = _open_days(settings, 7)[0]
+    barrier = threading.Barrier(12)
+    results = []
+
+    def book():
+        barrier.wait()
+        results.append(
+            agenda_logic.create_appointment(CLINIC, "Paciente", "5491100000001", day, "10:00", f"{CLINIC}-t0")
+        )
+
+    threads = [threading.Thread(target=book) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(1 for r in results if r.get("success")) == 2
+    assert {r["code"] for r in results if "error" in r} == {"slot_conflict"}
+    assert [a["overbooked"] for a in db.tables["appointments"]] == [False, True]
+
+
+def test_rpc_checks_match_the_sql_function(db):
+    db.seed("patients", [{"id": "p1", "clinic_id": CLINIC, "full_name": "Paciente"}])
+    db.seed("treatments", [{"id": "t1", "clinic_id": CLINIC, "duration_minutes": 30}])
+    db.seed(
+        "appointments",
+        [
+            # NULL status occupies, like coalesce(status, '') <> 'cancelled'
+            {"id": "a1", "clinic_id": CLINIC, "date": "2026-03-02", "start_time": "10:00",
+             "end_time": None, "treatment_id": "t1", "status": None, "resource_ids": ["r1"]},
+            {"id": "a2", "clinic_id": CLINIC, "date": "2026-03-02", "start_time": "11:00",
+             "end_time": "11:30", "treatment_id": "t1", "status": "cancelled", "resource_ids": []},
+        ],
+    )
+    rpc = install_booking_rpc(db)
+
+    def book(start, end, **params):
+        return rpc({
+            "p_clinic_id": CLINIC, "p_patient_id": None, "p_patient_name": "Paciente",
+            "p_patient_phone": "549", "p_date": "2026-03-02", "p_start_time": start,
+            "p_end_time": end, "p_treatment_id": "t1", **params,
+        })
+
+    assert book("10:00", "10:30", p_patient_name="Otro")["code"] == "patient_not_found"
+    assert book("10:15", "10:45")["code"] == "slot_conflict"
+    # The buffer widens the NULL-status row to [09:50, 10:40)
+    assert book("10:30", "11:00", p_buffer_minutes=10)["code"] == "slot_conflict"
+    assert book("09:30", "10:00", p_buffer_minutes=10, p_resource_ids=["r1"])["code"] == "resource_conflict"
+    assert book("10:00", "10:30", p_resource_ids=["r2"])["success"]
+    # Cancelled rows do not occupy the slot but count for the daily limit
+    assert book("11:00", "11:30", p_max_per_day=3)["code"] == "daily_limit"
+    booked = book("10:00", "10:30", p_max_per_slot=3, p_allow_overbooking=True, p_overbooking_fee=500)
+    assert booked["appointment"]["overbooked"] is True
+    assert booked["appointment"]["extra_fee"] == 500
+    assert booked["appointment"]["status"] == "pending"
+
+
+def test_booking_outside_grid_is_rejected(db, seeded):
+    day = _open_days(seeded, 7)[0]
+    result = agenda_logic.create_appointment(
+        CLINIC, "Paciente", "5491100000001", day, "13:15", f"{CLINIC}-t0"
+    )
+    assert result["code"] == "slot_unavailable"
+    assert parse_hhmm("13:15") >= parse_hhmm(seeded["lunch_start"])
+
+
+def test_bulk_reschedule_respects_capacity_across_the_batch(db, seeded):
+    days = _open_days(seeded, 7)
+    ids = [a["id"] for a in db.tables["appointments"] if a["date"] == days[0] and a["status"] != "cancelled"]
+    moves = [{"appointment_id": i, "new_date": days[1], "new_time": "09:00"} for i in ids]
+    result = agenda_logic.reschedule_appointments(CLINIC, moves)
+    assert len(result["rescheduled"]) + len(result["failed"]) == len(moves)
+
+    by_id = {t["id"]: t for t in harness.treatment_rows(CLINIC)}
+    buffer_minutes = seeded["buffer_between_appointments"]
+    moved_ids = {row["id"] for row in result["rescheduled"]}
+    placed = [
+        reference.appointment_interval(a, by_id, 30)
+        for a in db.tables["appointments"]
+        if a["date"] == days[1] and a["status"] != "cancelled" and a["id"] not in moved_ids
+    ]
+    for row in result["rescheduled"]:
+        assert (row["date"], row["start_time"]) == (days[1], "09:00")
+        start, end = reference.appointment_interval(row, by_id, 30)
+        # Every move found a free seat given the rows placed before it
+        assert reference.brute_force_overlap(placed, buffer_minutes, start, end) < seeded["max_appointments_per_slot"]
+        placed.append((start, end))
+    for treatment in harness.treatment_rows(CLINIC):
+        expected = reference.reference_available_slots(db.tables, CLINIC, days[1], treatment["id"])
+        assert agenda_logic.get_available_slots(CLINIC, days[1], treatment["id"]) == expected
+
+
+def test_bulk_reschedule_only_writes_the_moved_columns(db, seeded, monkeypatch):
+    days = _open_days(seeded, 7)
+    free_day = _open_days(seeded, 40)[-1]  # past the seeded month: room for both moves
+    rows = [a for a in db.tables["appointments"] if a["date"] == days[0] and a["status"] not in ("cancelled", None)]
+    edited, cancelled = rows[0], rows[1]
+    targets = {
+        row["id"]: agenda_logic.get_available_slots(CLINIC, free_day, row["treatment_id"])[i]
+        for i, row in enumerate((edited, cancelled))
+    }
+    moves = [{"appointment_id": i, "new_date": free_day, "new_time": t} for i, t in targets.items()]
+    real = agenda_logic._write_moves
+
+    def edit_then_write(clinic_id, moved, with_resources):
+        # Another request edits and cancels between the batch's read and its write
+        edited["patient_name"] = "Editado"
+        cancelled["status"] = "cancelled"
+        return real(clinic_id, moved, with_resources)
+
+    monkeypatch.setattr(agenda_logic, "_write_moves", edit_then_write)
+    result = agenda_logic.reschedule_appointments(CLINIC, moves)
+
+    assert [row["id"] for row in result["rescheduled"]] == [edited["id"]]
+    assert result["failed"] == [{"appointment_id": cancelled["id"], "error": "Turno cancelado"}]
+    assert (edited["patient_name"], edited["date"]) == ("Editado", free_day)
+    assert edited["start_time"] == targets[edited["id"]]
+    assert (cancelled["status"], cancelled["date"]) == ("cancelled", days[0])
+    assert db.calls[("appointments", "upsert")] == 0
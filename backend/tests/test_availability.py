@@ -0,0 +1,210 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from app.services.availability import (
+    BlockedIndex,
+    OccupancyTimeline,
+    build_open_windows,
+    day_slot_minutes,
+    format_hhmm,
+    format_slots,
+    parse_hhmm,
+    rank_slots,
+)
+from app.services.resources import GRAIN_MINUTES, ResourceCatalog, ResourceDay, runs_mask
+from tests import reference
+
+SEEDS = range(25)
+
+
+def _hhmm(rng: random.Random, lo: int, hi: int, step: int = 15) -> str:
+    return format_hhmm(rng.randrange(lo, hi, step))
+
+
+def test_parse_and_format_roundtrip():
+    for minute in range(0, 24 * 60 + 1):
+        assert parse_hhmm(format_hhmm(minute)) == minute
+    assert parse_hhmm("09:30:00") == 570
+    with pytest.raises(ValueError):
+        parse_hhmm("25:00")
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_day_slots_match_original_generator(seed):
+    rng = random.Random(seed)
+    open_time = _hhmm(rng, 6 * 60, 11 * 60)
+    close_time = _hhmm(rng, 15 * 60, 22 * 60)
+    settings = {"open_time": open_time, "close_time": close_time}
+    if rng.random() < 0.7:
+        lunch_start = parse_hhmm(_hhmm(rng, 12 * 60, 14 * 60))
+        settings["lunch_start"] = format_hhmm(lunch_start)
+        settings["lunch_end"] = format_hhmm(lunch_start + rng.choice([30, 45, 60, 90]))
+    for duration in (10, 15, 20, 25, 30, 45, 60, 90, 120):
+        if "lunch_start" in settings:
+            expected = reference.generate_slots_with_lunch(
+                open_time, close_time, settings["lunch_start"], settings["lunch_end"], duration
+            )
+        else:
+            expected = reference.generate_slots(open_time, close_time, duration)
+        assert format_slots(day_slot_minutes(settings, duration)) == expected
+
+
+def test_slots_respect_buffer_and_breaks():
+    settings = {
+        "open_time": "09:00",
+        "close_time": "12:00",
+        "breaks": [{"start": "10:00", "end": "10:15"}],
+        "buffer_between_appointments": 10,
+    }
+    slots = day_slot_minutes(settings, 30)
+    windows = build_open_windows(9 * 60, 12 * 60, [(600, 615)])
+    for start in slots:
+        assert any(w_start <= start and start + 30 <= w_end for w_start, w_end in windows)
+    assert format_slots(slots) == ["09:00", "10:15", "10:55"]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_blocked_index_matches_original_check(seed):
+    rng = random.Random(seed)
+    base = date(2026, 1, 1)
+    blocked_dates = [(base + timedelta(days=rng.randrange(365))).isoformat() for _ in range(rng.randrange(15))]
+    periods = []
+    for _ in range(rng.randrange(6)):
+        start = base + timedelta(days=rng.randrange(365))
+        periods.append({"start": start.isoformat(), "end": (start + timedelta(days=rng.randrange(20))).isoformat()})
+    index = BlockedIndex(blocked_dates, periods)
+    days = [base + timedelta(days=i) for i in range(380)]
+    expected = [reference.is_date_blocked(blocked_dates, periods, d.isoformat()) for d in days]
+    assert index.blocked_mask(days) == expected
+    assert [index.is_blocked(d.isoformat()) for d in days] == expected
+
+
+def _random_intervals(rng: random.Random, count: int):
+    intervals = []
+    for _ in range(count):
+        start = rng.randrange(8 * 60, 19 * 60, 5)
+        intervals.append((start, start + rng.choice([15, 30, 45, 60, 90])))
+    return intervals
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_timeline_free_slots_match_brute_force(seed):
+    rng = random.Random(seed)
+    intervals = _random_intervals(rng, rng.randrange(0, 25))
+    buffer_minutes = rng.choice([0, 0, 5, 10])
+    timeline = OccupancyTimeline(intervals, buffer_minutes)
+    for duration in (15, 30, 60):
+        grid = list(range(8 * 60, 20 * 60 - duration + 1, rng.choice([5, 15, duration])))
+        for capacity in (1, 2, 3):
+            assert timeline.free_slots(grid, duration, capacity) == reference.brute_force_free_slots(
+                intervals, buffer_minutes, grid, duration, capacity
+            )
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_timeline_max_overlap_matches_brute_force(seed):
+    rng = random.Random(seed)
+    intervals = _random_intervals(rng, rng.randrange(0, 20))
+    timeline = OccupancyTimeline(intervals, 5)
+    for _ in range(50):
+        start = rng.randrange(7 * 60, 20 * 60)
+        end = start + rng.randrange(1, 120)
+        assert timeline.max_overlap(start, end) == reference.brute_force_overlap(intervals, 5, start, end)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rank_slots_is_a_permutation(seed):
+    rng = random.Random(seed)
+    intervals = _random_intervals(rng, rng.randrange(0, 10))
+    timeline = OccupancyTimeline(intervals)
+    windows = build_open_windows(9 * 60, 18 * 60, [(13 * 60, 14 * 60)])
+    slots = sorted(rng.sample(range(9 * 60, 17 * 60, 15), 12))
+    ranked = rank_slots(slots, 30, timeline, windows, 30)
+    assert sorted(ranked) == slots
+
+
+def test_rank_slots_prefers_slots_that_close_gaps():
+    # Busy 10:00-11:00 and 11:30-12:00 inside a 09:00-13:00 window
+    timeline = OccupancyTimeline([(600, 660), (690, 720)])
+    ranked = rank_slots([540, 555, 660, 720], 30, timeline, [(540, 780)], 30)
+    # 11:00 fills the 30-minute hole exactly; 09:15 leaves two 15-minute holes
+    assert ranked[0] == 660
+    assert ranked[-1] == 555
+
+
+def _resource_case(rng: random.Random):
+    resources = []
+    for i in range(rng.randrange(1, 4)):
+        resources.append({"id": f"d{i}", "kind": "dentist", "open_time": rng.choice([None, "10:00"])})
+    for i in range(rng.randrange(1, 3)):
+        resources.append({"id": f"c{i}", "kind": "chair"})
+    eligibility = [
+        {"treatment_id": "t1", "resource_id": r["id"]} for r in resources if rng.random() < 0.7
+    ]
+    catalog = ResourceCatalog(resources, eligibility)
+    intervals = []
+    for _ in range(rng.randrange(0, 12)):
+        start = rng.randrange(9 * 60, 17 * 60, GRAIN_MINUTES)
+        chosen = [r["id"] for r in rng.sample(resources, rng.randrange(0, len(resources) + 1))]
+        intervals.append((start, start + rng.choice([15, 30, 45, 60]), chosen))
+    return catalog, intervals
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_resource_day_matches_brute_force(seed):
+    rng = random.Random(seed)
+    catalog, intervals = _resource_case(rng)
+    settings = {
+        "open_time": "09:00",
+        "close_time": "18:00",
+        "lunch_start": "13:00",
+        "lunch_end": "14:00",
+        "work_days": [0, 1, 2, 3, 4, 5, 6],
+        "buffer_between_appointments": rng.choice([0, 5, 10]),
+    }
+    day = ResourceDay(settings, catalog, "2026-03-02", intervals)
+
+    # Independent minute-set model (all times are multiples of GRAIN_MINUTES)
+    buffer_minutes = settings["buffer_between_appointments"]
+    free_minutes = {}
+    for resource in catalog.resources:
+        open_minute = parse_hhmm(resource.get("open_time") or settings["open_time"])
+        free_minutes[resource["id"]] = {
+            m for m in range(open_minute, 18 * 60) if not 13 * 60 <= m < 14 * 60
+        }
+    for start, end, resource_ids in intervals:
+        busy = set(range(start - buffer_minutes, end + buffer_minutes))
+        targets = [r for r in resource_ids if r in free_minutes]
+        if not targets:
+            # Legacy rows take the first resource of each kind that is free
+            chosen = {}
+            for resource in catalog.resources:
+                if resource["kind"] not in chosen and busy <= free_minutes[resource["id"]]:
+                    chosen[resource["kind"]] = resource["id"]
+            targets = list(chosen.values())
+        for resource_id in targets:
+            free_minutes[resource_id] -= busy
+
+    for treatment_id in ("t1", "t2"):
+        requirements = catalog.requirements(treatment_id)
+        for duration in (15, 30, 60):
+            grid = list(range(9 * 60, 18 * 60 - duration + 1, 15))
+            expected = reference.brute_force_resource_free(free_minutes, requirements, grid, duration)
+            assert day.free_slots(treatment_id, grid, duration) == expected
+            for start in expected:
+                assigned = day.assign(treatment_id, start, duration)
+                assert assigned is not None and len(assigned) == len(requirements)
+
+
+def test_runs_mask_matches_naive():
+    rng = random.Random(7)
+    for _ in range(200):
+        bits = rng.getrandbits(64)
+        length = rng.randrange(1, 20)
+        naive = 0
+        for i in range(64):
+            if all(bits >> (i + k) & 1 for k in range(length)):
+                naive |= 1 << i
+        assert runs_mask(bits, length) == naive
@@ -0,0 +1,61 @@
+from fastapi.testclient import TestClient
+
+from tests import harness
+import app.main
+from app.services import agenda_logic
+from app.services.clinic_calendar import clinic_today
+
+CLINIC = "clinic-1"
+
+
+def _seeded(db, rng):
+    settings = harness.seed_clinic(db, CLINIC, rng, appointments_per_month=90, allow_double_booking=False)
+    harness.seed_clinic(db, "clinic-2", rng, appointments_per_month=30)
+    today = clinic_today(settings).isoformat()
+    rows = [a for a in db.tables["appointments"] if a["clinic_id"] == CLINIC and a["date"] >= today]
+    return settings, rows
+
+
+def test_bulk_confirm_skips_cancelled_and_foreign_appointments(db, rng):
+    _, rows = _seeded(db, rng)
+    cancelled = [a for a in rows if a["status"] == "cancelled"][:3]
+    active = [a for a in rows if a["status"] != "cancelled"][:5]
+    foreign = next(a for a in db.tables["appointments"] if a["clinic_id"] == "clinic-2")
+    foreign_status = foreign["status"]
+    ids = [a["id"] for a in cancelled + active] + [foreign["id"]]
+
+    client = TestClient(app.main.fastapi_app)
+    result = client.post("/api/appointments/bulk/confirm", json={"clinic_id": CLINIC, "appointment_ids": ids}).json()
+
+    assert result["confirmed"] == len(active)
+    assert set(result["not_found"]) == {a["id"] for a in cancelled} | {foreign["id"]}
+    assert {a["status"] for a in cancelled} == {"cancelled"}
+    assert {a["status"] for a in active} == {"confirmed"}
+    assert foreign["status"] == foreign_status
+    (audit,) = [row for row in db.tables["outbox_events"] if row["kind"] == "audit"]
+    assert {r["entity_id"] for r in audit["payload"]["rows"]} == {a["id"] for a in active}
+
+
+def test_bulk_cancel_frees_the_slots_in_the_inventory(db, rng):
+    _, rows = _seeded(db, rng)
+    active = [a for a in rows if a["status"] != "cancelled"]
+    day = active[0]["date"]
+    on_day = [a for a in active if a["date"] == day]
+    treatment_id = f"{CLINIC}-t0"
+    before = agenda_logic.get_available_slots(CLINIC, day, treatment_id)
+
+    client = TestClient(app.main.fastapi_app)
+    payload = {"clinic_id": CLINIC, "appointment_ids": [a["id"] for a in on_day], "reason": "x"}
+    result = client.post("/api/appointments/bulk/cancel", json=payload).json()
+    assert result["cancelled"] == len(on_day)
+
+    after = agenda_logic.get_available_slots(CLINIC, day, treatment_id)
+    assert set(before) < set(after)
+    agenda_logic.slot_inventory.invalidate()
+    assert agenda_logic.get_available_slots(CLINIC, day, treatment_id) == after
+
+    # Cancelling again changes nothing and records no new effects
+    effects = len(db.tables["outbox_events"])
+    again = client.post("/api/appointments/bulk/cancel", json=payload).json()
+    assert again["cancelled"] == 0
+    assert len(db.tables["outbox_events"]) == effects
@@ -0,0 +1,95 @@
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests import harness, reference
+import app.main
+from app.services.capacity_simulator import MAX_SIMULATION_DAYS, Demand, simulate
+
+FIRST_DAY = "2026-03-02"  # Monday
+TREATMENTS = [
+    {"id": "t30", "duration_minutes": 30, "base_price": 1000},
+    {"id": "t60", "duration_minutes": 60, "base_price": 4000},
+]
+
+
+def _request(day: str, start: str, treatment_id: str, arrival: int) -> dict:
+    return {"date": day, "start_time": start, "treatment_id": treatment_id, "created_at": f"2026-01-01T00:{arrival:02d}"}
+
+
+def _check(settings: dict, rows: list, n_days: int = 7) -> dict:
+    result = simulate(settings, Demand(date.fromisoformat(FIRST_DAY), rows, TREATMENTS), n_days)
+    expected = reference.reference_simulate(settings, rows, TREATMENTS, FIRST_DAY, n_days)
+    assert {k: result[k] for k in expected} == expected
+    assert result["accepted"] + result["rejected"] == len(rows)
+    assert 0 <= result["utilization"] <= 1
+    return result
+
+
+def test_capacity_one_accepts_once_per_slot():
+    settings = harness.clinic_settings("c1", allow_double_booking=False)
+    rows = [
+        _request(FIRST_DAY, "09:00", "t30", 0),
+        _request(FIRST_DAY, "09:10", "t30", 1),  # snaps to 09:00: taken
+        _request(FIRST_DAY, "10:00", "t60", 2),
+        _request("2026-03-07", "09:00", "t30", 3),  # Saturday: closed
+    ]
+    result = _check(settings, rows)
+    assert (result["accepted"], result["rejected_capacity"], result["rejected_closed"]) == (2, 1, 1)
+    assert result["overbooked"] == 0
+
+
+def test_overbooking_is_accepted_up_to_capacity_and_charged():
+    settings = harness.clinic_settings(
+        "c1", max_appointments_per_slot=3, overbooking_extra_fee=10, overbooking_fee_type="percent"
+    )
+    rows = [_request(FIRST_DAY, "10:00", "t60", n) for n in range(4)] + [_request(FIRST_DAY, "10:30", "t30", 4)]
+    result = _check(settings, rows)
+    assert (result["accepted"], result["overbooked"], result["rejected_capacity"]) == (3, 2, 2)
+    assert result["extra_fee_revenue"] == 800.0
+
+    # Full days at capacity 3: utilization stays within [0, 1]
+    full = [
+        _request(FIRST_DAY, f"{h:02d}:{m:02d}", "t30", n)
+        for n, (h, m) in enumerate((h, m) for h in range(9, 18) for m in (0, 30) for _ in range(3))
+    ]
+    assert _check(settings, full, n_days=1)["utilization"] == 1.0
+
+
+def test_daily_limit_rejects_after_the_limit_in_arrival_order():
+    settings = harness.clinic_settings("c1", max_appointments_per_day=2, buffer_between_appointments=10)
+    rows = [
+        _request(FIRST_DAY, "11:00", "t30", 2),
+        _request(FIRST_DAY, "09:00", "t30", 0),
+        _request(FIRST_DAY, "10:00", "t30", 1),
+        _request("2026-03-03", "09:00", "t30", 3),
+    ]
+    result = _check(settings, rows)
+    assert (result["accepted"], result["rejected_daily_limit"]) == (3, 1)
+
+
+def test_random_demand_matches_the_reference(rng):
+    settings = harness.clinic_settings(
+        "c1", max_appointments_per_slot=2, max_appointments_per_day=12, buffer_between_appointments=5
+    )
+    days = [f"2026-03-{d:02d}" for d in range(2, 16)]
+    rows = [
+        _request(
+            rng.choice(days),
+            f"{rng.randrange(8, 19):02d}:{rng.randrange(0, 60, 5):02d}",
+            rng.choice(["t30", "t60"]),
+            n % 60,
+        )
+        for n in range(400)
+    ]
+    _check(settings, rows, n_days=14)
+
+
+@pytest.mark.parametrize("params", [{"start_date": "2020-01-01"}, {"start_date": "2023-01-01", "end_date": "2026-01-01"}])
+def test_simulation_range_is_capped(db, params):
+    db.seed("clinic_settings", [harness.clinic_settings("c1")])
+    client = TestClient(app.main.fastapi_app)
+    response = client.post("/api/availability/simulate", json={"clinic_id": "c1", "configs": [], **params})
+    assert response.status_code == 400
+    assert str(MAX_SIMULATION_DAYS) in response.json()["detail"]
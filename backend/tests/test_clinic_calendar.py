@@ -0,0 +1,52 @@
+from datetime import date, datetime
+
+import pytest
+import pytz
+
+from tests import harness
+from app.services import clinic_calendar
+from app.services.availability import BlockedIndex
+
+
+def _freeze_utc(monkeypatch, instant: datetime) -> None:
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return instant.astimezone(tz) if tz else instant.replace(tzinfo=None)
+
+    monkeypatch.setattr(clinic_calendar, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize(
+    "timezone, expected",
+    [
+        # 02:30 UTC on the 3rd is still the evening of the 2nd in Buenos Aires (UTC-3)
+        ("America/Argentina/Buenos_Aires", (date(2026, 3, 2), "23:30")),
+        ("Asia/Tokyo", (date(2026, 3, 3), "11:30")),
+        ("UTC", (date(2026, 3, 3), "02:30")),
+        # Unknown or missing timezone: the default (Buenos Aires), not the server's
+        ("Mars/Olympus", (date(2026, 3, 2), "23:30")),
+        (None, (date(2026, 3, 2), "23:30")),
+    ],
+)
+def test_clinic_day_follows_the_clinic_timezone_around_midnight(monkeypatch, timezone, expected):
+    _freeze_utc(monkeypatch, datetime(2026, 3, 3, 2, 30, tzinfo=pytz.utc))
+    settings = harness.clinic_settings("c1", timezone=timezone)
+    now = clinic_calendar.clinic_now(settings)
+    assert (clinic_calendar.clinic_today(settings), now.strftime("%H:%M")) == expected
+
+
+def test_calendar_days_start_at_the_clinic_today(monkeypatch):
+    _freeze_utc(monkeypatch, datetime(2026, 3, 3, 2, 30, tzinfo=pytz.utc))
+    settings = harness.clinic_settings("c1", blocked_dates=["2026-03-03"])
+    calendar = clinic_calendar.ClinicCalendar(
+        settings, BlockedIndex(settings["blocked_dates"], []), clinic_calendar.clinic_today(settings), horizon_days=3
+    )
+    assert [(d["date"], d["day_name"], d["available"]) for d in calendar.days(5)] == [
+        ("2026-03-02", "Lunes", True),
+        ("2026-03-03", "Martes", False),
+        ("2026-03-04", "Miércoles", True),
+        ("2026-03-05", "Jueves", True),
+        ("2026-03-06", "Viernes", True),
+    ]
+    assert calendar.open_dates(5) == ["2026-03-02", "2026-03-04", "2026-03-05", "2026-03-06"]
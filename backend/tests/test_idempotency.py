@@ -0,0 +1,52 @@
+import threading
+import time
+
+import pytest
+
+from app.services.idempotency import IdempotencyConflict, IdempotencyStore
+
+
+def test_replay_returns_stored_result_without_running_again():
+    store = IdempotencyStore("test_idempotency_replay", ttl_seconds=60, max_entries=10)
+    calls = []
+    first = store.run("k", {"slot": "09:00"}, lambda: calls.append(1) or {"id": "a1"})
+    again = store.run("k", {"slot": "09:00"}, lambda: calls.append(1) or {"id": "a2"})
+    assert first == ({"id": "a1"}, False)
+    assert again == ({"id": "a1"}, True)
+    assert len(calls) == 1
+
+
+def test_same_key_with_other_payload_conflicts():
+    store = IdempotencyStore("test_idempotency_conflict", ttl_seconds=60, max_entries=10)
+    store.run("k", {"slot": "09:00"}, lambda: {"id": "a1"})
+    with pytest.raises(IdempotencyConflict):
+        store.run("k", {"slot": "10:00"}, lambda: {"id": "a2"})
+
+
+def test_concurrent_duplicates_run_once():
+    store = IdempotencyStore("test_idempotency_concurrent", ttl_seconds=60, max_entries=10)
+    calls = []
+
+    def book():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"id": "a1"}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(store.run("k", {}, book))) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False] + [True] * 7
+
+
+def test_store_is_bounded():
+    store = IdempotencyStore("test_idempotency_bounded", ttl_seconds=60, max_entries=2)
+    for key in ("a", "b", "c"):
+        store.run(key, {}, lambda: {"key": key})
+    _, replayed = store.run("a", {}, lambda: {"key": "a"})
+    assert replayed is False
@@ -0,0 +1,164 @@
+import asyncio
+
+import pytest
+from postgrest.exceptions import APIError
+
+from tests import harness  # noqa: F401  (environment + sys.path)
+from app.services import outbox
+
+
+def _drain(dispatcher: outbox.OutboxDispatcher) -> int:
+    return asyncio.run(dispatcher.drain_once())
+
+
+def test_effects_are_recorded_with_one_insert_and_drained_in_batches(db):
+    for i in range(3):
+        outbox.record_effects(
+            "c1",
+            [
+                outbox.effect_audit("c1", "confirm_appointment", "appointments", [(f"a{i}", {"status": "confirmed"})]),
+                outbox.effect_event("appointment_confirmed", {"appointment_id": f"a{i}"}),
+                outbox.effect_broadcast("appointment_confirmed", {"appointment_id": f"a{i}"}),
+            ],
+        )
+    assert db.calls[("outbox_events", "insert")] == 3
+    assert db.query_count("audit_logs") == 0
+
+    dispatcher = outbox.OutboxDispatcher(batch_size=100)
+    # Each event is two rows: system_events and alerts
+    assert _drain(dispatcher) == 12
+    # Audit rows of the whole batch go in one insert
+    assert db.calls[("audit_logs", "insert")] == 1
+    assert len(db.tables["audit_logs"]) == 3
+    assert len(db.tables["system_events"]) == 3
+    assert {row["status"] for row in db.tables["outbox_events"]} == {"done"}
+    assert _drain(dispatcher) == 0
+
+
+def test_failures_are_retried_with_backoff_then_marked_failed(db, monkeypatch):
+    def fail(_rows):
+        raise RuntimeError("audit_logs unavailable")
+
+    monkeypatch.setattr(outbox, "_handle_audit", fail)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    outbox.record_effects("c1", [outbox.effect_audit("c1", "x", "appointments", [("a1", None)])])
+    dispatcher = outbox.OutboxDispatcher(batch_size=10)
+
+    assert _drain(dispatcher) == 1
+    row = db.tables["outbox_events"][0]
+    assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "audit_logs unavailable")
+    # Not available again until the backoff expires
+    assert _drain(dispatcher) == 0
+
+    row["available_at"] = outbox._utcnow().isoformat()
+    assert _drain(dispatcher) == 1
+    assert (row["status"], row["attempts"]) == ("failed", 2)
+    assert dispatcher.stats()["retried"] == 1 and dispatcher.stats()["failed"] == 1
+
+
+def test_failed_reschedule_records_no_effects(db, rng):
+    from fastapi.testclient import TestClient
+    import app.main
+
+    harness.seed_clinic(db, "c1", rng, appointments_per_month=30)
+    appointment = db.tables["appointments"][0]
+    client = TestClient(app.main.fastapi_app)
+    response = client.patch(
+        f"/api/appointments/{appointment['id']}/reschedule",
+        json={"appointment_id": appointment["id"], "new_date": appointment["date"], "new_time": "03:00"},
+    )
+    assert response.json().get("error")
+    assert not db.tables.get("outbox_events")
+
+
+def test_retries_only_repeat_the_failed_clinic_and_effect(db, monkeypatch):
+    db.seed(
+        "automation_rules",
+        [
+            {"id": f"r-{c}", "clinic_id": c, "trigger": "appointment_confirmed", "template": "Hola", "enabled": True}
+            for c in ("c1", "c2")
+        ],
+    )
+    appointments = [
+        {"id": "a1", "clinic_id": "c1", "patient_name": "Ana"},
+        {"id": "a2", "clinic_id": "c2", "patient_name": "Beto"},
+    ]
+    outbox.record_effects(
+        "c1",
+        [
+            outbox.effect_automations("appointment_confirmed", appointments),
+            outbox.effect_event("appointment_confirmed", {"appointment_id": "a1"}),
+        ],
+    )
+    assert [(row["kind"], row["clinic_id"]) for row in db.tables["outbox_events"]] == [
+        ("automations", "c1"),
+        ("automations", "c2"),
+        ("event", "c1"),
+        ("alerts", "c1"),
+    ]
+
+    real = outbox.run_automations_for_appointments
+
+    def flaky_automations(trigger, rows):
+        if rows[0]["clinic_id"] == "c2" and not calls:
+            calls.append(trigger)
+            raise RuntimeError("messages insert timeout")
+        return real(trigger, rows)
+
+    def flaky_alerts(*_args, **_kwargs):
+        if len(calls) < 2:
+            calls.append("alerts")
+            raise RuntimeError("smtp down")
+        return []
+
+    calls = []
+    monkeypatch.setattr(outbox, "run_automations_for_appointments", flaky_automations)
+    monkeypatch.setattr(outbox, "dispatch_alerts", flaky_alerts)
+    dispatcher = outbox.OutboxDispatcher(batch_size=10)
+    assert _drain(dispatcher) == 4
+    assert len(db.tables["messages"]) == 1 and len(db.tables["system_events"]) == 1
+
+    for row in db.tables["outbox_events"]:
+        row["available_at"] = outbox._utcnow().isoformat()
+    # Only the c2 automations and the alerts are retried
+    assert _drain(dispatcher) == 2
+    assert sorted(m["clinic_id"] for m in db.tables["messages"]) == ["c1", "c2"]
+    assert len(db.tables["system_events"]) == 1
+    assert {row["status"] for row in db.tables["outbox_events"]} == {"done"}
+
+
+def _failing_insert(monkeypatch, db, code):
+    attempts = []
+    table = type(db).table.__get__(db)
+
+    def fake_table(name):
+        query = table(name)
+        if name == "outbox_events":
+            def execute():
+                attempts.append(code)
+                raise APIError({"code": code, "message": "boom"})
+            query.execute = execute
+        return query
+
+    monkeypatch.setattr(db, "table", fake_table)
+    return attempts
+
+
+def test_only_a_missing_outbox_table_runs_effects_inline(db, monkeypatch):
+    effects = [outbox.effect_event("appointment_confirmed", {"appointment_id": "a1"})]
+
+    attempts = _failing_insert(monkeypatch, db, "57014")
+    with pytest.raises(APIError):
+        outbox.record_effects("c1", effects)
+    assert len(attempts) == outbox.OUTBOX_INSERT_ATTEMPTS
+    assert "system_events" not in db.tables  # nothing ran on the request
+
+    _failing_insert(monkeypatch, db, "PGRST205")
+    outbox.record_effects("c1", effects)
+    assert len(db.tables["system_events"]) == 1
+
+
+def test_missing_claim_rpc_is_logged(db, caplog):
+    with caplog.at_level("WARNING", logger="app.services.outbox"):
+        assert outbox.claim_batch() == []
+    assert "single dispatcher" in caplog.text
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from fastapi.testclient import TestClient
+
+from tests import harness, reference
+import app.main
+from app.services import agenda_logic
+from app.services.clinic_calendar import clinic_today
+
+CLINIC = "clinic-1"
+
+
+def _busy_day(db, settings):
+    today = clinic_today(settings)
+    days = [(today + timedelta(days=i)).isoformat() for i in range(1, 10)]
+    return next(
+        d for d in days
+        if any(a["date"] == d and a["status"] != "cancelled" for a in db.tables["appointments"])
+    )
+
+
+def _outbox(db, kind):
+    return [row for row in db.tables.get("outbox_events", []) if row["kind"] == kind]
+
+
+def test_impact_without_apply_writes_nothing(db, rng):
+    settings = harness.seed_clinic(db, CLINIC, rng, appointments_per_month=120)
+    day = _busy_day(db, settings)
+    before = [dict(a) for a in db.tables["appointments"]]
+
+    client = TestClient(app.main.fastapi_app)
+    result = client.post(f"/api/clinic-settings/{CLINIC}/blocked-impact", json={"dates": [day]}).json()
+
+    assert result["affected"] > 0 and not result["applied"]
+    assert len(result["rebooked"]) + len(result["unplaced"]) == result["affected"]
+    assert db.tables["appointments"] == before
+    assert "outbox_events" not in db.tables
+
+
+def test_blocking_with_rebook_moves_appointments_with_the_reschedule_effects(db, rng):
+    settings = harness.seed_clinic(db, CLINIC, rng, appointments_per_month=120)
+    day = _busy_day(db, settings)
+    affected = {a["id"] for a in db.tables["appointments"] if a["date"] == day and a["status"] != "cancelled"}
+
+    client = TestClient(app.main.fastapi_app)
+    response = client.post(f"/api/clinic-settings/{CLINIC}/blocked-dates?rebook=true", json={"dates": [day]})
+    rebooking = response.json()["rebooking"]
+    moved = {m["appointment_id"]: m["to"] for m in rebooking["rebooked"]}
+
+    assert rebooking["applied"] and moved and set(moved) <= affected
+    by_id = {a["id"]: a for a in db.tables["appointments"]}
+    for appointment_id, to in moved.items():
+        row = by_id[appointment_id]
+        assert (row["date"], row["start_time"], row["status"]) == (to["date"], to["time"], "pending")
+    assert rebooking["notifications"] == len(db.tables["patient_notifications"]) == len(moved)
+
+    # Same side effects as a reschedule: per-appointment audit, event and broadcast
+    (audit,) = [
+        row for row in _outbox(db, "audit") if row["payload"]["rows"][0]["action"] == "reschedule_appointment"
+    ]
+    assert {r["entity_id"] for r in audit["payload"]["rows"]} == set(moved)
+    assert [r["payload"]["event"] for r in _outbox(db, "broadcast")] == ["appointment_rescheduled"]
+    assert [r["payload"]["event_type"] for r in _outbox(db, "event")] == ["appointment_rescheduled"]
+
+    # The moves never overbook their new days
+    treatments = {t["id"]: t for t in harness.treatment_rows(CLINIC)}
+    capacity = settings["max_appointments_per_slot"]
+    for target in {to["date"] for to in moved.values()}:
+        intervals = [
+            reference.appointment_interval(a, treatments, 30)
+            for a in db.tables["appointments"]
+            if a["date"] == target and a["status"] != "cancelled"
+        ]
+        for appointment_id in (i for i, to in moved.items() if to["date"] == target):
+            start, end = reference.appointment_interval(by_id[appointment_id], treatments, 30)
+            assert reference.brute_force_overlap(intervals, 0, start, end) <= capacity
+    assert agenda_logic.get_available_slots(CLINIC, day, f"{CLINIC}-t0") == []
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from tests import harness
+from tests.fake_booking import install_booking_rpc
+import app.main
+from app.services import agenda_logic
+from app.services.clinic_calendar import clinic_today
+from app.services.resources import ResourceCatalog, ResourceDay
+
+
+def _two_clinics(db) -> None:
+    db.seed("treatments", harness.treatment_rows("c1") + harness.treatment_rows("c2"))
+    db.seed(
+        "resources",
+        [
+            {"id": "r1", "clinic_id": "c1", "name": "Dra. A", "kind": "dentist"},
+            {"id": "r2", "clinic_id": "c2", "name": "Dr. B", "kind": "dentist"},
+        ],
+    )
+    db.seed(
+        "treatment_resources",
+        [
+            {"clinic_id": "c1", "treatment_id": "c1-t0", "resource_id": "r1"},
+            {"clinic_id": "c2", "treatment_id": "c2-t0", "resource_id": "r2"},
+        ],
+    )
+
+
+def test_eligibility_cannot_cross_clinics(db):
+    _two_clinics(db)
+    client = TestClient(app.main.fastapi_app)
+
+    # Another clinic's treatment: 404, its rows stay
+    response = client.put("/api/treatments/c2-t0/resources", json={"clinic_id": "c1", "resource_ids": []})
+    assert response.status_code == 404
+    # Another clinic's resource on an own treatment: 400, nothing replaced
+    response = client.put("/api/treatments/c1-t0/resources", json={"clinic_id": "c1", "resource_ids": ["r2"]})
+    assert response.status_code == 400
+    assert sorted(r["resource_id"] for r in db.tables["treatment_resources"]) == ["r1", "r2"]
+
+    response = client.put("/api/treatments/c1-t0/resources", json={"clinic_id": "c1", "resource_ids": []})
+    assert response.status_code == 200
+    assert db.tables["treatment_resources"] == [
+        {"clinic_id": "c2", "treatment_id": "c2-t0", "resource_id": "r2"}
+    ]
+
+
+def test_kinds_missing_from_eligibility_are_still_required():
+    catalog = ResourceCatalog(
+        [
+            {"id": "d1", "kind": "dentist"},
+            {"id": "d2", "kind": "dentist"},
+            {"id": "c1", "kind": "chair"},
+            {"id": "c2", "kind": "chair"},
+        ],
+        [{"treatment_id": "t1", "resource_id": "d2"}],
+    )
+    assert catalog.requirements("t1") == {"dentist": ["d2"], "chair": ["c1", "c2"]}
+    assert catalog.requirements("t2") == {"dentist": ["d1", "d2"], "chair": ["c1", "c2"]}
+
+    # Both chairs busy: a dentist-only eligibility must not book a third patient
+    settings = harness.clinic_settings("c1", work_days=[0, 1, 2, 3, 4, 5, 6])
+    day = ResourceDay(settings, catalog, "2026-03-02", [(600, 630, ["d1", "c1"]), (600, 630, ["c2"])])
+    assert day.free_slots("t1", [600, 630], 30) == [630]
+
+
+def test_resource_hours_can_only_narrow_the_clinic(db):
+    db.seed("clinic_settings", [harness.clinic_settings("c1")])
+    client = TestClient(app.main.fastapi_app)
+    base = {"clinic_id": "c1", "name": "Dra. A", "kind": "dentist"}
+
+    assert client.post("/api/resources", json={**base, "work_days": [5]}).status_code == 400
+    assert client.post("/api/resources", json={**base, "open_time": "08:00"}).status_code == 400
+    assert client.post("/api/resources", json={**base, "close_time": "19:00"}).status_code == 400
+    created = client.post("/api/resources", json={**base, "work_days": [0, 2], "open_time": "10:00"})
+    assert created.status_code == 200
+
+    resource_id = created.json()["id"]
+    response = client.put(f"/api/resources/{resource_id}?clinic_id=c1", json={"close_time": "09:30"})
+    assert response.status_code == 400  # before the stored 10:00 opening
+
+    # Legacy rows outside the clinic hours are clamped, not trusted
+    legacy = {"id": "r9", "kind": "dentist", "work_days": [0, 6], "open_time": "07:00", "close_time": "20:00"}
+    settings = harness.clinic_settings("c1")
+    catalog = ResourceCatalog([legacy], [])
+    assert ResourceDay(settings, catalog, "2026-03-08", []).free["r9"] == 0  # Sunday: clinic closed
+    monday = ResourceDay(settings, catalog, "2026-03-02", [])
+    assert monday.free_slots(None, [480, 540, 1050, 1080], 30) == [540, 1050]
+
+
+@pytest.mark.parametrize("rpc", [True, False])
+def test_resource_scheduling_without_resources_books_nothing(db, rng, rpc):
+    settings = harness.seed_clinic(
+        db, "c1", rng, appointments_per_month=0, resource_scheduling=True, work_days=[0, 1, 2, 3, 4, 5, 6]
+    )
+    if rpc:
+        install_booking_rpc(db)
+    day = (clinic_today(settings) + timedelta(days=7)).isoformat()
+    assert agenda_logic.get_available_slots("c1", day, "c1-t0") == []
+
+    for _ in range(5):
+        result = agenda_logic.create_appointment("c1", "Paciente", "549", day, "10:00", "c1-t0")
+        assert result["code"] == "resource_conflict"
+    assert db.tables.get("appointments", []) == []
+    assert db.calls[("rpc", "book_appointment")] == 0
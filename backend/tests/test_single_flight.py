@@ -0,0 +1,86 @@
+import threading
+import time
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+def _run_concurrently(flight, key, fn, count):
+    """count callers of flight.do(key, fn); the first one is already inside fn when the rest call."""
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    return threads, results, errors
+
+
+def _wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight("test")
+    entered, release = threading.Event(), threading.Event()
+    executions = []
+
+    def load():
+        executions.append(1)
+        entered.set()
+        assert release.wait(5)
+        return {"value": 42}
+
+    threads, results, errors = _run_concurrently(flight, "k", load, 5)
+    threads[0].start()
+    assert entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.stats()["collapsed"] == 4)
+    # Another key is not held back by the in-flight one
+    assert flight.do("other", lambda: "free") == "free"
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(executions) == 1 and not errors
+    assert results == [{"value": 42}] * 5 and all(r is results[0] for r in results)
+    stats = flight.stats()
+    assert (stats["calls"], stats["executions"], stats["collapsed"], stats["in_flight"]) == (6, 2, 4, 0)
+
+
+def test_an_error_reaches_every_waiter_and_releases_the_key():
+    flight = SingleFlight("test")
+    entered, release = threading.Event(), threading.Event()
+
+    def fail():
+        entered.set()
+        assert release.wait(5)
+        raise RuntimeError("db down")
+
+    threads, results, errors = _run_concurrently(flight, "k", fail, 3)
+    threads[0].start()
+    assert entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flight.stats()["collapsed"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [] and len(errors) == 3
+    assert all(isinstance(e, RuntimeError) and str(e) == "db down" for e in errors)
+    assert flight.stats()["in_flight"] == 0
+
+    # Nothing is cached after the failure: the next caller runs again
+    assert flight.do("k", lambda: "recovered") == "recovered"
+    with pytest.raises(ValueError):
+        flight.do("k", lambda: int("x"))
+    assert flight.do("k", lambda: "again") == "again"
@@ -0,0 +1,67 @@
+import threading
+from datetime import date
+
+from app.services.availability import OccupancyTimeline, parse_hhmm
+from app.services.slot_inventory import SlotInventory
+
+DAY = "2026-03-02"
+SETTINGS = {"open_time": "09:00", "close_time": "12:00", "slot_minutes": 30, "work_days": [0, 1, 2, 3, 4]}
+
+
+def _timeline(clinic_id, settings, rows):
+    return OccupancyTimeline([(parse_hhmm(r["start_time"]), parse_hhmm(r["end_time"])) for r in rows])
+
+
+def test_a_slow_rebuild_does_not_block_other_clinics():
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def loader(clinic_id, first, last):
+        loads.append(clinic_id)
+        if clinic_id == "slow":
+            started.set()
+            assert release.wait(5)
+        return {}
+
+    inventory = SlotInventory(loader, _timeline, horizon_days=7, today=lambda settings: date(2026, 3, 2))
+    results = {}
+    readers = [
+        threading.Thread(target=lambda: results.setdefault(n, inventory.get_slots("slow", SETTINGS, DAY, 30, 1)))
+        for n in range(3)
+    ]
+    for reader in readers:
+        reader.start()
+    assert started.wait(5)
+
+    # The slow clinic's query is in flight: other clinics still read, changes are kept
+    assert inventory.get_slots("fast", SETTINGS, DAY, 30, 1)[:2] == ["09:00", "09:30"]
+    inventory.apply_change({"id": "a1", "clinic_id": "slow", "date": DAY, "start_time": "09:00", "end_time": "09:30"})
+    release.set()
+    for reader in readers:
+        reader.join()
+
+    assert loads == ["slow", "fast"]  # the three slow readers shared one query
+    assert inventory.get_slots("slow", SETTINGS, DAY, 30, 1)[0] == "09:30"
+
+
+def test_invalidate_during_a_load_discards_it():
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def loader(clinic_id, first, last):
+        calls.append(clinic_id)
+        if len(calls) == 1:
+            started.set()
+            assert release.wait(5)
+        return {}
+
+    inventory = SlotInventory(loader, _timeline, horizon_days=7, today=lambda settings: date(2026, 3, 2))
+    reader = threading.Thread(target=lambda: inventory.get_slots("c1", SETTINGS, DAY, 30, 1))
+    reader.start()
+    assert started.wait(5)
+    inventory.invalidate("c1")
+    release.set()
+    reader.join()
+
+    inventory.get_slots("c1", SETTINGS, DAY, 30, 1)
+    assert calls == ["c1", "c1"]
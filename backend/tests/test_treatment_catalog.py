@@ -0,0 +1,33 @@
+from fastapi.testclient import TestClient
+
+from tests import harness
+import app.main
+from app.routers import treatments as treatments_router
+from app.services import treatment_catalog
+
+
+def test_unknown_ids_reload_the_catalog_at_most_once_per_window(db):
+    db.seed("treatments", harness.treatment_rows("c1")[:1])
+    assert treatment_catalog.get_treatment("c1", "c1-t0")["id"] == "c1-t0"
+
+    # Created by another process: the first miss reloads
+    db.seed("treatments", harness.treatment_rows("c1")[1:2])
+    assert treatment_catalog.get_treatment("c1", "c1-t1")["id"] == "c1-t1"
+
+    loads = db.query_count("treatments")
+    for _ in range(50):
+        assert treatment_catalog.get_treatment("c1", "bogus") is None
+        assert treatment_catalog.get_treatment("c1", "c2-t0") is None
+    assert db.query_count("treatments") == loads
+    assert treatment_catalog.get_treatment("c1", "c1-t0")["id"] == "c1-t0"
+
+
+def test_listed_treatments_are_copies_of_the_cache(db):
+    db.seed("treatments", harness.treatment_rows("c1"))
+    client = TestClient(app.main.fastapi_app)
+    listed = client.get("/api/treatments", params={"clinic_id": "c1"}).json()["treatments"]
+    assert [t["id"] for t in listed] == [t["id"] for t in harness.treatment_rows("c1")]
+
+    rows = treatments_router.list_treatments("c1")["treatments"]
+    rows[0]["duration_minutes"] = 0
+    assert treatment_catalog.get_treatment("c1", rows[0]["id"])["duration_minutes"] != 0
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+from tests import harness  # noqa: F401  (environment + sys.path)
+from app.services import webhook_queue as wq
+from app.services.webhook_queue import SqliteQueueStore, WebhookQueue
+
+SAMPLE = os.path.join(harness.BACKEND_DIR, "sample_payload.json")
+
+
+def _store(tmp_path) -> SqliteQueueStore:
+    return SqliteQueueStore(str(tmp_path / "queue.sqlite3"))
+
+
+def test_items_are_processed_and_acked(tmp_path):
+    store = _store(tmp_path)
+    seen = []
+
+    async def scenario():
+        queue = WebhookQueue("test", seen.append, store, workers=3)
+        queue.start()
+        for i in range(20):
+            await queue.enqueue({"n": i})
+        await queue.join()
+        stats = queue.stats()
+        await queue.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert sorted(item["n"] for item in seen) == list(range(20))
+    assert store.count() == 0
+    assert stats["processed"] == 20 and stats["depth"] == 0 and stats["in_flight"] == 0
+    assert stats["wait_ms"]["max"] >= stats["wait_ms"]["p50"] >= 0
+
+
+def test_pending_items_survive_a_restart(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+
+    async def enqueue_without_workers():
+        queue = WebhookQueue("test", lambda _: None, SqliteQueueStore(path))
+        await queue.enqueue({"n": 1})
+        await queue.enqueue({"n": 2})
+
+    asyncio.run(enqueue_without_workers())
+    seen = []
+
+    async def restart():
+        queue = WebhookQueue("test", seen.append, SqliteQueueStore(path), workers=1)
+        queue.start()
+        await queue.join()
+        await queue.stop()
+
+    asyncio.run(restart())
+    assert seen == [{"n": 1}, {"n": 2}]
+    assert SqliteQueueStore(path).count() == 0
+
+
+def test_failing_items_are_retried_then_parked(tmp_path, monkeypatch):
+    monkeypatch.setattr(wq, "WEBHOOK_RETRY_BASE_SECONDS", 0.01)
+    store = _store(tmp_path)
+    calls = []
+
+    def handler(payload):
+        calls.append(payload)
+        raise RuntimeError("openai timeout")
+
+    async def scenario():
+        queue = WebhookQueue("test", handler, store, workers=1, max_attempts=3)
+        queue.start()
+        await queue.enqueue({"n": 1})
+        deadline = time.time() + 2
+        while queue.stats()["failed"] == 0 and time.time() < deadline:
+            await asyncio.sleep(0.01)
+        stats = queue.stats()
+        await queue.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert len(calls) == 3
+    assert (stats["retried"], stats["failed"]) == (2, 1)
+    assert store.count("failed") == 1 and store.count() == 0
+
+
+def test_webhook_acks_before_processing(db, monkeypatch):
+    from fastapi.testclient import TestClient
+    import app.main
+    from app.services import whatsapp_inbound
+
+    processed = []
+    monkeypatch.setattr(whatsapp_inbound.webhook_queue, "handler", processed.append)
+    with open(SAMPLE) as fh:
+        payload = json.load(fh)
+    with TestClient(app.main.app) as client:
+        assert client.post("/whatsapp/webhook", json={"object": "x"}).status_code == 400
+        response = client.post("/whatsapp/webhook", json=payload)
+        assert response.json() == {"ok": True}
+        deadline = time.time() + 2
+        while not processed and time.time() < deadline:
+            time.sleep(0.01)
+    assert processed == [payload]
+
+
+def test_same_key_runs_in_order_while_keys_run_in_parallel(tmp_path):
+    store = _store(tmp_path)
+    lock = threading.Lock()
+    running = {}
+    seen = []
+    peak = []
+
+    def handler(payload):
+        with lock:
+            assert payload["k"] not in running, "two items of one conversation overlapped"
+            running[payload["k"]] = payload["n"]
+            peak.append(len(running))
+        time.sleep(0.005)
+        with lock:
+            del running[payload["k"]]
+            seen.append((payload["k"], payload["n"]))
+
+    async def scenario():
+        queue = WebhookQueue("test", handler, store, workers=8, key_fn=lambda p: p["k"])
+        queue.start()
+        for n in range(10):
+            for k in ("a", "b", "c", "d"):
+                await queue.enqueue({"k": k, "n": n})
+        await queue.join()
+        stats = queue.stats()
+        await queue.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    for k in ("a", "b", "c", "d"):
+        assert [n for key, n in seen if key == k] == list(range(10))
+    assert max(peak) > 1
+    assert stats["processed"] == 40 and stats["conversations"] == {"active_keys": 0, "waiting": 0}
+
+
+def test_a_retried_item_keeps_its_conversation_blocked(tmp_path, monkeypatch):
+    monkeypatch.setattr(wq, "WEBHOOK_RETRY_BASE_SECONDS", 0.02)
+    store = _store(tmp_path)
+    seen = []
+    failures = []
+
+    def handler(payload):
+        if payload["n"] == 0 and not failures:
+            failures.append(payload)
+            raise RuntimeError("graph api 500")
+        seen.append((payload["k"], payload["n"]))
+
+    async def scenario():
+        queue = WebhookQueue("test", handler, store, workers=4, key_fn=lambda p: p["k"])
+        queue.start()
+        for n in range(3):
+            await queue.enqueue({"k": "a", "n": n})
+        await queue.enqueue({"k": "b", "n": 9})
+        await queue.join()
+        await queue.stop()
+
+    asyncio.run(scenario())
+    # "b" did not wait for the retry; "a" resumed in order after it
+    assert seen == [("b", 9), ("a", 0), ("a", 1), ("a", 2)]
+    assert store.count() == 0
@@ -0,0 +1,85 @@
+from tests import harness  # noqa: F401  (environment + sys.path)
+from app.services import alerts_dispatcher, whatsapp_accounts, whatsapp_inbound
+
+ACCOUNTS = [
+    {"id": "a1", "clinic_id": "c1", "phone_number_id": "pn-1", "access_token": "tok-1", "enabled": True},
+    {"id": "a2", "clinic_id": "c2", "phone_number_id": "pn-2", "access_token": "tok-2", "enabled": True},
+    {"id": "a3", "clinic_id": "c3", "phone_number_id": "pn-3", "access_token": "tok-3", "enabled": False},
+]
+
+
+def _value(phone_number_id: str, wa_id: str, sender: str, body: str) -> dict:
+    return {
+        "metadata": {"phone_number_id": phone_number_id, "display_phone_number": "5491100000000"},
+        "messages": [{"id": wa_id, "from": sender, "type": "text", "text": {"body": body}}],
+    }
+
+
+def _delivery(*values: dict) -> dict:
+    return {"entry": [{"id": "waba", "changes": [{"field": "messages", "value": v} for v in values]}]}
+
+
+def _bot_clinics(db) -> None:
+    db.seed(
+        "clinic_settings",
+        [
+            harness.clinic_settings(clinic_id, bot_enabled=True, auto_reply_enabled=True)
+            for clinic_id in ("c1", "c2")
+        ],
+    )
+
+
+def test_each_change_routes_to_the_clinic_of_its_number_without_queries(db, monkeypatch):
+    _bot_clinics(db)
+    db.seed("whatsapp_accounts", ACCOUNTS)
+    sent = []
+    monkeypatch.setattr(whatsapp_inbound, "build_ai_reply", lambda clinic_id, text, *args: f"{clinic_id}:{text}")
+    monkeypatch.setattr(
+        whatsapp_inbound, "send_whatsapp", lambda target, body, **kwargs: sent.append((target, body, kwargs))
+    )
+    whatsapp_accounts.get_account_index()
+
+    whatsapp_inbound.process_webhook(
+        _delivery(_value("pn-1", "wamid.1", "5491100000001", "hola"), _value("pn-2", "wamid.2", "5491100000002", "hi"))
+    )
+
+    assert db.query_count("whatsapp_accounts") == 1
+    assert db.query_count("clinic_settings") == 2  # settings of c1 and c2, no fallback lookup
+    assert {m["wa_message_id"]: m["clinic_id"] for m in db.tables["messages"]} == {"wamid.1": "c1", "wamid.2": "c2"}
+    assert sent == [
+        ("5491100000001", "c1:hola", {"phone_number_id": "pn-1", "token": "tok-1"}),
+        ("5491100000002", "c2:hi", {"phone_number_id": "pn-2", "token": "tok-2"}),
+    ]
+
+
+def test_unknown_number_refreshes_once_then_falls_back(db, monkeypatch):
+    monkeypatch.setenv("DEFAULT_CLINIC_ID", "c-default")
+    db.seed("whatsapp_accounts", ACCOUNTS[:1])
+    assert whatsapp_accounts.resolve_clinic_id("pn-1") == "c1"
+
+    # Added by another process: the first miss reloads the index
+    db.seed("whatsapp_accounts", ACCOUNTS[1:2])
+    assert whatsapp_accounts.resolve_clinic_id("pn-2") == "c2"
+
+    loads = db.query_count("whatsapp_accounts")
+    for _ in range(50):
+        assert whatsapp_accounts.resolve_clinic_id("pn-unknown") == "c-default"
+        assert whatsapp_accounts.resolve_clinic_id("pn-3") == "c-default"  # disabled
+    assert db.query_count("whatsapp_accounts") == loads
+    assert whatsapp_accounts.resolve_clinic_id(None, "c-payload") == "c-payload"
+
+
+def test_alerts_and_replies_without_account_use_env_credentials(db, monkeypatch):
+    db.seed("whatsapp_accounts", ACCOUNTS)
+    assert whatsapp_accounts.sender_credentials("c9") == {}
+    # A number that belongs to another clinic never sends for this one
+    assert whatsapp_accounts.sender_credentials("c1", "pn-2") == {"phone_number_id": "pn-1", "token": "tok-1"}
+
+    db.seed(
+        "alert_rules",
+        [{"id": "r1", "clinic_id": "c2", "event_type": "x", "channel": "whatsapp", "target": "549", "enabled": True}],
+    )
+    sent = []
+    monkeypatch.setattr(alerts_dispatcher, "send_whatsapp", lambda *args, **kwargs: sent.append(kwargs) or (True, ""))
+    alerts_dispatcher.dispatch_alerts("x", {}, clinic_id="c2")
+    assert sent == [{"phone_number_id": "pn-2", "token": "tok-2"}]
@@ -0,0 +1,164 @@
+import pytest
+
+from tests import harness  # noqa: F401  (environment + sys.path)
+from app.services import whatsapp_inbound
+
+
+def _message(wa_id: str, sender: str, body: str) -> dict:
+    return {"id": wa_id, "from": sender, "timestamp": "1732468900", "type": "text", "text": {"body": body}}
+
+
+def _delivery(*values: dict) -> dict:
+    return {
+        "object": "whatsapp_business_account",
+        "clinic_id": "c1",
+        "entry": [{"id": "waba", "changes": [{"field": "messages", "value": v} for v in values]}],
+    }
+
+
+def test_every_entry_change_and_message_is_stored_with_one_insert(db):
+    db.seed("message_threads", [{"id": "t-known", "clinic_id": "c1", "contact_number": "5491100000001"}])
+    first = {
+        "contacts": [{"wa_id": "5491100000001", "profile": {"name": "Ana"}}],
+        "messages": [_message("wamid.1", "5491100000001", "hola"), _message("wamid.2", "5491100000001", "turno?")],
+    }
+    second = {
+        "contacts": [{"wa_id": "5491100000002", "profile": {"name": "Beto"}}],
+        "messages": [
+            _message("wamid.3", "5491100000002", "buen dia"),
+            {"id": "wamid.4", "from": "5491100000002", "type": "image", "image": {"id": "m1"}},
+        ],
+    }
+    payload = _delivery(first)
+    payload["entry"].append(_delivery(second)["entry"][0])
+
+    whatsapp_inbound.process_webhook(payload)
+
+    stored = db.tables["messages"]
+    assert [m["wa_message_id"] for m in stored] == ["wamid.1", "wamid.2", "wamid.3", "wamid.4"]
+    assert stored[3]["body"] == "[image]"
+    assert db.calls[("messages", "upsert")] == 1
+    assert db.calls[("message_threads", "insert")] == 1
+    threads = {t["contact_number"]: t for t in db.tables["message_threads"]}
+    assert stored[0]["thread_id"] == "t-known"
+    assert stored[2]["thread_id"] == threads["5491100000002"]["id"]
+    assert threads["5491100000002"]["contact_name"] == "Beto"
+
+
+def test_status_only_changes_update_messages_without_message_work(db):
+    db.seed(
+        "messages",
+        [
+            {"id": "m1", "clinic_id": "c1", "wa_message_id": "wamid.out1", "status": "sent"},
+            {"id": "m2", "clinic_id": "c1", "wa_message_id": "wamid.out2", "status": "sent"},
+        ],
+    )
+    statuses = [
+        {"id": "wamid.out1", "status": "delivered"},
+        {"id": "wamid.out1", "status": "read"},
+        {"id": "wamid.out1", "status": "delivered"},
+        {"id": "wamid.out2", "status": "failed"},
+    ]
+    whatsapp_inbound.process_webhook(_delivery({"statuses": statuses}))
+
+    assert {m["id"]: m["status"] for m in db.tables["messages"]} == {"m1": "read", "m2": "failed"}
+    assert db.query_count("message_threads") == 0
+    assert db.calls[("messages", "upsert")] == 0
+
+
+def test_redelivered_messages_are_dropped_before_db_and_ai(db, monkeypatch):
+    db.seed("clinic_settings", [harness.clinic_settings("c1", bot_enabled=True, auto_reply_enabled=True)])
+    replies = []
+    monkeypatch.setattr(whatsapp_inbound, "build_ai_reply", lambda *args: replies.append(args) or "ok")
+    monkeypatch.setattr(whatsapp_inbound, "send_whatsapp", lambda *args: (True, ""))
+    payload = _delivery({"messages": [_message("wamid.1", "5491100000001", "hola")]})
+
+    whatsapp_inbound.process_webhook(payload)
+    assert len(replies) == 1
+    assert whatsapp_inbound.is_duplicate_delivery(payload)
+
+    queries = db.query_count()
+    whatsapp_inbound.process_webhook(payload)
+    assert db.query_count() == queries
+    assert len(replies) == 1
+
+
+def test_storage_key_catches_duplicates_the_process_did_not_see(db, monkeypatch):
+    db.seed("clinic_settings", [harness.clinic_settings("c1", bot_enabled=True, auto_reply_enabled=True)])
+    replies = []
+    monkeypatch.setattr(whatsapp_inbound, "build_ai_reply", lambda *args: replies.append(args) or "ok")
+    monkeypatch.setattr(whatsapp_inbound, "send_whatsapp", lambda *args: (True, ""))
+    payload = _delivery(
+        {"messages": [_message("wamid.1", "5491100000001", "hola"), _message("wamid.2", "5491100000001", "chau")]}
+    )
+    whatsapp_inbound.process_webhook(payload)
+    # Restart: the in-memory LRU is empty, the unique wa_message_id is not
+    whatsapp_inbound._seen_messages.invalidate()
+    payload["entry"][0]["changes"][0]["value"]["messages"].append(_message("wamid.3", "5491100000001", "?"))
+    whatsapp_inbound.process_webhook(payload)
+
+    assert [m["wa_message_id"] for m in db.tables["messages"]] == ["wamid.1", "wamid.2", "wamid.3"]
+    assert [args[1] for args in replies] == ["hola", "chau", "?"]
+
+
+def test_deliveries_are_split_into_one_ordered_item_per_conversation():
+    first = {
+        "metadata": {"phone_number_id": "pn-1"},
+        "contacts": [
+            {"wa_id": "5491100000001", "profile": {"name": "Ana"}},
+            {"wa_id": "5491100000002", "profile": {"name": "Beto"}},
+        ],
+        "messages": [
+            _message("wamid.1", "5491100000001", "hola"),
+            _message("wamid.2", "5491100000002", "buenas"),
+            _message("wamid.3", "5491100000001", "turno?"),
+        ],
+        "statuses": [{"id": "wamid.out1", "status": "read"}],
+    }
+    payload = _delivery(first)
+    parts = whatsapp_inbound.split_by_conversation(payload)
+
+    keys = [whatsapp_inbound.conversation_key(part) for part in parts]
+    assert keys == [None, ("pn-1", "5491100000001"), ("pn-1", "5491100000002")]
+    assert all(part["clinic_id"] == "c1" for part in parts)
+    ana = next(whatsapp_inbound.iter_changes(parts[1]))
+    assert [m["id"] for m in ana["messages"]] == ["wamid.1", "wamid.3"]
+    assert [c["profile"]["name"] for c in ana["contacts"]] == ["Ana"]
+    assert next(whatsapp_inbound.iter_changes(parts[0]))["statuses"] == first["statuses"]
+
+    single = _delivery({"messages": [_message("wamid.9", "5491100000009", "hola")]})
+    assert whatsapp_inbound.split_by_conversation(single) == [single]
+    assert whatsapp_inbound.conversation_key(single) == ("c1", "5491100000009")
+
+
+def test_a_failed_reply_is_sent_when_the_batch_is_retried(db, monkeypatch):
+    db.seed("clinic_settings", [harness.clinic_settings("c1", bot_enabled=True, auto_reply_enabled=True)])
+    sent = []
+    failing = {"chau"}
+
+    def build_ai_reply(clinic_id, text, *args):
+        if text in failing:
+            raise RuntimeError("AI unavailable")
+        return f"re: {text}"
+
+    monkeypatch.setattr(whatsapp_inbound, "build_ai_reply", build_ai_reply)
+    monkeypatch.setattr(whatsapp_inbound, "send_whatsapp", lambda target, body, **kwargs: sent.append(body))
+    payload = _delivery(
+        {"messages": [_message("wamid.1", "5491100000001", "hola"), _message("wamid.2", "5491100000001", "chau")]}
+    )
+
+    with pytest.raises(RuntimeError):
+        whatsapp_inbound.process_webhook(payload)
+    assert sent == ["re: hola"]
+    assert not whatsapp_inbound.is_duplicate_delivery(payload)
+
+    # The queue retries the whole item: only the unanswered message goes back to the AI
+    failing.clear()
+    whatsapp_inbound.process_webhook(payload)
+    assert sent == ["re: hola", "re: chau"]
+    assert len(db.tables["messages"]) == 2
+    assert whatsapp_inbound.is_duplicate_delivery(payload)
+
+    whatsapp_inbound._seen_messages.invalidate()
+    whatsapp_inbound.process_webhook(payload)
+    assert sent == ["re: hola", "re: chau"]